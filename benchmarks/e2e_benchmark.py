@@ -0,0 +1,402 @@
+# e2e_benchmark.py
+# Benchmark de extremo a extremo de los bots sin red: mensajes sintéticos recorren el mismo código
+# que en producción (cola de trabajo, normalización, caché de veredictos, cliente de la API de
+# Phishing, agente LangGraph y envío por streaming) contra sustitutos locales:
+#   - Una API de Phishing falsa (aiohttp en 127.0.0.1) con latencia configurable e inyección de 401.
+#   - Un ChatOpenAI falso que emite tokens a un ritmo fijo (se sustituye en langgraph.agente_impersonador).
+#   - Eventos de Telegram y mensajes de Discord sintéticos que entran por TelegramSession.on_new_message
+#     y por on_message de bots/discordbot.py.
+# Por cada nivel de concurrencia (usuarios simultáneos, cada uno envía un mensaje y espera a que se
+# procese antes del siguiente) informa de mensajes/s, latencias p50/p95/p99 y memoria RSS.
+#
+# Uso:
+#   python benchmarks/e2e_benchmark.py                               # ambas plataformas, niveles 1,4,16,64
+#   python benchmarks/e2e_benchmark.py --platform telegram -c 1 8 32 --messages 400
+#   python benchmarks/e2e_benchmark.py --api-latency 0.2 --unauthorized-rate 0.05 --tokens-per-second 100
+#   python benchmarks/e2e_benchmark.py --json
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import functools
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import psutil
+from aiohttp import web
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOTS_DIR = os.path.join(PROJECT_ROOT, "bots")
+# Mismo orden que los bots: bots/ primero (telegram.py) y después la raíz del proyecto
+sys.path[:0] = [BOTS_DIR, PROJECT_ROOT]
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from botengine.session_metrics import percentile
+
+PLATFORMS = ("telegram", "discord")
+
+
+# --- API de Phishing falsa ---
+
+class FakePhishingApi:
+    """Servidor local con los endpoints de token y análisis que usa PhishingApiClient."""
+
+    def __init__(self, latency: float, jitter: float, unauthorized_rate: float, phishing_rate: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.unauthorized_rate = unauthorized_rate
+        self.phishing_rate = phishing_rate
+        self.tokens_issued = 0
+        self.samples = 0
+        self.unauthorized = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    async def token(self, request: web.Request) -> web.Response:
+        self.tokens_issued += 1
+        return web.json_response({"access": f"benchmark-{self.tokens_issued}"})
+
+    async def analyze(self, request: web.Request) -> web.Response:
+        # Cuerpo completo (JSON o multipart) como en la API real
+        await request.read()
+        if random.random() < self.unauthorized_rate:
+            # Token "caducado": el cliente debe regenerarlo y reenviar la muestra
+            self.unauthorized += 1
+            return web.json_response({"detail": "token expirado"}, status=401)
+        self.samples += 1
+        await asyncio.sleep(max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+        is_phishing = random.random() < self.phishing_rate
+        response = {"analysis_results": {"is_phishing": is_phishing}, "bot_responses": {}}
+        if is_phishing:
+            response["bot_responses"]["technical_response"] = {"text": "Posible suplantación detectada."}
+        return web.json_response(response)
+
+    async def start(self) -> None:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/token", self.token)
+        app.router.add_post("/analyze", self.analyze)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+# --- ChatOpenAI falso ---
+
+class FakeChatOpenAI(BaseChatModel):
+    """Modelo de chat que responde `reply_tokens` tokens a `tokens_per_second`, en streaming o completo."""
+
+    model: str = "fake"
+    api_key: Any = None
+    temperature: float = 0.0
+    tokens_per_second: float = 50.0
+    reply_tokens: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-openai"
+
+    def _tokens(self) -> List[str]:
+        return [f"tok{i} " for i in range(self.reply_tokens)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.reply_tokens / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._tokens())))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        for token in self._tokens():
+            await asyncio.sleep(1.0 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = "".join([chunk.message.content async for chunk in self._astream(messages, stop, run_manager)])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+# --- Mensajes sintéticos ---
+
+class Obj:
+    """Objeto con atributos arbitrarios para imitar las entidades de Telethon y discord.py."""
+
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+class SentMessage:
+    """Mensaje enviado por el bot; las ediciones del streaming se cuentan pero no salen a la red."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.edits = 0
+
+    async def edit(self, text: Optional[str] = None, content: Optional[str] = None):
+        self.edits += 1
+        self.text = content if content is not None else text
+        return self
+
+
+async def send_message(text: str) -> SentMessage:
+    return SentMessage(text)
+
+
+def telegram_event(message_id: int, user: int, text: str, done: asyncio.Future) -> Obj:
+    """Mensaje privado de Telegram con lo que leen TelegramSession y normalize_telegram."""
+    sender = Obj(id=1000 + user, first_name=f"Usuario{user}", last_name=None, username=f"usuario{user}", bot=False)
+    return Obj(
+        id=message_id, sender_id=sender.id, sender=sender, chat_id=sender.id, chat=sender, is_private=True,
+        raw_text=text, date=datetime.now(timezone.utc), media=None, file=None, forward=None, is_reply=False,
+        mentioned=False, reply=send_message, get_entities_text=lambda: [], done=done,
+    )
+
+
+def discord_message(message_id: int, user: int, text: str, done: asyncio.Future, guilds: int) -> Obj:
+    """Mensaje de Discord en un canal de servidor (repartidos entre `guilds` servidores)."""
+    guild = Obj(id=500 + user % guilds, name=f"servidor{user % guilds}")
+    channel = Obj(id=9000 + user, name=f"canal{user}", send=send_message)
+    author = Obj(id=1000 + user, name=f"usuario{user}", display_name=f"Usuario{user}", bot=False)
+    return Obj(
+        id=message_id, guild=guild, channel=channel, author=author, content=text, attachments=[], mentions=[],
+        created_at=datetime.now(timezone.utc), flags=Obj(forwarded=False), reference=None, done=done,
+    )
+
+
+def tracked(process):
+    """Envuelve el procesado de la cola para marcar el fin de cada mensaje sintético."""
+    @functools.wraps(process)
+    async def wrapper(item):
+        try:
+            await process(item)
+        finally:
+            if not item.done.done():
+                item.done.set_result(time.perf_counter())
+    return wrapper
+
+
+# --- Plataformas ---
+
+class TelegramTarget:
+    """Una TelegramSession real sin conexión: los eventos entran por on_new_message."""
+
+    name = "telegram"
+
+    async def setup(self, data_path: str) -> None:
+        import telegram
+        self.shared = telegram.TelegramShared(os.path.join(data_path, "agent_memory_telegram.sqlite"))
+        self.session = telegram.TelegramSession("benchmark", "+000", 1, "benchmark", self.shared)
+        self.session.me = Obj(id=1, username="botengine", first_name="BotEngine")
+        self.session.work_queue = telegram.ChatWorkQueue.from_env(
+            tracked(self.session.handle_message), prefix="TELEGRAM", name="telegram-benchmark"
+        )
+        self.session.work_queue.start()
+        await self.shared.phishing_client.generate_token()
+        await self.shared.agent.get()
+
+    def message(self, message_id: int, user: int, text: str, done: asyncio.Future) -> Obj:
+        return telegram_event(message_id, user, text, done)
+
+    async def submit(self, item: Obj) -> None:
+        await self.session.on_new_message(item)
+
+    async def close(self) -> None:
+        await self.session.work_queue.stop(drain=True, timeout=5)
+        if self.session.client.session is not None:
+            self.session.client.session.close()
+        await self.shared.close()
+
+
+class DiscordTarget:
+    """bots/discordbot.py importado sin conectar: los mensajes entran por on_message."""
+
+    name = "discord"
+
+    def __init__(self, guilds: int):
+        self.guilds = guilds
+
+    async def setup(self, data_path: str) -> None:
+        import discordbot
+        self.bot = discordbot
+        # Misma cola por servidor que en producción, con el marcador de fin de cada mensaje
+        discordbot.guild_queues = discordbot.GuildQueues(tracked(discordbot.process_message))
+        await discordbot.phishing_client.generate_token()
+        await discordbot.agent_loader.get()
+
+    def message(self, message_id: int, user: int, text: str, done: asyncio.Future) -> Obj:
+        return discord_message(message_id, user, text, done, self.guilds)
+
+    async def submit(self, item: Obj) -> None:
+        await self.bot.on_message(item)
+
+    async def close(self) -> None:
+        for queue in self.bot.guild_queues.queues.values():
+            await queue.stop(drain=True, timeout=5)
+        await self.bot.phishing_client.close()
+        self.bot.verdict_cache.close()
+        checkpointer = self.bot.agent_loader.checkpointer
+        if hasattr(checkpointer, "close"):
+            checkpointer.close()
+
+
+# --- Medida ---
+
+class RssSampler:
+    """Muestrea la memoria RSS del proceso mientras dura un nivel."""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self.peak = self.process.memory_info().rss
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> int:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return self.process.memory_info().rss
+
+
+async def run_level(target, concurrency: int, messages: int, first_id: int) -> Dict[str, Any]:
+    """`concurrency` usuarios envían mensajes de uno en uno hasta completar `messages`."""
+    loop = asyncio.get_running_loop()
+    latencies: List[float] = []
+    counter = iter(range(messages))
+
+    async def user(index: int) -> None:
+        for n in counter:
+            done = loop.create_future()
+            # Texto único: cada mensaje pasa por la API (sin aciertos de la caché de veredictos)
+            item = target.message(first_id + n, index, f"Mensaje {first_id + n} del usuario {index}", done)
+            started = time.perf_counter()
+            await target.submit(item)
+            latencies.append(await done - started)
+
+    rss = RssSampler()
+    rss.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    rss_end = await rss.stop()
+    return {
+        "platform": target.name,
+        "concurrency": concurrency,
+        "messages": len(latencies),
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "rss_mb": round(rss_end / 1e6, 1),
+        "rss_peak_mb": round(rss.peak / 1e6, 1),
+    }
+
+
+def configure_env(data_path: str, api: FakePhishingApi) -> None:
+    """Entorno mínimo para construir los bots sin credenciales reales."""
+    os.environ.update({
+        "DATA_PATH": data_path,
+        "OPENAI_API_KEY": "sk-benchmark",
+        "DISCORD_TOKEN": "benchmark",
+        "PHISHING_API_USER": "benchmark",
+        "PHISHING_API_PASSWORD": "benchmark",
+        "TOKEN_URL": f"{api.base_url}/token",
+        "PHISHING_API_URL": f"{api.base_url}/analyze",
+        "SESSION_METRICS_INTERVAL": "0",
+        "STREAM_EDIT_INTERVAL": os.environ.get("STREAM_EDIT_INTERVAL", "0.2"),
+    })
+    # Registro mínimo para no medir la escritura en consola
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+def install_fake_llm(tokens_per_second: float, reply_tokens: int) -> None:
+    import langgraph.agente_impersonador as agente
+    agente.ChatOpenAI = functools.partial(FakeChatOpenAI, tokens_per_second=tokens_per_second, reply_tokens=reply_tokens)
+
+
+async def run(args) -> Dict[str, Any]:
+    api = FakePhishingApi(args.api_latency, args.api_jitter, args.unauthorized_rate, args.phishing_rate)
+    await api.start()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="botengine-benchmark-") as data_path:
+        configure_env(data_path, api)
+        install_fake_llm(args.tokens_per_second, args.reply_tokens)
+        targets = {"telegram": TelegramTarget(), "discord": DiscordTarget(args.guilds)}
+        next_id = 1
+        for platform in (PLATFORMS if args.platform == "all" else (args.platform,)):
+            target = targets[platform]
+            await target.setup(data_path)
+            try:
+                for concurrency in args.concurrency:
+                    results.append(await run_level(target, concurrency, args.messages, next_id))
+                    next_id += args.messages
+            finally:
+                await target.close()
+    await api.close()
+    return {
+        "levels": results,
+        "api": {"tokens": api.tokens_issued, "samples": api.samples, "unauthorized": api.unauthorized},
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+    }
+
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value * 1000:.0f}" if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo de BotEngine sin red")
+    parser.add_argument("--platform", choices=PLATFORMS + ("all",), default="all")
+    parser.add_argument("-c", "--concurrency", type=int, nargs="+", default=[1, 4, 16, 64], help="usuarios simultáneos por nivel")
+    parser.add_argument("--messages", type=int, default=200, help="mensajes por nivel")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="latencia media de la API de Phishing (s)")
+    parser.add_argument("--api-jitter", type=float, default=0.02, help="variación de la latencia (s)")
+    parser.add_argument("--unauthorized-rate", type=float, default=0.0, help="fracción de análisis que responden 401")
+    parser.add_argument("--phishing-rate", type=float, default=0.1, help="fracción de muestras marcadas como phishing")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="ritmo del LLM falso")
+    parser.add_argument("--reply-tokens", type=int, default=40, help="tokens por respuesta del LLM falso")
+    parser.add_argument("--guilds", type=int, default=4, help="servidores de Discord entre los que se reparten los usuarios")
+    parser.add_argument("--json", action="store_true", help="imprimir los resultados en JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+
+    print(f"{'Plataforma':<10} {'Conc.':>5} {'Msgs':>6} {'Msgs/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MB':>8} {'Pico MB':>8}")
+    for r in report["levels"]:
+        print(
+            f"{r['platform']:<10} {r['concurrency']:>5} {r['messages']:>6} {r['messages_per_second']:>8.1f} "
+            f"{_ms(r['p50']):>8} {_ms(r['p95']):>8} {_ms(r['p99']):>8} {r['rss_mb']:>8.1f} {r['rss_peak_mb']:>8.1f}"
+        )
+    api = report["api"]
+    print(f"\nAPI de Phishing: {api['samples']} muestras, {api['unauthorized']} respuestas 401, {api['tokens']} tokens emitidos")
+
+
+if __name__ == "__main__":
+    main()
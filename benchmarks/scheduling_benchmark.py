@@ -0,0 +1,126 @@
+# scheduling_benchmark.py
+# Coste de planificación por mensaje según la implementación del event loop.
+# Compara el loop de asyncio tal cual, el mismo loop parcheado con nest_asyncio (lo que hacía
+# bots/telegram.py antes) y uvloop. Cada variante se mide en un intérprete nuevo, porque
+# nest_asyncio parchea asyncio para todo el proceso.
+#
+# Cargas medidas:
+#   - queue: mensajes con un procesado vacío a través de ChatWorkQueue (submit, worker, reparto por chat).
+#   - tasks: creación y espera de tareas triviales encadenadas (el paso de tarea que parchea nest_asyncio).
+#
+# Uso:
+#   python benchmarks/scheduling_benchmark.py                     # tabla resumen
+#   python benchmarks/scheduling_benchmark.py --messages 50000 --chats 64
+#   python benchmarks/scheduling_benchmark.py --json
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VARIANTS = ("asyncio", "nest_asyncio", "uvloop")
+
+
+async def queue_workload(messages: int, chats: int, workers: int) -> float:
+    """Segundos por mensaje a través de ChatWorkQueue con un procesado vacío."""
+    from botengine.work_queue import ChatWorkQueue, POLICY_DELAY
+    done = asyncio.Event()
+    processed = 0
+
+    async def process(item):
+        nonlocal processed
+        processed += 1
+        if processed == messages:
+            done.set()
+
+    queue = ChatWorkQueue(process, num_workers=workers, max_queue_per_chat=messages, policy=POLICY_DELAY)
+    queue.start()
+    started = time.perf_counter()
+    for n in range(messages):
+        await queue.submit(n % chats, n)
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    await queue.stop(drain=True)
+    return elapsed / messages
+
+
+async def task_workload(messages: int) -> float:
+    """Segundos por tarea creada y esperada."""
+    async def step(n):
+        return n
+
+    started = time.perf_counter()
+    for n in range(messages):
+        await asyncio.ensure_future(step(n))
+    return (time.perf_counter() - started) / messages
+
+
+def child(variant: str, messages: int, chats: int, workers: int, repeat: int) -> dict:
+    """Se ejecuta en el intérprete hijo: prepara la variante y mide ambas cargas."""
+    sys.path.insert(0, PROJECT_ROOT)
+    if variant == "nest_asyncio":
+        import nest_asyncio
+        nest_asyncio.apply()
+    elif variant == "uvloop":
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    async def measure():
+        queue_runs, task_runs = [], []
+        for _ in range(max(1, repeat)):
+            queue_runs.append(await queue_workload(messages, chats, workers))
+            task_runs.append(await task_workload(messages))
+        return sorted(queue_runs)[len(queue_runs) // 2], sorted(task_runs)[len(task_runs) // 2]
+
+    queue_seconds, task_seconds = asyncio.run(measure())
+    return {"variant": variant, "queue_us": queue_seconds * 1e6, "task_us": task_seconds * 1e6}
+
+
+def run_variant(variant: str, args) -> dict:
+    command = [
+        sys.executable, os.path.abspath(__file__), "--child", variant,
+        "--messages", str(args.messages), "--chats", str(args.chats),
+        "--workers", str(args.workers), "--repeat", str(args.repeat),
+    ]
+    result = subprocess.run(command, cwd=PROJECT_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        error = (result.stderr.strip().splitlines() or ["error desconocido"])[-1]
+        return {"variant": variant, "error": error}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coste de planificación por mensaje según el event loop")
+    parser.add_argument("--messages", type=int, default=20000, help="mensajes (y tareas) por repetición")
+    parser.add_argument("--chats", type=int, default=32, help="chats entre los que se reparten los mensajes")
+    parser.add_argument("--workers", type=int, default=8, help="workers de la cola")
+    parser.add_argument("--repeat", type=int, default=3, help="repeticiones por variante (se toma la mediana)")
+    parser.add_argument("--json", action="store_true", help="imprimir los resultados en JSON")
+    parser.add_argument("--child", choices=VARIANTS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.child, args.messages, args.chats, args.workers, args.repeat)))
+        return
+
+    results = [run_variant(variant, args) for variant in VARIANTS]
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        return
+
+    baseline = next((r for r in results if r["variant"] == "asyncio" and "error" not in r), None)
+    print(f"{'Event loop':<14} {'Cola (µs/msg)':>14} {'Tarea (µs)':>11} {'vs asyncio':>11}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['variant']:<14} {'no disponible':>14}   {r['error']}")
+            continue
+        ratio = f"{r['queue_us'] / baseline['queue_us']:.2f}x" if baseline else "-"
+        print(f"{r['variant']:<14} {r['queue_us']:>14.2f} {r['task_us']:>11.2f} {ratio:>11}")
+
+
+if __name__ == "__main__":
+    main()
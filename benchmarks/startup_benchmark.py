@@ -0,0 +1,147 @@
+# startup_benchmark.py
+# Benchmark del arranque de los bots: coste de cada importación y de la construcción del agente.
+# Cada medida se toma en un intérprete nuevo (python -X importtime) para no contar módulos ya cargados.
+#
+# Uso:
+#   python benchmarks/startup_benchmark.py            # tabla resumen
+#   python benchmarks/startup_benchmark.py --top 20   # importaciones anidadas más lentas por módulo
+#   python benchmarks/startup_benchmark.py --json     # resultados en JSON
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOTS_DIR = os.path.join(PROJECT_ROOT, "bots")
+
+# Dependencias de los bots y los módulos de entrada, en el orden en que las carga telegram.py
+MODULES = [
+    "telethon",
+    "aiohttp",
+    "discord",
+    "langchain_core",
+    "langchain_openai",
+    "langgraph.graph",
+    "langgraph.agente_impersonador",
+    "botengine.phishing_api",
+    "telegram",  # bots/telegram.py (sin langchain/langgraph: se cargan en segundo plano)
+]
+
+# Entorno mínimo para importar los bots y construir el agente sin credenciales reales
+# (DATA_PATH apunta a un directorio temporal que se borra al terminar)
+FAKE_ENV = {
+    "OPENAI_API_KEY": "sk-benchmark",
+    "AGENT_CHECKPOINT_FLUSH_INTERVAL": "3600",
+}
+
+
+def _env(data_path):
+    env = os.environ.copy()
+    env.update(FAKE_ENV)
+    env["DATA_PATH"] = data_path
+    # Mismo orden que los bots: bots/ primero (telegram.py) y después la raíz del proyecto
+    env["PYTHONPATH"] = os.pathsep.join([BOTS_DIR, PROJECT_ROOT, env.get("PYTHONPATH", "")])
+    return env
+
+
+def parse_importtime(stderr):
+    """Devuelve [(módulo, self_us, cumulative_us, nivel)] a partir de la salida de -X importtime."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line.split("|", 2)
+        if len(parts) != 3:
+            continue
+        try:
+            self_us = int(parts[0].split(":")[-1].strip())
+            cumulative_us = int(parts[1].strip())
+        except ValueError:
+            continue
+        name = parts[2]
+        # Formato: "import time: self | cumulative | <espacio><2 espacios por nivel>módulo"
+        level = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((name.strip(), self_us, cumulative_us, level))
+    return rows
+
+
+def measure_import(module, data_path):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=_env(data_path), cwd=PROJECT_ROOT, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        error = (result.stderr.strip().splitlines() or ["error desconocido"])[-1]
+        return {"module": module, "error": error, "wall_seconds": wall}
+    rows = parse_importtime(result.stderr)
+    top_level = [r for r in rows if r[0] == module]
+    return {
+        "module": module,
+        "import_seconds": (top_level[-1][2] if top_level else sum(r[1] for r in rows)) / 1e6,
+        "wall_seconds": wall,
+        "modules_loaded": len(rows),
+        "slowest": sorted(((name, cum / 1e6) for name, _, cum, _ in rows if name != module), key=lambda x: -x[1]),
+    }
+
+
+def measure_agent_build(data_path):
+    """Construcción completa del agente (importaciones incluidas) en un intérprete nuevo."""
+    code = (
+        "import time; t = time.perf_counter();"
+        "from langgraph.agente_impersonador import create_langgraph_agent;"
+        "i = time.perf_counter();"
+        "create_langgraph_agent();"
+        "print(i - t, time.perf_counter() - i)"
+    )
+    result = subprocess.run([sys.executable, "-c", code], env=_env(data_path), cwd=PROJECT_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        error = (result.stderr.strip().splitlines() or ["error desconocido"])[-1]
+        return {"error": error}
+    imports, build = (float(x) for x in result.stdout.strip().splitlines()[-1].split())
+    return {"import_seconds": imports, "build_seconds": build}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de arranque de los bots de BotEngine")
+    parser.add_argument("--top", type=int, default=0, help="mostrar las N importaciones anidadas más lentas")
+    parser.add_argument("--json", action="store_true", help="imprimir los resultados en JSON")
+    parser.add_argument("--repeat", type=int, default=3, help="repeticiones por módulo (se toma la mediana)")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="botengine-startup-") as data_path:
+        for module in MODULES:
+            runs = [measure_import(module, data_path) for _ in range(max(1, args.repeat))]
+            ok = [r for r in runs if "error" not in r]
+            if not ok:
+                results.append(runs[0])
+                continue
+            ok.sort(key=lambda r: r["import_seconds"])
+            results.append(ok[len(ok) // 2])
+        agent = measure_agent_build(data_path)
+
+    if args.json:
+        print(json.dumps({"imports": results, "agent": agent}, indent=2, ensure_ascii=False))
+        return
+
+    print(f"{'Módulo':<34} {'Import (s)':>10} {'Proceso (s)':>12} {'Módulos':>8}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['module']:<34} {'error':>10}   {r['error']}")
+            continue
+        print(f"{r['module']:<34} {r['import_seconds']:>10.3f} {r['wall_seconds']:>12.3f} {r['modules_loaded']:>8}")
+        for name, seconds in r["slowest"][:args.top]:
+            print(f"    {name:<30} {seconds:>10.3f}")
+    if "error" in agent:
+        print(f"\nAgente: error {agent['error']}")
+    else:
+        print(f"\nAgente: importación {agent['import_seconds']:.3f}s + construcción {agent['build_seconds']:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
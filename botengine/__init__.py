@@ -0,0 +1,2 @@
+# botengine
+# Componentes compartidos por los bots (Telegram, Discord) y el panel de control.
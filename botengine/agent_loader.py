@@ -0,0 +1,58 @@
+# agent_loader.py
+# Construcción diferida del agente LangGraph.
+# langchain/langgraph son las dependencias más pesadas de los bots: se importan y el grafo se
+# compila una sola vez, en un hilo aparte, mientras el bot se conecta y autentica.
+import time
+import asyncio
+import logging
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class AgentLoader:
+    """Carga el agente en segundo plano y lo entrega a quien lo espere."""
+
+    def __init__(self, checkpoint_path: Optional[str] = None):
+        self.checkpoint_path = checkpoint_path
+        self.build_seconds: Optional[float] = None
+        self._future: Optional[asyncio.Future] = None
+        self._agent: Optional[Tuple[Any, Any]] = None
+
+    def _build(self) -> Tuple[Any, Any]:
+        started = time.monotonic()
+        # Importación diferida: es la parte más lenta del arranque
+        from langgraph.agente_impersonador import create_langgraph_agent
+        logger.info("Creando agente LangGraph...")
+        agent = create_langgraph_agent(checkpoint_path=self.checkpoint_path)
+        self.build_seconds = time.monotonic() - started
+        logger.info(f"Agente LangGraph creado en {self.build_seconds:.2f}s.")
+        return agent
+
+    def start(self) -> "AgentLoader":
+        """Lanza la construcción si no está en marcha. Debe llamarse desde el event loop."""
+        if self._future is None:
+            self._future = asyncio.get_running_loop().run_in_executor(None, self._build)
+        return self
+
+    async def get(self) -> Tuple[Any, Any]:
+        """Devuelve (grafo compilado, checkpointer), esperando a que termine la construcción."""
+        if self._agent is None:
+            self._agent = await self.start()._future
+        return self._agent
+
+    async def graph(self) -> Any:
+        return (await self.get())[0]
+
+    @property
+    def ready(self) -> bool:
+        return self._agent is not None or (self._future is not None and self._future.done() and not self._future.exception())
+
+    @property
+    def checkpointer(self) -> Any:
+        """Checkpointer si el agente ya está construido, o None."""
+        if self._agent is not None:
+            return self._agent[1]
+        if self._future is not None and self._future.done() and not self._future.exception():
+            return self._future.result()[1]
+        return None
@@ -0,0 +1,73 @@
+# discord_adapter.py
+# Adaptador de Discord (discord.py) al registro común de botengine/messages.py.
+# Los adjuntos se descargan de la CDN con el pool HTTP compartido: en memoria si son pequeños o
+# canalizados por bloques directamente a la subida multipart de la API de Phishing.
+import os
+from datetime import datetime
+
+from botengine.messages import (
+    AttachmentRef, NormalizedMessage, CHAT_GROUP, CHAT_PRIVATE, media_type_from_mime
+)
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _attachment(attachment, message, http_session, temp_dir: str) -> AttachmentRef:
+    mime_type = attachment.content_type
+
+    async def stream():
+        async with http_session.get(attachment.url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                yield chunk
+
+    async def download_to_file():
+        # Solo para archivos por encima de MEDIA_TEMP_FILE_MIN_BYTES
+        os.makedirs(temp_dir, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(temp_dir, f"discord_{message.id}_{attachment.id}_{timestamp}")
+        await attachment.save(path)
+        return path
+
+    return AttachmentRef(
+        type=media_type_from_mime(mime_type),
+        filename=attachment.filename,
+        size=attachment.size,
+        mime_type=mime_type,
+        download_bytes=attachment.read,
+        stream_factory=stream,
+        download_to_file=download_to_file,
+        # Discord no expone un identificador del contenido (el ID es único por subida): la misma
+        # imagen publicada en otro canal o servidor se reconoce por el hash de sus bytes. Los adjuntos
+        # por encima de MEDIA_SPOOL_MAX_BYTES no se descargan antes de tiempo y no se cachean.
+        hash_content=True,
+    )
+
+
+def normalize_discord(message, bot_user, http_session, temp_dir: str) -> NormalizedMessage:
+    """Registro común a partir de un discord.Message."""
+    guild = message.guild
+    attachments = [_attachment(a, message, http_session, temp_dir) for a in message.attachments]
+    mentioned = bot_user is not None and any(user.id == bot_user.id for user in message.mentions)
+    return NormalizedMessage(
+        platform="discord",
+        message_id=message.id,
+        chat_id=message.channel.id,
+        chat_type=CHAT_GROUP if guild else CHAT_PRIVATE,
+        chat_title=f"{guild.name} #{getattr(message.channel, 'name', '')}" if guild else None,
+        sender_id=message.author.id,
+        sender_name=message.author.display_name,
+        sender_username=message.author.name,
+        sender_is_bot=message.author.bot,
+        recipient=bot_user.name if bot_user else "DiscordBot",
+        text=message.content,
+        timestamp=message.created_at,
+        message_type=attachments[0].type if attachments else "text",
+        mime_type=attachments[0].mime_type if attachments else None,
+        is_forward=bool(getattr(message.flags, "forwarded", False)),
+        is_reply=message.reference is not None,
+        mentioned=mentioned,
+        # El bot de Discord responde a todos los mensajes, también en servidores
+        should_reply=True,
+        attachments=attachments,
+    )
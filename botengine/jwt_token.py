@@ -0,0 +1,120 @@
+# jwt_token.py
+# Gestor del token JWT de la API de Phishing.
+# Decodifica la expiración del token, lo renueva poco antes de que caduque y garantiza
+# que las peticiones concurrentes compartan una única renovación (single-flight).
+import os
+import json
+import time
+import base64
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def decode_jwt_expiry(token: str) -> Optional[float]:
+    """Devuelve el campo 'exp' (timestamp Unix) del JWT sin verificar la firma, o None."""
+    try:
+        payload_b64 = token.split(".")[1]
+        payload_b64 += "=" * (-len(payload_b64) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(payload_b64))
+        exp = payload.get("exp")
+        return float(exp) if exp is not None else None
+    except (IndexError, ValueError, TypeError, AttributeError):
+        return None
+
+
+class JwtTokenManager:
+    """Mantiene un token JWT válido con renovación proactiva y reintentos acotados."""
+
+    def __init__(
+        self,
+        fetch_token: Callable[[], Awaitable[Optional[str]]],
+        refresh_margin: Optional[float] = None,
+        default_ttl: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        backoff_base: Optional[float] = None,
+        backoff_max: float = 10.0,
+    ):
+        self._fetch_token = fetch_token
+        # Segundos antes de la expiración a partir de los cuales se renueva el token
+        self.refresh_margin = refresh_margin if refresh_margin is not None else float(os.getenv("PHISHING_API_TOKEN_REFRESH_MARGIN", 60))
+        # Vida asumida cuando el token no incluye 'exp'
+        self.default_ttl = default_ttl if default_ttl is not None else float(os.getenv("PHISHING_API_TOKEN_DEFAULT_TTL", 300))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("PHISHING_API_TOKEN_MAX_RETRIES", 3))
+        self.backoff_base = backoff_base if backoff_base is not None else float(os.getenv("PHISHING_API_TOKEN_BACKOFF", 0.5))
+        self.backoff_max = backoff_max
+
+        self.token: Optional[str] = None
+        self.expires_at: float = 0.0
+        self.refresh_count = 0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _is_valid(self, now: float) -> bool:
+        return self.token is not None and now < self.expires_at
+
+    def _needs_refresh(self, now: float) -> bool:
+        return self.token is None or now >= self.expires_at - self.refresh_margin
+
+    async def _refresh(self) -> Optional[str]:
+        for attempt in range(1, self.max_retries + 1):
+            token = await self._fetch_token()
+            if token:
+                exp = decode_jwt_expiry(token)
+                self.token = token
+                self.expires_at = exp if exp is not None else time.time() + self.default_ttl
+                self.refresh_count += 1
+                return token
+            if attempt < self.max_retries:
+                delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+                logger.warning(f"Fallo al obtener token JWT (intento {attempt}/{self.max_retries}). Reintentando en {delay:.1f}s.")
+                await asyncio.sleep(delay)
+        if self._is_valid(time.time()):
+            # Fallo en una renovación proactiva: el token actual sirve hasta que caduque de verdad
+            logger.error(f"No se pudo renovar el token JWT tras {self.max_retries} intentos; se mantiene el actual hasta su expiración.")
+            return self.token
+        logger.error(f"No se pudo obtener un token JWT tras {self.max_retries} intentos.")
+        self.token = None
+        self.expires_at = 0.0
+        return None
+
+    def _start_refresh(self) -> asyncio.Task:
+        # Todas las llamadas concurrentes comparten la misma tarea de renovación
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+            self._refresh_task.add_done_callback(self._log_refresh_error)
+        return self._refresh_task
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Task) -> None:
+        # Las renovaciones en segundo plano no tienen a nadie esperándolas: el error se recoge aquí
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error al renovar el token JWT: {task.exception()}")
+
+    async def refresh(self) -> Optional[str]:
+        """Fuerza una renovación (compartida con otras llamadas en curso)."""
+        return await asyncio.shield(self._start_refresh())
+
+    async def get_token(self) -> Optional[str]:
+        """Devuelve un token válido, renovándolo si está caducado o a punto de caducar."""
+        now = time.time()
+        if not self._needs_refresh(now):
+            return self.token
+        if self._is_valid(now):
+            # Todavía es válido: se renueva en segundo plano sin hacer esperar al llamante
+            self._start_refresh()
+            return self.token
+        return await self.refresh()
+
+    async def invalidate(self, rejected_token: Optional[str]) -> Optional[str]:
+        """Marca como inválido un token rechazado (401) y devuelve uno nuevo.
+
+        Si otra petición ya renovó el token, se reutiliza sin volver a llamar a TOKEN_URL.
+        """
+        if rejected_token is not None and rejected_token != self.token and self._is_valid(time.time()):
+            return self.token
+        if self._refresh_task is None or self._refresh_task.done():
+            self.token = None
+            self.expires_at = 0.0
+        return await self.refresh()
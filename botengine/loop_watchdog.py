@@ -0,0 +1,210 @@
+# loop_watchdog.py
+# Vigilancia del event loop de los bots.
+#   - Un latido en el loop (LOOP_WATCHDOG_INTERVAL) mide el retraso de cada despertar y lo exporta
+#     como histograma de Prometheus (botengine_event_loop_lag_seconds).
+#   - Un hilo aparte comprueba el latido: si el loop lleva más de LOOP_WATCHDOG_THRESHOLD segundos sin
+#     despertar, algo lo está bloqueando y se registra la pila del hilo del loop en ese momento (el
+#     culpable), además de la duración total del bloqueo cuando se recupera.
+#   - Perfilador por muestreo opcional (LOOP_PROFILER=true): muestrea la pila del hilo del loop cada
+#     LOOP_PROFILER_INTERVAL segundos y escribe las pilas agregadas en formato "folded"
+#     (flamegraph.pl, speedscope, inferno) en DATA_PATH/profiles/<nombre>-<pid>.folded.
+# Los hilos solo leen sys._current_frames(): no interrumpen ni ralentizan el loop.
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter
+from typing import Dict, Optional
+
+from botengine.prometheus_metrics import REGISTRY, LAG_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = REGISTRY.histogram("botengine_event_loop_lag_seconds", "Retraso del event loop respecto a lo programado", buckets=LAG_BUCKETS)
+LOOP_STALLS = REGISTRY.counter("botengine_event_loop_stalls_total", "Bloqueos del event loop por encima del umbral")
+LOOP_STALL_SECONDS = REGISTRY.histogram("botengine_event_loop_stall_seconds", "Duración de los bloqueos del event loop", buckets=LAG_BUCKETS)
+
+# Marcos donde el loop está esperando eventos: sus muestras cuentan como inactividad
+IDLE_FUNCTIONS = frozenset(("select", "poll"))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "si", "sí")
+
+
+def profiles_dir(data_path: str) -> str:
+    return os.path.join(data_path, "profiles")
+
+
+def folded_stack(frame) -> str:
+    """Pila de la raíz a la hoja como "func (archivo:línea);..." para el formato folded."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Muestrea la pila de un hilo y acumula las pilas en formato folded."""
+
+    def __init__(self, thread_id: int, path: str, interval: float = 0.01, flush_interval: float = 30.0):
+        self.thread_id = thread_id
+        self.path = path
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.stacks: Dict[str, int] = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        self.samples += 1
+        if frame.f_code.co_name in IDLE_FUNCTIONS:
+            self.idle_samples += 1 # El loop espera en el selector: no hay trabajo que perfilar
+            return
+        self.stacks[folded_stack(frame)] += 1
+
+    def flush(self) -> None:
+        """Reescribe el archivo con todas las pilas acumuladas (escritura atómica)."""
+        if not self.stacks:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        os.replace(tmp_path, self.path)
+
+    def _run(self) -> None:
+        next_flush = time.monotonic() + self.flush_interval
+        while not self._stop.wait(self.interval):
+            self.sample()
+            if time.monotonic() >= next_flush:
+                self._flush_safely()
+                next_flush = time.monotonic() + self.flush_interval
+        self._flush_safely()
+
+    def _flush_safely(self) -> None:
+        try:
+            self.flush()
+        except OSError as e:
+            logger.error(f"No se pudo escribir el perfil {self.path}: {e}")
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="loop-profiler", daemon=True)
+        self._thread.start()
+        logger.info(f"Perfilador del event loop activo: {self.path}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+class LoopWatchdog:
+    """Latido en el event loop más un hilo que detecta bloqueos y registra la pila culpable."""
+
+    def __init__(
+        self,
+        interval: float = 0.25,
+        threshold: float = 0.5,
+        profile_path: Optional[str] = None,
+        profile_interval: float = 0.01,
+        profile_flush_interval: float = 30.0,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.profile_path = profile_path
+        self.profile_interval = profile_interval
+        self.profile_flush_interval = profile_flush_interval
+        self.stalls = 0
+        self.profiler: Optional[SamplingProfiler] = None
+        self._expected_wake = 0.0  # time.monotonic() en que debería despertar el latido
+        self._stall_started: Optional[float] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, data_path: str, name: str) -> "LoopWatchdog":
+        profile_path = None
+        if _env_bool("LOOP_PROFILER", False):
+            profile_path = os.path.join(profiles_dir(data_path), f"{name}-{os.getpid()}.folded")
+        return cls(
+            interval=float(os.getenv("LOOP_WATCHDOG_INTERVAL", 0.25)),
+            threshold=float(os.getenv("LOOP_WATCHDOG_THRESHOLD", 0.5)),
+            profile_path=profile_path,
+            profile_interval=float(os.getenv("LOOP_PROFILER_INTERVAL", 0.01)),
+            profile_flush_interval=float(os.getenv("LOOP_PROFILER_FLUSH", 30)),
+        )
+
+    def _check(self) -> None:
+        now = time.monotonic()
+        overdue = now - self._expected_wake
+        if overdue >= self.threshold:
+            if self._stall_started is None:
+                self._stall_started = self._expected_wake
+                self.stalls += 1
+                LOOP_STALLS.labels().inc()
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else "(pila no disponible)"
+                # La pila se toma durante el bloqueo: la última línea es el código que lo causa
+                logger.warning(
+                    "Event loop bloqueado durante más de %.2fs", overdue,
+                    extra={"fields": {"stack": stack}},
+                )
+        elif self._stall_started is not None:
+            duration = now - self._stall_started
+            self._stall_started = None
+            LOOP_STALL_SECONDS.labels().observe(duration)
+            logger.warning("Event loop recuperado tras un bloqueo de %.2fs", duration)
+
+    def _watch(self) -> None:
+        check_interval = max(0.02, self.threshold / 5)
+        while not self._stop.wait(check_interval):
+            self._check()
+
+    def _start_threads(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._expected_wake = time.monotonic() + self.interval
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        if self.profile_path:
+            self.profiler = SamplingProfiler(
+                self._loop_thread_id, self.profile_path, self.profile_interval, self.profile_flush_interval
+            )
+            self.profiler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self.profiler is not None:
+            self.profiler.stop() # Escribe el perfil final
+
+    async def run(self) -> None:
+        """Latido del loop; se detiene al cancelar la tarea."""
+        loop = asyncio.get_running_loop()
+        lag = LOOP_LAG.labels()
+        self._start_threads()
+        try:
+            while True:
+                expected = loop.time() + self.interval
+                self._expected_wake = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                lag.observe(max(0.0, loop.time() - expected))
+        finally:
+            self.stop()
+
+
+def watchdog_enabled() -> bool:
+    return _env_bool("LOOP_WATCHDOG_ENABLED", True)
@@ -0,0 +1,54 @@
+# media.py
+# Estrategia de envío de adjuntos a la API de Phishing sin pasar por disco:
+#   - Archivos pequeños: se descargan a memoria (spool) y pueden reenviarse sin coste.
+#   - Archivos medianos: la descarga se canaliza directamente a la subida multipart por bloques.
+#   - Archivos enormes (opcional): se usa un archivo temporal, como antes.
+import os
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Claves de un adjunto que solo tienen sentido en el proceso local y no se envían en el JSON
+LOCAL_ATTACHMENT_KEYS = ("file_path", "content", "stream_factory")
+
+
+def spool_max_bytes() -> int:
+    return int(os.getenv("MEDIA_SPOOL_MAX_BYTES", 1024 * 1024))
+
+
+def temp_file_min_bytes() -> int:
+    """Tamaño a partir del cual se usa un archivo temporal. 0 desactiva los archivos temporales."""
+    return int(os.getenv("MEDIA_TEMP_FILE_MIN_BYTES", 0))
+
+
+async def prepare_attachment_source(
+    size: Optional[int],
+    download_bytes: Callable[[], Awaitable[bytes]],
+    stream_factory: Callable[[], AsyncIterator[bytes]],
+    download_to_file: Optional[Callable[[], Awaitable[Optional[str]]]] = None,
+) -> Dict[str, Any]:
+    """Elige cómo se enviará un adjunto y devuelve las claves locales a añadir al adjunto.
+
+    `stream_factory` debe poder invocarse de nuevo para reintentar una subida (p. ej. tras un 401).
+    """
+    threshold = temp_file_min_bytes()
+    if download_to_file is not None and threshold and size is not None and size >= threshold:
+        file_path = await download_to_file()
+        return {"file_path": file_path} if file_path else {}
+    if size is not None and size <= spool_max_bytes():
+        return {"content": await download_bytes()}
+    return {"stream_factory": stream_factory}
+
+
+def sanitize_attachment(attachment: Dict[str, Any]) -> Dict[str, Any]:
+    """Copia del adjunto sin las claves locales, apta para serializar en JSON."""
+    return {k: v for k, v in attachment.items() if k not in LOCAL_ATTACHMENT_KEYS}
+
+
+def has_upload_source(attachment: Dict[str, Any]) -> bool:
+    if attachment.get("content") is not None or attachment.get("stream_factory") is not None:
+        return True
+    file_path = attachment.get("file_path")
+    return bool(file_path) and os.path.exists(file_path)
+
@@ -0,0 +1,379 @@
+# messages.py
+# Normalización de mensajes común a todas las plataformas.
+#   - NormalizedMessage: registro compacto (__slots__) con los campos que usan el análisis y el agente.
+#   - AttachmentRef: referencia a un adjunto; no descarga nada hasta que el análisis lo necesita
+#     (en un acierto de la caché de veredictos no hay descarga) y entonces elige memoria, flujo por
+#     bloques o archivo temporal según el tamaño (botengine/media.py). Si la plataforma no da un
+#     identificador estable del contenido, los adjuntos pequeños se identifican por el hash de sus bytes.
+#   - handle_message: el mismo camino de análisis y respuesta para todas las plataformas; con una
+#     ReplyGate (botengine/reply_gate.py) decide antes si la respuesta merece una llamada al LLM.
+# Los adaptadores de cada plataforma (p. ej. botengine/telegram_adapter.py) solo rellenan el registro.
+import os
+import logging
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from botengine.media import prepare_attachment_source, sanitize_attachment, spool_max_bytes
+from botengine.pipeline import run_message_pipeline
+from botengine.reply_gate import REASON_TEXT
+from botengine.runtime import run_blocking
+from botengine.streaming import StreamingReply, streaming_enabled, split_text, DEFAULT_MAX_LENGTH
+from botengine.verdict_cache import verdict_key, content_hash
+from botengine.session_metrics import METRIC_PHISHING, METRIC_LLM, METRIC_REPLY_SEND, METRIC_LLM_TOKENS
+
+logger = logging.getLogger(__name__)
+
+CHAT_PRIVATE = "private"
+CHAT_GROUP = "group"
+
+
+def media_type_from_mime(mime_type: Optional[str]) -> str:
+    if not mime_type:
+        return "document"
+    if mime_type.startswith("audio/") or mime_type == "application/ogg":
+        return "audio"
+    if mime_type.startswith("image/"):
+        return "image"
+    if mime_type.startswith("video/"):
+        return "video"
+    return "document"
+
+
+class AttachmentRef:
+    """Adjunto pendiente de descargar, con las funciones de descarga de su plataforma."""
+
+    __slots__ = (
+        "type", "filename", "size", "mime_type", "media_id", "hash_content", "content",
+        "download_bytes", "stream_factory", "download_to_file",
+    )
+
+    def __init__(
+        self,
+        type: str,
+        filename: str,
+        size: Optional[int],
+        mime_type: Optional[str],
+        download_bytes: Callable[[], Awaitable[bytes]],
+        stream_factory: Callable[[], AsyncIterator[bytes]],
+        download_to_file: Optional[Callable[[], Awaitable[Optional[str]]]] = None,
+        media_id: Optional[str] = None,
+        hash_content: bool = False,
+    ):
+        self.type = type
+        self.filename = filename
+        self.size = size
+        self.mime_type = mime_type
+        self.media_id = media_id  # Identificador estable del contenido, para la caché de veredictos
+        # Sin media_id: calcularlo con el hash de los bytes si el adjunto cabe en memoria
+        self.hash_content = hash_content
+        self.content: Optional[bytes] = None  # Bytes ya descargados para el hash; se reutilizan al subir
+        self.download_bytes = download_bytes
+        self.stream_factory = stream_factory
+        self.download_to_file = download_to_file
+
+    async def resolve_media_id(self) -> Optional[str]:
+        """Identificador del contenido; descarga y hashea el adjunto si hace falta y es pequeño."""
+        if self.media_id is None and self.hash_content and self.size is not None and self.size <= spool_max_bytes():
+            try:
+                self.content = await self.download_bytes()
+                self.media_id = content_hash(self.content)
+            except Exception as e:
+                logger.warning(f"No se pudo calcular el hash del adjunto {self.filename}: {e}")
+        return self.media_id
+
+    async def prepare(self) -> Dict[str, Any]:
+        """Adjunto en el formato de la API de Phishing, con su origen de subida ya elegido."""
+        attachment = {"type": self.type, "filename": self.filename, "size": self.size}
+        if self.mime_type:
+            attachment["mime_type"] = self.mime_type
+        if self.content is not None:
+            attachment["content"] = self.content # Ya descargado para el hash
+            return attachment
+        attachment.update(await prepare_attachment_source(
+            self.size, self.download_bytes, self.stream_factory, self.download_to_file
+        ))
+        return attachment
+
+
+class NormalizedMessage:
+    """Mensaje entrante de cualquier plataforma."""
+
+    __slots__ = (
+        "platform", "message_id", "chat_id", "chat_type", "chat_title",
+        "sender_id", "sender_name", "sender_username", "sender_is_bot", "recipient",
+        "text", "timestamp", "message_type", "mime_type",
+        "is_forward", "is_reply", "mentioned", "should_reply", "attachments",
+    )
+
+    def __init__(
+        self,
+        platform: str,
+        message_id: Any,
+        chat_id: Any,
+        sender_id: Any,
+        sender_name: str,
+        text: str,
+        timestamp: datetime,
+        chat_type: str = CHAT_PRIVATE,
+        chat_title: Optional[str] = None,
+        sender_username: Optional[str] = None,
+        sender_is_bot: bool = False,
+        recipient: str = "BotEngine",
+        message_type: str = "text",
+        mime_type: Optional[str] = None,
+        is_forward: bool = False,
+        is_reply: bool = False,
+        mentioned: bool = False,
+        should_reply: Optional[bool] = None,
+        attachments: Optional[List[AttachmentRef]] = None,
+    ):
+        self.platform = platform
+        self.message_id = message_id
+        self.chat_id = chat_id
+        self.chat_type = chat_type
+        self.chat_title = chat_title
+        self.sender_id = sender_id
+        self.sender_name = sender_name
+        self.sender_username = sender_username
+        self.sender_is_bot = sender_is_bot
+        self.recipient = recipient
+        self.text = text or ""
+        self.timestamp = timestamp
+        self.message_type = message_type
+        self.mime_type = mime_type
+        self.is_forward = is_forward
+        self.is_reply = is_reply
+        self.mentioned = mentioned
+        # Por defecto se responde en privado y, en grupos, solo si se menciona al bot
+        self.should_reply = (chat_type == CHAT_PRIVATE or mentioned) if should_reply is None else should_reply
+        self.attachments = attachments or []
+
+    @property
+    def is_group(self) -> bool:
+        return self.chat_type == CHAT_GROUP
+
+    def cache_key(self) -> Optional[str]:
+        """Clave de la caché de veredictos, o None si algún adjunto no tiene identificador estable
+        o el mensaje no tiene contenido que identificar (p. ej. encuestas o ubicaciones)."""
+        media_ids = [a.media_id for a in self.attachments]
+        if any(m is None for m in media_ids) or not (self.text or media_ids):
+            return None
+        return verdict_key(self.text, media_ids)
+
+    async def resolve_cache_key(self) -> Optional[str]:
+        """Como cache_key, calculando antes los hashes de contenido de los adjuntos que los necesiten."""
+        for ref in self.attachments:
+            await ref.resolve_media_id()
+        return self.cache_key()
+
+    def phishing_payload(self, attachments: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Muestra para la API de Phishing (mismo esquema en todas las plataformas)."""
+        return {
+            "sample": {
+                "message_id": str(self.message_id),
+                "platform": self.platform,
+                "chat_type": self.chat_type,
+                "from": self.sender_name,
+                "to": self.recipient,
+                "sender_info": {
+                    "user_id": str(self.sender_id),
+                    "username": self.sender_username or "N/A",
+                    "is_bot": 1 if self.sender_is_bot else 0,
+                },
+                "message_content": {
+                    "text": self.text,
+                    "attachments": attachments,
+                },
+                "timestamp": self.timestamp.isoformat(),
+            }
+        }
+
+    def log_data(self) -> Dict[str, Any]:
+        """Resumen del mensaje para el registro (mismas claves que antes en los bots)."""
+        return {
+            "plataforma": self.platform,
+            "remitenteID": self.sender_id,
+            "nombreRemitente": self.sender_name,
+            "usernameRemitente": self.sender_username or "N/A",
+            "esUnGrupo": self.is_group,
+            "tituloChat": self.chat_title if self.is_group else "Chat Privado",
+            "contenidoMensaje": self.text,
+            "timestampUnix": self.timestamp.timestamp(),
+            "idMensaje": self.message_id,
+            "esReenviado": self.is_forward,
+            "esRespuesta": self.is_reply,
+            "tipoMensaje": self.message_type,
+            "mimeType": self.mime_type,
+            "botFueMencionado": self.mentioned,
+        }
+
+
+class ReplyChannel:
+    """Cómo responde una plataforma: `send(text)` devuelve el mensaje enviado y `edit(msg, text)` lo
+    modifica (necesario para el streaming; sin él se envía la respuesta completa). Las respuestas
+    más largas que `max_length` se reparten en varios mensajes."""
+
+    __slots__ = ("send_alert", "send", "edit", "max_length")
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[Any]],
+        edit: Optional[Callable[[Any, str], Awaitable[Any]]] = None,
+        send_alert: Optional[Callable[[str], Awaitable[Any]]] = None,
+        max_length: int = DEFAULT_MAX_LENGTH,
+    ):
+        self.send = send
+        self.edit = edit
+        self.send_alert = send_alert or send
+        self.max_length = max_length
+
+
+def build_media_input(message: NormalizedMessage, api_response: Optional[dict]) -> str:
+    """Construye la entrada del agente para mensajes sin texto a partir del tipo de contenido y del análisis."""
+    is_phishing = (api_response or {}).get('analysis_results', {}).get('is_phishing', False)
+
+    if is_phishing:
+        # Si se detectó phishing, incluir esa información en el mensaje
+        return f"[Se ha detectado contenido sospechoso en el {message.message_type} enviado]"
+    # Mensaje específico según el tipo de contenido
+    if message.message_type == "image":
+        return "[El usuario ha enviado una imagen]"
+    elif message.message_type == "audio":
+        return "[El usuario ha enviado un mensaje de voz o archivo de audio]"
+    elif message.message_type == "video":
+        return "[El usuario ha enviado un video]"
+    elif message.message_type == "document":
+        return f"[El usuario ha enviado un archivo de tipo: {message.mime_type or 'desconocido'}]"
+    return "[El usuario ha enviado un archivo multimedia]"
+
+
+def remove_temp_attachments(attachments: List[Dict[str, Any]]) -> None:
+    """Elimina del disco los adjuntos descargados temporalmente."""
+    for attachment in attachments:
+        file_path = attachment.get('file_path')
+        if file_path and os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+                logger.info(f"Archivo temporal eliminado: {file_path}")
+            except Exception as e:
+                logger.error(f"Error al eliminar archivo temporal: {e}")
+
+
+async def handle_message(
+    message: NormalizedMessage,
+    *,
+    phishing_client,
+    verdict_cache,
+    agent,
+    thread_id: str,
+    channel: ReplyChannel,
+    metrics=None,
+    reply_gate=None,
+    followup: Optional[Callable[[], bool]] = None,
+) -> Dict[str, Any]:
+    """Analiza el mensaje y, si procede, responde con el agente. Devuelve los datos registrados.
+
+    `agent` es un AgentLoader; el análisis y el LLM corren en paralelo salvo que la entrada del
+    agente dependa del veredicto (mensajes solo multimedia). Con `reply_gate` los mensajes triviales
+    no llegan al LLM y, si `followup()` indica que el usuario ya tiene más mensajes en cola, se
+    responden todos juntos con el último.
+    """
+    timer = metrics.timer if metrics is not None else (lambda name: nullcontext())
+    message_data = message.log_data()
+
+    async def scan():
+        try:
+            cache_key = await message.resolve_cache_key()
+            api_response = await verdict_cache.get(cache_key)
+            if api_response is not None:
+                message_data['veredictoEnCache'] = True # Muestra repetida: sin descarga ni petición
+            else:
+                attachments = []
+                try:
+                    for ref in message.attachments:
+                        try:
+                            attachments.append(await ref.prepare())
+                        except Exception as e:
+                            logger.error(f"Error al procesar archivo adjunto: {e}")
+                    if attachments:
+                        message_data['adjuntos'] = [sanitize_attachment(a) for a in attachments]
+                    with timer(METRIC_PHISHING):
+                        api_response = await phishing_client.send_sample(message.phishing_payload(attachments))
+                finally:
+                    await run_blocking(remove_temp_attachments, attachments)
+                await verdict_cache.set(cache_key, api_response)
+            message_data['phishingApiResponse'] = api_response or "No se obtuvo respuesta"
+            technical_text = (api_response or {}).get("bot_responses", {}).get("technical_response", {}).get("text")
+            if technical_text:
+                await channel.send_alert(f"Alerta de Seguridad: {technical_text}")
+            return api_response
+        except Exception as e:
+            logger.error(f"Error al procesar con la API de Phishing: {e}")
+            return None
+
+    async def agent_reply(api_response, gate):
+        try:
+            input_message = message.text or build_media_input(message, api_response)
+            if reply_gate is not None:
+                decision = await reply_gate.decide(message, input_message, api_response, thread_id, followup)
+                if not decision.reply:
+                    message_data['respuestaBot'] = f"No se respondió ({REASON_TEXT[decision.reason]})."
+                    return
+                if decision.messages > 1:
+                    message_data['mensajesAgrupados'] = decision.messages
+                input_message = decision.input
+
+            async def send(text):
+                if gate is not None:
+                    await gate # Esperar al veredicto antes de responder
+                with timer(METRIC_REPLY_SEND):
+                    return await channel.send(text)
+
+            async def counted(fragments):
+                # Solo la generación: los envíos y ediciones (y la espera al veredicto) van en la tarea
+                # editora de StreamingReply y se miden aparte en METRIC_REPLY_SEND
+                count = 0
+                try:
+                    with timer(METRIC_LLM):
+                        async for fragment in fragments:
+                            count += 1
+                            yield fragment
+                finally:
+                    if metrics is not None:
+                        metrics.increment(METRIC_LLM_TOKENS, count)
+
+            agent_config = {"configurable": {"thread_id": thread_id}}
+            compiled_graph = await agent.graph()
+            if streaming_enabled() and channel.edit is not None:
+                from langgraph.agente_impersonador import astream_agent_reply # Ya cargado por AgentLoader
+                # Primer mensaje con los primeros tokens y ediciones periódicas después
+                streamer = StreamingReply(send=send, edit=channel.edit, max_length=channel.max_length)
+                reply = await streamer.run(
+                    counted(astream_agent_reply(compiled_graph, {"input": input_message}, agent_config))
+                )
+                message_data['latenciaPrimerEnvio'] = streamer.first_send_latency
+            else:
+                with timer(METRIC_LLM):
+                    result = await compiled_graph.ainvoke({"input": input_message}, config=agent_config)
+                reply = result["output"]
+                for part in split_text(reply, channel.max_length):
+                    await send(part)
+            message_data['respuestaBot'] = reply
+        except Exception as e:
+            logger.error(f"Error al generar respuesta para {message.sender_name}: {e}")
+            message_data['errorAgente'] = str(e)
+
+    if not message.should_reply:
+        message_data['respuestaBot'] = "No se respondió (mensaje en grupo sin mención)."
+
+    await run_message_pipeline(
+        scan,
+        agent_reply if message.should_reply else None,
+        reply_needs_verdict=not message.text,
+    )
+
+    # Una línea estructurada; el formateo, la redacción y el truncado de cuerpos ocurren en el
+    # hilo del registro (botengine/structured_log.py), no en el event loop
+    logger.info("Mensaje procesado (%s)", message.platform, extra={"fields": message_data})
+    return message_data
@@ -0,0 +1,228 @@
+# phishing_api.py
+# Cliente asíncrono compartido para la API de Phishing.
+# Mantiene un único pool de conexiones keep-alive (aiohttp) por proceso, de modo que
+# los análisis de mensajes distintos se ejecutan en paralelo sin bloquear el event loop.
+import os
+import json
+import logging
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from botengine.jwt_token import JwtTokenManager
+from botengine.media import LOCAL_ATTACHMENT_KEYS, has_upload_source, sanitize_attachment
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        logger.warning(f"Valor inválido para {name}, usando {default}.")
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        logger.warning(f"Valor inválido para {name}, usando {default}.")
+        return default
+
+
+class PhishingApiClient:
+    """Cliente HTTP asíncrono con pool de conexiones para la API de Phishing."""
+
+    def __init__(
+        self,
+        token_url: str,
+        api_url: str,
+        username: str,
+        password: str,
+        max_connections: Optional[int] = None,
+        max_connections_per_host: Optional[int] = None,
+        timeout: Optional[float] = None,
+        connect_timeout: Optional[float] = None,
+        keepalive_timeout: Optional[float] = None,
+    ):
+        self.token_url = token_url
+        self.api_url = api_url
+        self.username = username
+        self.password = password
+        # Límites y timeouts configurables por variables de entorno
+        self.max_connections = max_connections or _env_int("PHISHING_API_MAX_CONNECTIONS", 100)
+        self.max_connections_per_host = max_connections_per_host or _env_int("PHISHING_API_MAX_CONNECTIONS_PER_HOST", 20)
+        self.timeout = timeout or _env_float("PHISHING_API_TIMEOUT", 30.0)
+        self.connect_timeout = connect_timeout or _env_float("PHISHING_API_CONNECT_TIMEOUT", 10.0)
+        self.keepalive_timeout = keepalive_timeout or _env_float("PHISHING_API_KEEPALIVE_TIMEOUT", 60.0)
+
+        # Reintentos acotados tras un 401, con backoff exponencial entre intentos
+        self.max_auth_retries = _env_int("PHISHING_API_MAX_AUTH_RETRIES", 2)
+        self.auth_retry_backoff = _env_float("PHISHING_API_AUTH_RETRY_BACKOFF", 0.5)
+
+        self.tokens = JwtTokenManager(self._request_token)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def jwt_token(self) -> Optional[str]:
+        return self.tokens.token
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Pool HTTP compartido; también se usa para descargar adjuntos por URL (p. ej. la CDN de Discord)."""
+        return self._get_session()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # La sesión se crea de forma perezosa para que pertenezca al event loop en ejecución
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self) -> "PhishingApiClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def _request_token(self) -> Optional[str]:
+        """Pide un token nuevo a TOKEN_URL. Solo lo invoca el gestor de tokens."""
+        logger.info(f"Generando token JWT desde: {self.token_url}")
+        payload = {"username": self.username, "password": self.password}
+        try:
+            async with self._get_session().post(self.token_url, json=payload) as response:
+                response.raise_for_status()
+                token_data = await response.json(content_type=None)
+            access_token = token_data.get("access")
+            if access_token:
+                logger.info("Token de ACCESO JWT generado exitosamente.")
+                return access_token
+            logger.error("Error: El campo 'access' no se encontró en la respuesta del token.")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Error de conexión al generar token: {e}")
+        except json.JSONDecodeError:
+            logger.error("Error al decodificar la respuesta JSON del token.")
+        return None
+
+    async def generate_token(self) -> Optional[str]:
+        """Fuerza la obtención de un token (p. ej. al arrancar el bot)."""
+        return await self.tokens.refresh()
+
+    def _build_request(self, sample_data: Dict[str, Any]):
+        """Prepara el cuerpo de la petición: JSON directo o multipart si hay adjuntos con contenido.
+
+        Cada adjunto puede aportar su contenido en memoria ('content'), como flujo de bloques
+        ('stream_factory') o como archivo en disco ('file_path').
+        """
+        message_content = sample_data.get("sample", {}).get("message_content", {})
+        attachments: List[Dict[str, Any]] = message_content.get("attachments") or []
+        upload_attachments = [(idx, att) for idx, att in enumerate(attachments) if has_upload_source(att)]
+        if not upload_attachments:
+            if any(set(att) & set(LOCAL_ATTACHMENT_KEYS) for att in attachments):
+                return {"json": self._sanitize(sample_data)}, []
+            return {"json": sample_data}, []
+
+        logger.info("Detectados adjuntos. Preparando envío multipart/form-data.")
+        form = aiohttp.FormData()
+        form.add_field("sample", json.dumps(self._sanitize(sample_data)))
+        file_handles = []
+        for idx, attachment in upload_attachments:
+            if attachment.get("content") is not None:
+                value = attachment["content"]
+            elif attachment.get("stream_factory") is not None:
+                # Subida por bloques (chunked) a medida que llega la descarga
+                value = attachment["stream_factory"]()
+            else:
+                value = open(attachment["file_path"], "rb")
+                file_handles.append(value)
+            form.add_field(
+                f"file_{idx}",
+                value,
+                filename=attachment["filename"],
+                content_type="application/octet-stream",
+            )
+        return {"data": form}, file_handles
+
+    @staticmethod
+    def _sanitize(sample_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Copia del payload sin las claves locales de los adjuntos (rutas, bytes, flujos)."""
+        sample = dict(sample_data["sample"])
+        message_content = dict(sample["message_content"])
+        message_content["attachments"] = [sanitize_attachment(att) for att in message_content["attachments"]]
+        sample["message_content"] = message_content
+        return {**sample_data, "sample": sample}
+
+    async def _post_sample(self, sample_data: Dict[str, Any], token: str) -> Dict[str, Any]:
+        request_kwargs, file_handles = self._build_request(sample_data)
+        headers = {"Authorization": f"Bearer {token}"}
+        try:
+            async with self._get_session().post(self.api_url, headers=headers, **request_kwargs) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+        finally:
+            for f in file_handles:
+                try:
+                    f.close()
+                except Exception as e:
+                    logger.error(f"Error al cerrar archivo: {e}")
+
+    async def send_sample(self, sample_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Envía una muestra a la API. Devuelve la respuesta JSON o None si hubo un error."""
+        token = await self.tokens.get_token()
+        if not token:
+            logger.error("Token JWT no disponible. No se enviará la muestra.")
+            return None
+
+        try:
+            attempt = 0
+            while True:
+                try:
+                    api_response = await self._post_sample(sample_data, token)
+                    break
+                except aiohttp.ClientResponseError as http_err:
+                    if http_err.status != 401 or attempt >= self.max_auth_retries:
+                        raise
+                    attempt += 1
+                    logger.info(f"Token posiblemente expirado. Regenerando y reenviando (intento {attempt}/{self.max_auth_retries}).")
+                    if attempt > 1:
+                        await asyncio.sleep(self.auth_retry_backoff * (2 ** (attempt - 2)))
+                    token = await self.tokens.invalidate(token)
+                    if not token:
+                        logger.error("No se pudo regenerar el token para el reenvío.")
+                        return None
+            logger.info("Muestra enviada exitosamente a la API de Phishing.")
+            return api_response
+        except aiohttp.ClientResponseError as http_err:
+            logger.error(f"Error HTTP: {http_err.status} {http_err.message}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as req_err:
+            logger.error(f"Error de conexión al enviar la muestra: {req_err}")
+        except json.JSONDecodeError:
+            logger.error("Error al decodificar la respuesta JSON de la API de Phishing.")
+        except Exception as e:
+            logger.error(f"Error inesperado al enviar la muestra: {e}")
+        return None
+
+
+def create_phishing_client_from_env() -> PhishingApiClient:
+    """Construye el cliente a partir de las variables de entorno estándar de los bots."""
+    return PhishingApiClient(
+        token_url=os.getenv("TOKEN_URL"),
+        api_url=os.getenv("PHISHING_API_URL"),
+        username=os.getenv("PHISHING_API_USER"),
+        password=os.getenv("PHISHING_API_PASSWORD"),
+    )
@@ -0,0 +1,49 @@
+# pipeline.py
+# Pipeline por mensaje: el análisis de phishing y la respuesta del agente se lanzan a la vez
+# cuando son independientes, de modo que la latencia total es la del más lento de los dos.
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def hold_reply_enabled() -> bool:
+    """Si está activo, la respuesta del agente no se envía hasta conocer el veredicto del análisis."""
+    return os.getenv("PIPELINE_HOLD_REPLY", "false").strip().lower() in ("1", "true", "yes", "si", "sí")
+
+
+async def run_message_pipeline(
+    scan: Callable[[], Awaitable[Optional[dict]]],
+    reply: Optional[Callable[[Optional[dict], Optional[Awaitable]], Awaitable[Any]]],
+    reply_needs_verdict: bool,
+    hold_reply: Optional[bool] = None,
+) -> Tuple[Optional[dict], Any]:
+    """Ejecuta el análisis y, si procede, la respuesta. Devuelve (veredicto, resultado de la respuesta).
+
+    `reply(verdict, gate)` recibe el veredicto cuando la entrada del agente depende de él
+    (mensajes solo multimedia). En caso contrario recibe `None` y arranca en paralelo; si
+    `gate` no es None, debe esperarlo justo antes de enviar su primer mensaje.
+    """
+    hold_reply = hold_reply_enabled() if hold_reply is None else hold_reply
+    scan_task = asyncio.ensure_future(scan())
+
+    if reply is None:
+        return await scan_task, None
+
+    if reply_needs_verdict:
+        verdict = await scan_task
+        return verdict, await reply(verdict, None)
+
+    # asyncio.shield evita que una cancelación de la respuesta cancele también el análisis
+    gate = asyncio.shield(scan_task) if hold_reply else None
+    reply_task = asyncio.ensure_future(reply(None, gate))
+    verdict, reply_result = await asyncio.gather(scan_task, reply_task, return_exceptions=True)
+    if isinstance(verdict, BaseException):
+        logger.error(f"Error en el análisis de phishing: {verdict}")
+        verdict = None
+    if isinstance(reply_result, BaseException):
+        logger.error(f"Error al generar la respuesta del agente: {reply_result}")
+        reply_result = None
+    return verdict, reply_result
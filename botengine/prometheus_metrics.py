@@ -0,0 +1,367 @@
+# prometheus_metrics.py
+# Registro de métricas del proceso en el formato de texto de Prometheus (0.0.4), sin dependencias.
+#   - Counter, Gauge y Histogram con etiquetas. Todas llevan `platform` y `session_id`: el proceso fija
+#     sus valores por defecto (set_default_labels) y cada muestra puede sobrescribirlos (en modo host
+#     cada cuenta de Telegram usa su propio session_id).
+#   - Los contadores que ya existen (cachés, token JWT, colas) se leen en el momento del scrape con
+#     colectores registrados: no añaden coste al camino de cada mensaje.
+#   - Endpoint GET /metrics en un socket Unix (METRICS_SOCKET, por defecto
+#     DATA_PATH/metrics/<platform>-<session_id>.sock) y, si se define METRICS_PORT, también por TCP
+#     en METRICS_HOST (127.0.0.1 por defecto). METRICS_ENABLED=false lo desactiva.
+#   - start_process_metrics arranca además el vigilante del event loop (botengine/loop_watchdog.py).
+import os
+import time
+import math
+import asyncio
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+BASE_LABELS = ("platform", "session_id")
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (nombre, tipo, ayuda, etiquetas, valor) producido por un colector en cada scrape
+Sample = Tuple[str, str, str, Dict[str, Any], float]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Iterable[Tuple[str, Any]]) -> str:
+    rendered = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return "{" + rendered + "}" if rendered else ""
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """El valor se calcula al hacer scrape."""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # El último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started)
+
+
+class _Family:
+    kind = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = BASE_LABELS + tuple(n for n in labelnames if n not in BASE_LABELS)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        defaults = self.registry.default_labels
+        return tuple(str(labels[n]) if n in labels else defaults.get(n, "") for n in self.labelnames)
+
+    def labels(self, **labels):
+        """Serie con esas etiquetas; conviene guardarla si se usa en cada mensaje."""
+        key = self._key(labels)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def remove(self, **labels) -> None:
+        """Elimina la serie (p. ej. al terminar una sesión del host)."""
+        self._children.pop(self._key(labels), None)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            lines.extend(self._render_child(list(zip(self.labelnames, key)), child))
+        return lines
+
+    def _render_child(self, pairs, child) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Family):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def _render_child(self, pairs, child):
+        return [f"{self.name}{_format_labels(pairs)} {_format_value(child.value)}"]
+
+
+class Gauge(_Family):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def _render_child(self, pairs, child):
+        try:
+            value = child.get()
+        except Exception as e:
+            logger.error(f"Error al calcular la métrica {self.name}: {e}")
+            return []
+        return [f"{self.name}{_format_labels(pairs)} {_format_value(value)}"]
+
+
+class Histogram(_Family):
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, pairs, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), child.counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', _format_value(bound))])} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{_format_labels(pairs)} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Familias de métricas y colectores de un proceso."""
+
+    def __init__(self):
+        self.default_labels: Dict[str, str] = {}
+        self._families: Dict[str, _Family] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def set_default_labels(self, **labels) -> None:
+        self.default_labels.update({k: str(v) for k, v in labels.items()})
+
+    def _family(self, cls, name, documentation, labelnames, **kwargs):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = cls(self, name, documentation, labelnames, **kwargs)
+        elif not isinstance(family, cls):
+            raise ValueError(f"La métrica {name} ya existe con otro tipo.")
+        return family
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._family(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._family(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._family(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]) -> Callable[[], Iterable[Sample]]:
+        self._collectors.append(collector)
+        return collector
+
+    def unregister_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for family in list(self._families.values()):
+            lines.extend(family.render())
+        # Las muestras de los colectores se agrupan por nombre para emitir HELP/TYPE una sola vez
+        collected: Dict[str, Tuple[str, str, List[str]]] = {}
+        for collector in list(self._collectors):
+            try:
+                samples = list(collector())
+            except Exception as e:
+                logger.error(f"Error en un colector de métricas: {e}")
+                continue
+            for name, kind, documentation, labels, value in samples:
+                pairs = [(n, labels.get(n, self.default_labels.get(n, ""))) for n in BASE_LABELS]
+                pairs += [(n, v) for n, v in labels.items() if n not in BASE_LABELS]
+                entry = collected.setdefault(name, (kind, documentation, []))
+                entry[2].append(f"{name}{_format_labels(pairs)} {_format_value(value)}")
+        for name, (kind, documentation, samples) in collected.items():
+            lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"])
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+
+# --- Colectores de los contadores existentes ---
+
+def work_queue_samples(queue, **labels) -> List[Sample]:
+    stats = queue.stats()
+    labels = {**labels, "queue": queue.name}
+    return [
+        ("botengine_queue_depth", "gauge", "Mensajes esperando en la cola", labels, stats["depth"]),
+        ("botengine_queue_in_flight", "gauge", "Mensajes en proceso", labels, stats["in_flight"]),
+        ("botengine_queue_processed_total", "counter", "Mensajes procesados por la cola", labels, stats["processed"]),
+        ("botengine_queue_dropped_total", "counter", "Mensajes descartados por contrapresión", labels, stats["dropped"]),
+    ]
+
+
+def cache_samples(cache_name: str, hits: int, misses: int, **labels) -> List[Sample]:
+    labels = {**labels, "cache": cache_name}
+    return [
+        ("botengine_cache_hits_total", "counter", "Aciertos de caché", labels, hits),
+        ("botengine_cache_misses_total", "counter", "Fallos de caché", labels, misses),
+    ]
+
+
+def verdict_cache_samples(verdict_cache, **labels) -> List[Sample]:
+    stats = verdict_cache.stats()
+    return cache_samples("verdicts", stats["hits_memory"] + stats["hits_disk"], stats["misses"], **labels)
+
+
+def token_samples(phishing_client, **labels) -> List[Sample]:
+    return [(
+        "botengine_token_refreshes_total", "counter", "Tokens JWT obtenidos para la API de Phishing",
+        labels, phishing_client.tokens.refresh_count,
+    )]
+
+
+# --- Endpoint ---
+
+def metrics_enabled() -> bool:
+    return os.getenv("METRICS_ENABLED", "true").strip().lower() in ("1", "true", "yes", "si", "sí")
+
+
+def metrics_socket_path(data_path: str, platform: str, session_id: str) -> str:
+    template = os.getenv("METRICS_SOCKET", os.path.join(data_path, "metrics", "{platform}-{session_id}.sock"))
+    return template.format(platform=platform, session_id=session_id)
+
+
+class MetricsServer:
+    """Sirve GET /metrics (HTTP/1.0 mínimo) en un socket Unix y, opcionalmente, por TCP."""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        self.registry = registry
+        self.socket_path: Optional[str] = None
+        self._servers: List[asyncio.AbstractServer] = []
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Cabeceras de la petición hasta la línea vacía
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+                status, body = "200 OK", self.registry.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, data_path: str, platform: str, session_id: str) -> "MetricsServer":
+        if not metrics_enabled():
+            return self
+        self.socket_path = metrics_socket_path(data_path, platform, session_id)
+        try:
+            os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path) # Socket huérfano de una ejecución anterior
+            self._servers.append(await asyncio.start_unix_server(self._handle, path=self.socket_path))
+        except OSError as e:
+            logger.error(f"No se pudo abrir el socket de métricas {self.socket_path}: {e}")
+            self.socket_path = None
+        port = os.getenv("METRICS_PORT")
+        if port:
+            host = os.getenv("METRICS_HOST", "127.0.0.1")
+            try:
+                self._servers.append(await asyncio.start_server(self._handle, host=host, port=int(port)))
+                logger.info(f"Métricas en http://{host}:{port}/metrics")
+            except (OSError, ValueError) as e:
+                # Otro proceso ya usa el puerto: el bot sigue funcionando sin el endpoint TCP
+                logger.error(f"No se pudo abrir el puerto de métricas {host}:{port}: {e}")
+        return self
+
+    async def close(self) -> None:
+        for server in self._servers:
+            server.close()
+        self._servers = []
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.socket_path = None
+
+
+async def start_process_metrics(data_path: str, platform: str, session_id: str) -> Tuple[MetricsServer, Optional[asyncio.Task]]:
+    """Etiquetas por defecto del proceso, endpoint y vigilante del event loop. Devuelve (servidor, tarea)."""
+    from botengine.loop_watchdog import LoopWatchdog, watchdog_enabled # Importa este módulo
+    REGISTRY.set_default_labels(platform=platform, session_id=session_id)
+    server = await MetricsServer().start(data_path, platform, session_id)
+    watchdog_task = None
+    if watchdog_enabled():
+        watchdog_task = asyncio.ensure_future(LoopWatchdog.from_env(data_path, f"{platform}-{session_id}").run())
+    return server, watchdog_task
@@ -0,0 +1,241 @@
+# reply_gate.py
+# Puerta previa al agente: decide si un mensaje merece una llamada al LLM.
+#   - Reglas: los mensajes solo multimedia (stickers, fotos, notas de voz...) no se responden salvo que
+#     el análisis haya detectado phishing (REPLY_GATE_SKIP_MEDIA), y los que no tienen ninguna palabra
+#     (solo emojis o signos) tampoco.
+#   - Clasificador: una puntuación lineal barata (engagement_score) descarta acuses de recibo y risas
+#     ("ok", "vale", "jajaja"...) por debajo de REPLY_GATE_MIN_SCORE. REPLY_GATE_ENABLED=false
+#     desactiva reglas y clasificador (el agrupado y el presupuesto siguen aplicándose).
+#   - Agrupado: si el mismo usuario ya tiene más mensajes en la cola del chat, el texto se guarda y se
+#     responde junto con el último en un solo turno (REPLY_COALESCE). REPLY_DEBOUNCE_SECONDS espera
+#     además ese tiempo por si llegan más mensajes seguidos.
+#   - Presupuesto por sesión: como mucho REPLY_BUDGET_CALLS llamadas al LLM cada REPLY_BUDGET_WINDOW
+#     segundos (0 = sin límite).
+# El análisis de phishing y las alertas no pasan por aquí: cada mensaje se sigue analizando.
+import os
+import re
+import math
+import time
+import asyncio
+import logging
+import unicodedata
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional
+
+from botengine.prometheus_metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REASON_MEDIA = "media"          # Solo multimedia, sin phishing
+REASON_TRIVIAL = "trivial"      # Sin palabras: emojis o signos
+REASON_LOW_SCORE = "low_score"  # El clasificador lo considera un acuse de recibo
+REASON_COALESCED = "coalesced"  # Se responde junto con un mensaje posterior
+REASON_BUDGET = "budget"        # Presupuesto de la sesión agotado
+
+REASON_TEXT = {
+    REASON_MEDIA: "multimedia sin texto ni phishing",
+    REASON_TRIVIAL: "mensaje sin palabras",
+    REASON_LOW_SCORE: "mensaje trivial",
+    REASON_COALESCED: "se responde junto con el siguiente mensaje",
+    REASON_BUDGET: "presupuesto de respuestas agotado",
+}
+
+OUTCOME_REPLY = "reply"
+
+REPLY_GATE = REGISTRY.counter("botengine_reply_gate_total", "Decisiones de la puerta de respuesta por resultado", ["outcome"])
+
+# Palabras que por sí solas no piden respuesta (sin tildes, en minúsculas)
+ACKNOWLEDGEMENTS = frozenset((
+    "ok", "oki", "okey", "okay", "okis", "k", "vale", "va", "bien", "genial", "perfecto", "listo",
+    "entendido", "gracias", "grax", "thx", "thanks", "lol", "xd", "xdd", "ah", "oh", "mm",
+))
+LAUGHTER_RE = re.compile(r"^(?:(?:j+[aeiou]+){2,}j*|(?:h+[aeiou]+){2,}h*|x+d+)$")
+# Temas que suelen merecer respuesta: saludos y el vocabulario habitual de las estafas
+ENGAGEMENT_KEYWORDS = frozenset((
+    "hola", "buenas", "buenos", "banco", "cuenta", "pago", "pagar", "transferencia", "tarjeta", "codigo",
+    "clave", "contrasena", "enlace", "link", "premio", "urgente", "dinero", "euros", "bizum", "paquete",
+    "envio", "factura", "verificar", "datos", "ayuda", "oferta", "inversion",
+))
+URL_RE = re.compile(r"https?://|www\.", re.IGNORECASE)
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "si", "sí")
+
+
+def normalized_words(text: str) -> List[str]:
+    """Palabras en minúsculas y sin tildes; los emojis y signos no cuentan."""
+    stripped = "".join(c for c in unicodedata.normalize("NFKD", text.lower()) if not unicodedata.combining(c))
+    return re.findall(r"\w+", stripped)
+
+
+def engagement_score(text: str) -> float:
+    """Probabilidad aproximada (0-1) de que el texto merezca respuesta del agente."""
+    words = normalized_words(text)
+    if not words:
+        return 0.0
+    acks = sum(1 for w in words if w in ACKNOWLEDGEMENTS or LAUGHTER_RE.match(w))
+    z = (
+        -0.5
+        + 0.9 * min(len(words), 4)
+        + 2.0 * ("?" in text or "¿" in text)
+        + 2.0 * bool(URL_RE.search(text))
+        + 1.0 * any(c.isdigit() for c in text)
+        + 1.5 * any(w in ENGAGEMENT_KEYWORDS for w in words)
+        - 4.0 * acks / len(words)
+    )
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+def is_phishing(verdict: Optional[dict]) -> bool:
+    return bool((verdict or {}).get('analysis_results', {}).get('is_phishing', False))
+
+
+class ReplyBudget:
+    """Máximo de llamadas al LLM en una ventana deslizante."""
+
+    def __init__(self, max_calls: int, window: float):
+        self.max_calls = max_calls
+        self.window = window
+        self.calls: Deque[float] = deque()
+        self.rejected = 0
+
+    def _trim(self, now: float) -> None:
+        while self.calls and now - self.calls[0] >= self.window:
+            self.calls.popleft()
+
+    def remaining(self) -> int:
+        self._trim(time.monotonic())
+        return max(0, self.max_calls - len(self.calls))
+
+    def acquire(self) -> bool:
+        now = time.monotonic()
+        self._trim(now)
+        if len(self.calls) >= self.max_calls:
+            if not self.rejected:
+                logger.warning(f"Presupuesto de respuestas agotado ({self.max_calls} cada {self.window:.0f}s): no se llama al LLM hasta que se libere.")
+            self.rejected += 1
+            return False
+        if self.rejected:
+            logger.info(f"Presupuesto de respuestas disponible de nuevo ({self.rejected} mensajes sin respuesta).")
+            self.rejected = 0
+        self.calls.append(now)
+        return True
+
+
+class GateDecision:
+    """Resultado de la puerta: si se llama al agente, con qué entrada y cuántos mensajes agrupa."""
+
+    __slots__ = ("reply", "reason", "input", "messages")
+
+    def __init__(self, reply: bool, reason: Optional[str] = None, input: Optional[str] = None, messages: int = 0):
+        self.reply = reply
+        self.reason = reason
+        self.input = input
+        self.messages = messages
+
+    @property
+    def outcome(self) -> str:
+        return OUTCOME_REPLY if self.reply else self.reason
+
+
+class ReplyGate:
+    """Reglas, clasificador, agrupado y presupuesto por delante del agente (una instancia por sesión)."""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        skip_media: bool = True,
+        min_score: float = 0.5,
+        classifier: Callable[[str], float] = engagement_score,
+        coalesce: bool = True,
+        debounce: float = 0.0,
+        max_coalesced: int = 10,
+        budget: Optional[ReplyBudget] = None,
+        labels: Optional[Dict[str, str]] = None,
+    ):
+        self.enabled = enabled
+        self.skip_media = skip_media
+        self.min_score = min_score
+        self.classifier = classifier
+        self.coalesce = coalesce
+        self.debounce = debounce
+        self.max_coalesced = max(1, max_coalesced)
+        self.budget = budget
+        self.labels = labels or {}
+        # Entradas ya filtradas a la espera del último mensaje seguido, por (hilo del agente, remitente):
+        # en un hilo compartido (p. ej. un canal de Discord) el texto de un usuario solo se agrupa con
+        # los mensajes siguientes del mismo usuario
+        self._pending: Dict[Hashable, List[str]] = {}
+        self._outcomes: Dict[str, Any] = {}
+
+    @classmethod
+    def from_env(cls, labels: Optional[Dict[str, str]] = None) -> "ReplyGate":
+        max_calls = int(os.getenv("REPLY_BUDGET_CALLS", 0))
+        budget = ReplyBudget(max_calls, float(os.getenv("REPLY_BUDGET_WINDOW", 3600))) if max_calls > 0 else None
+        return cls(
+            enabled=_env_bool("REPLY_GATE_ENABLED", True),
+            skip_media=_env_bool("REPLY_GATE_SKIP_MEDIA", True),
+            min_score=float(os.getenv("REPLY_GATE_MIN_SCORE", 0.5)),
+            coalesce=_env_bool("REPLY_COALESCE", True),
+            debounce=float(os.getenv("REPLY_DEBOUNCE_SECONDS", 0)),
+            max_coalesced=int(os.getenv("REPLY_COALESCE_MAX", 10)),
+            budget=budget,
+            labels=labels,
+        )
+
+    def skip_reason(self, message, verdict: Optional[dict]) -> Optional[str]:
+        """Motivo para no responder a este mensaje por sí solo, o None si merece respuesta."""
+        if not message.text:
+            # La entrada del agente sería un marcador ("[El usuario ha enviado una imagen]")
+            if self.skip_media and not is_phishing(verdict):
+                return REASON_MEDIA
+            return None
+        if message.attachments:
+            return None # El texto acompaña a un adjunto: se responde como hasta ahora
+        if not normalized_words(message.text):
+            return REASON_TRIVIAL
+        if self.classifier(message.text) < self.min_score:
+            return REASON_LOW_SCORE
+        return None
+
+    def _record(self, decision: GateDecision) -> GateDecision:
+        child = self._outcomes.get(decision.outcome)
+        if child is None:
+            child = self._outcomes[decision.outcome] = REPLY_GATE.labels(outcome=decision.outcome, **self.labels)
+        child.inc()
+        return decision
+
+    async def decide(
+        self,
+        message,
+        input_text: str,
+        verdict: Optional[dict],
+        key: Hashable,
+        followup: Optional[Callable[[], bool]] = None,
+    ) -> GateDecision:
+        """Decide si se llama al agente para `message` (hilo `key`) y con qué entrada.
+
+        `followup()` indica si el mismo usuario tiene más mensajes en cola que también llegarán a la
+        respuesta del agente; solo entonces se aplaza este texto para agruparlo con el siguiente.
+        """
+        reason = self.skip_reason(message, verdict) if self.enabled else None
+        key = (key, message.sender_id)
+        pending = self._pending.get(key)
+        if reason is None:
+            if pending is None:
+                pending = self._pending[key] = []
+            pending.append(input_text)
+
+        if self.coalesce and followup is not None and pending and len(pending) < self.max_coalesced:
+            if self.debounce > 0:
+                await asyncio.sleep(self.debounce) # Margen para que lleguen más mensajes seguidos
+            if followup():
+                return self._record(GateDecision(False, REASON_COALESCED))
+
+        texts = self._pending.pop(key, None)
+        if not texts:
+            return self._record(GateDecision(False, reason))
+        if self.budget is not None and not self.budget.acquire():
+            return self._record(GateDecision(False, REASON_BUDGET))
+        return self._record(GateDecision(True, input="\n".join(texts), messages=len(texts)))
@@ -0,0 +1,68 @@
+# runtime.py
+# Ejecución de los bots sobre un único event loop propio, sin parches de reentrada.
+#   - run(main): elige la implementación del loop (BOT_EVENT_LOOP: asyncio, uvloop o auto) y ejecuta
+#     `main` con asyncio.run; al terminar cierra también el pool de tareas bloqueantes.
+#   - run_blocking(func, *args): ejecuta código bloqueante (archivos, JSON grandes...) en un pool de
+#     hilos dedicado (BOT_BLOCKING_WORKERS) para no detener el event loop.
+import os
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+LOOP_ASYNCIO = "asyncio"
+LOOP_UVLOOP = "uvloop"
+LOOP_AUTO = "auto"  # uvloop si está instalado
+
+_blocking_executor: Optional[ThreadPoolExecutor] = None
+
+
+def install_event_loop_policy() -> str:
+    """Aplica la implementación de loop configurada y devuelve la elegida."""
+    backend = os.getenv("BOT_EVENT_LOOP", LOOP_ASYNCIO).strip().lower()
+    if backend not in (LOOP_UVLOOP, LOOP_AUTO):
+        return LOOP_ASYNCIO
+    try:
+        import uvloop
+    except ImportError:
+        if backend == LOOP_UVLOOP:
+            logger.warning("BOT_EVENT_LOOP=uvloop pero uvloop no está instalado; se usa asyncio.")
+        return LOOP_ASYNCIO
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return LOOP_UVLOOP
+
+
+def blocking_executor() -> ThreadPoolExecutor:
+    global _blocking_executor
+    if _blocking_executor is None:
+        _blocking_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("BOT_BLOCKING_WORKERS", 4)), thread_name_prefix="bot-blocking"
+        )
+    return _blocking_executor
+
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Ejecuta `func` en el pool de tareas bloqueantes y espera su resultado."""
+    return await asyncio.get_running_loop().run_in_executor(
+        blocking_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+def shutdown_blocking_executor() -> None:
+    global _blocking_executor
+    if _blocking_executor is not None:
+        _blocking_executor.shutdown(wait=True)
+        _blocking_executor = None
+
+
+def run(main: Awaitable[Any]) -> Any:
+    """Punto de entrada de un proceso de bot: un loop, creado y cerrado aquí."""
+    backend = install_event_loop_policy()
+    logger.info(f"Event loop: {backend}")
+    try:
+        return asyncio.run(main)
+    finally:
+        shutdown_blocking_executor()
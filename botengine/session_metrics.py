@@ -0,0 +1,167 @@
+# session_metrics.py
+# Métricas de trabajo de una sesión de bot: mensajes por segundo y latencias (manejador completo,
+# API de Phishing y LLM) sobre una ventana deslizante.
+# Las muestras se guardan en búferes circulares de tamaño fijo (array de floats, sin objetos por
+# muestra) y el bot publica un resumen periódico en el canal de estado; el panel solo lo lee.
+# Con `labels` (platform, session_id) cada observación se exporta además como histograma o contador
+# de Prometheus (botengine/prometheus_metrics.py).
+import os
+import math
+import time
+import asyncio
+import logging
+from array import array
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from botengine.status_channel import STATUS_METRICS
+from botengine.prometheus_metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+METRIC_HANDLER = "handler"
+METRIC_PHISHING = "phishing"
+METRIC_LLM = "llm"
+METRIC_REPLY_SEND = "reply_send"
+METRIC_LLM_TOKENS = "llm_tokens"
+METRIC_RECEIVED = "messages_received"
+
+# Nombre y ayuda de cada métrica exportada; el resto se exporta como botengine_<nombre>_seconds/_total
+EXPORTED = {
+    METRIC_HANDLER: ("botengine_handler_seconds", "Duración del procesado completo de un mensaje"),
+    METRIC_PHISHING: ("botengine_scan_seconds", "Latencia del análisis en la API de Phishing"),
+    METRIC_LLM: ("botengine_llm_seconds", "Latencia de la respuesta del LLM"),
+    METRIC_REPLY_SEND: ("botengine_reply_send_seconds", "Latencia del envío del primer mensaje de respuesta"),
+    METRIC_LLM_TOKENS: ("botengine_llm_tokens_total", "Fragmentos de texto (tokens) emitidos por el LLM en streaming"),
+    METRIC_RECEIVED: ("botengine_messages_received_total", "Mensajes recibidos por el bot"),
+}
+
+
+class RingBuffer:
+    """Búfer circular de floats con capacidad fija."""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, int(capacity))
+        self._data = array("d", bytes(8 * self.capacity))
+        self._next = 0
+        self._size = 0
+
+    def append(self, value: float) -> None:
+        self._data[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def values(self) -> List[float]:
+        """Valores en orden de inserción (el más antiguo primero)."""
+        if self._size < self.capacity:
+            return self._data[:self._size].tolist()
+        return self._data[self._next:].tolist() + self._data[:self._next].tolist()
+
+    def __len__(self) -> int:
+        return self._size
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Percentil q (0-100) por el método del rango más cercano."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class _Series:
+    """Pares (instante, duración) en dos búferes circulares paralelos."""
+
+    def __init__(self, capacity: int):
+        self.times = RingBuffer(capacity)
+        self.durations = RingBuffer(capacity)
+        self.total = 0
+
+    def add(self, at: float, seconds: float) -> None:
+        self.times.append(at)
+        self.durations.append(seconds)
+        self.total += 1
+
+    def since(self, start: float) -> List[float]:
+        return [d for t, d in zip(self.times.values(), self.durations.values()) if t >= start]
+
+
+class SessionMetrics:
+    def __init__(self, window: float = 60.0, capacity: int = 2048, labels: Optional[Dict[str, str]] = None):
+        self.window = window
+        self.capacity = capacity
+        self.labels = labels
+        self.started = time.monotonic()
+        self._series: Dict[str, _Series] = {}
+        self._exported: Dict[str, Any] = {}  # nombre -> serie de Prometheus con las etiquetas de la sesión
+
+    @classmethod
+    def from_env(cls, labels: Optional[Dict[str, str]] = None) -> "SessionMetrics":
+        return cls(
+            window=float(os.getenv("SESSION_METRICS_WINDOW", 60)),
+            capacity=int(os.getenv("SESSION_METRICS_SAMPLES", 2048)),
+            labels=labels,
+        )
+
+    def _export(self, name: str, counter: bool) -> Any:
+        child = self._exported.get(name)
+        if child is None:
+            default = f"botengine_{name}_total" if counter else f"botengine_{name}_seconds"
+            metric, documentation = EXPORTED.get(name, (default, name))
+            family = REGISTRY.counter(metric, documentation) if counter else REGISTRY.histogram(metric, documentation)
+            child = self._exported[name] = family.labels(**self.labels)
+        return child
+
+    def observe(self, name: str, seconds: float) -> None:
+        series = self._series.get(name)
+        if series is None:
+            series = self._series[name] = _Series(self.capacity)
+        series.add(time.monotonic(), seconds)
+        if self.labels is not None:
+            self._export(name, counter=False).observe(seconds)
+
+    def increment(self, name: str, amount: float = 1.0) -> None:
+        """Contador sin ventana: solo se exporta a Prometheus."""
+        if self.labels is not None:
+            self._export(name, counter=True).inc(amount)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Mide la duración del bloque, termine bien o con excepción."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Resumen de la ventana: mensajes/s y p50/p95 (en segundos) de cada latencia."""
+        now = time.monotonic()
+        start = now - self.window
+        span = max(1.0, min(self.window, now - self.started))
+        result: Dict[str, Any] = {"window": self.window}
+        for name, series in self._series.items():
+            recent = series.since(start)
+            result[name] = {
+                "count": len(recent),
+                "total": series.total,
+                "p50": percentile(recent, 50),
+                "p95": percentile(recent, 95),
+            }
+        handled = result.get(METRIC_HANDLER, {}).get("count", 0)
+        result["messages_per_second"] = round(handled / span, 3)
+        return result
+
+    async def publish_periodically(self, status, interval: float) -> None:
+        """Publica el resumen en el canal de estado cada `interval` segundos."""
+        while True:
+            try:
+                status.publish(STATUS_METRICS, self.snapshot())
+            except Exception as e:
+                logger.error(f"Error al publicar las métricas de la sesión: {e}")
+            await asyncio.sleep(interval)
+
+
+def metrics_interval() -> float:
+    return float(os.getenv("SESSION_METRICS_INTERVAL", 5))
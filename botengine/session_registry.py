@@ -0,0 +1,207 @@
+# session_registry.py
+# Registro de sesiones de los bots con un índice bajo DATA_PATH/sessions/index.json.
+#   - Cada sesión tiene su propio directorio (DATA_PATH/sessions/<plataforma>/<session_id>/), de
+#     modo que descubrir sesiones cuesta O(sesiones) y no O(archivos en DATA_PATH).
+#   - El índice se escribe de forma atómica (archivo temporal + rename) y se relee solo cuando
+#     cambia su mtime.
+#   - migrate_legacy() mueve una sola vez los archivos del formato plano anterior.
+import os
+import json
+import time
+import fcntl
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_DIR_NAME = "sessions"
+INDEX_FILE_NAME = "index.json"
+INDEX_VERSION = 1
+
+PLATFORMS = ("telegram", "whatsapp")
+
+# Nombres de archivo dentro del directorio de cada sesión
+TELEGRAM_SESSION_NAME = "telegram.session"
+AGENT_MEMORY_NAME = "agent_memory.sqlite"
+
+
+def sessions_root(data_path: str) -> str:
+    return os.path.join(data_path, SESSIONS_DIR_NAME)
+
+
+def session_dir(data_path: str, platform: str, session_id: str, create: bool = False) -> str:
+    if platform not in PLATFORMS:
+        raise ValueError(f"Plataforma desconocida: {platform}")
+    if not session_id or os.sep in session_id or session_id in (".", ".."):
+        raise ValueError(f"Nombre de sesión no válido: {session_id!r}")
+    path = os.path.join(sessions_root(data_path), platform, session_id)
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def telegram_session_file(data_path: str, session_id: str) -> str:
+    return os.path.join(session_dir(data_path, "telegram", session_id, create=True), TELEGRAM_SESSION_NAME)
+
+
+def agent_memory_file(data_path: str, platform: str, session_id: str) -> str:
+    return os.path.join(session_dir(data_path, platform, session_id, create=True), AGENT_MEMORY_NAME)
+
+
+def _empty_index() -> Dict[str, Any]:
+    return {"version": INDEX_VERSION, "migrated": False, "sessions": {p: {} for p in PLATFORMS}}
+
+
+class SessionRegistry:
+    """Índice de sesiones compartido por el panel y el supervisor."""
+
+    def __init__(self, data_path: str):
+        self.data_path = data_path
+        self.root = sessions_root(data_path)
+        self.index_path = os.path.join(self.root, INDEX_FILE_NAME)
+        self._lock_path = self.index_path + ".lock"
+        self._lock = threading.Lock()
+        self._index = _empty_index()
+        self._mtime_ns: Optional[int] = None
+        self.reloads = 0
+
+    # --- Lectura con caché por mtime ---
+
+    def _refresh(self) -> None:
+        try:
+            mtime_ns = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            self._index, self._mtime_ns = _empty_index(), None
+            return
+        if mtime_ns == self._mtime_ns:
+            return
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"No se pudo leer el índice de sesiones {self.index_path}: {e}")
+            return
+        for platform in PLATFORMS:
+            index.setdefault("sessions", {}).setdefault(platform, {})
+        self._index, self._mtime_ns = index, mtime_ns
+        self.reloads += 1
+
+    def list(self, platform: str) -> Dict[str, Dict[str, Any]]:
+        """Sesiones registradas de una plataforma: {session_id: metadatos}."""
+        with self._lock:
+            self._refresh()
+            return {sid: dict(meta) for sid, meta in self._index["sessions"].get(platform, {}).items()}
+
+    def get(self, platform: str, session_id: str) -> Optional[Dict[str, Any]]:
+        return self.list(platform).get(session_id)
+
+    # --- Escritura atómica ---
+
+    @contextmanager
+    def _locked_update(self):
+        """Relee el índice bajo un lock entre procesos, permite modificarlo y lo escribe de forma atómica."""
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._mtime_ns = None # Forzar la relectura: otro proceso pudo escribir
+                self._refresh()
+                yield self._index
+                self._write(self._index)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, index: Dict[str, Any]) -> None:
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+        self._mtime_ns = os.stat(self.index_path).st_mtime_ns
+
+    def upsert(self, platform: str, session_id: str, **fields: Any) -> Dict[str, Any]:
+        session_dir(self.data_path, platform, session_id, create=True)
+        with self._locked_update() as index:
+            meta = index["sessions"][platform].setdefault(session_id, {"created_at": time.time()})
+            meta.update({k: v for k, v in fields.items() if v is not None})
+            return dict(meta)
+
+    def remove(self, platform: str, session_id: str, delete_data: bool = True) -> None:
+        with self._locked_update() as index:
+            index["sessions"][platform].pop(session_id, None)
+        if delete_data:
+            shutil.rmtree(session_dir(self.data_path, platform, session_id), ignore_errors=True)
+
+    # --- Migración del formato plano anterior ---
+
+    def migrate_legacy(self) -> int:
+        """Mueve los datos de sesión que estaban sueltos en DATA_PATH a sus directorios. Solo lista DATA_PATH una vez."""
+        if self._index.get("migrated") or self._read_migrated():
+            return 0
+        moved = 0
+        with self._locked_update() as index:
+            if index.get("migrated"):
+                return 0
+            legacy_config = self._read_legacy_config()
+            entries = os.listdir(self.data_path) if os.path.isdir(self.data_path) else []
+            for item in entries:
+                source = os.path.join(self.data_path, item)
+                target = self._legacy_target(item)
+                if target is None:
+                    continue
+                platform, session_id, name = target
+                if name is None:
+                    # Archivos de estado de versiones anteriores: ya no se usan
+                    os.remove(source)
+                    continue
+                destination = os.path.join(session_dir(self.data_path, platform, session_id, create=True), name)
+                if not os.path.exists(destination):
+                    shutil.move(source, destination)
+                    moved += 1
+                meta = index["sessions"][platform].setdefault(session_id, {"created_at": time.time()})
+                meta.update(legacy_config.get(platform, {}).get(session_id, {}))
+            index["migrated"] = True
+        if moved:
+            logger.info(f"Migrados {moved} archivos de sesión al directorio {self.root}")
+        return moved
+
+    def _read_migrated(self) -> bool:
+        with self._lock:
+            self._refresh()
+            return bool(self._index.get("migrated"))
+
+    def _read_legacy_config(self) -> Dict[str, Any]:
+        path = os.path.join(self.data_path, "sessions_config.json")
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _legacy_target(item: str):
+        """(plataforma, session_id, nombre destino) de un archivo del formato plano, o None si no es de una sesión.
+
+        Un nombre destino None indica un archivo obsoleto que se borra.
+        """
+        if item.startswith("chatbot_session_") and ".session" in item:
+            session_id, _, suffix = item[len("chatbot_session_"):].partition(".session")
+            return "telegram", session_id, TELEGRAM_SESSION_NAME + suffix
+        if item.startswith("agent_memory_") and ".sqlite" in item and not item.startswith(("agent_memory_discord", "agent_memory_telegram_host")):
+            session_id, _, suffix = item[len("agent_memory_"):].partition(".sqlite")
+            return "telegram", session_id, AGENT_MEMORY_NAME + suffix
+        if item.startswith("session-"):
+            # Carpeta de LocalAuth de whatsapp-web.js: se conserva el nombre dentro del directorio de la sesión
+            return "whatsapp", item[len("session-"):], item
+        for prefix, platform in (
+            ("telegram_needs_code_", "telegram"), ("telegram_code_", "telegram"),
+            ("telegram_auth_status_", "telegram"), ("telegram_error_", "telegram"),
+            ("whatsapp_auth_status_", "whatsapp"), ("whatsapp_qr_data_url_", "whatsapp"),
+        ):
+            if item.startswith(prefix) and item.endswith(".txt"):
+                return platform, item[len(prefix):-len(".txt")], None
+        return None
@@ -0,0 +1,264 @@
+# status_channel.py
+# Canal local de estado entre los bots y el panel de control (sustituye a los archivos de estado).
+# Un socket Unix bajo DATA_PATH con mensajes JSON por líneas (NDJSON):
+#   bot -> hub: {"type": "hello", "platform", "session_id", "state"} y {"type": "status", "key", "value"}
+#   hub -> bot: {"type": "code", "code"} y otros comandos dirigidos a una sesión
+# Los cambios se notifican al instante en ambos sentidos, sin archivos ni bucles de sondeo.
+import os
+import json
+import socket
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SOCKET_NAME = "botengine_status.sock"
+
+# Claves de estado publicadas por los bots
+STATUS_AUTH = "auth_status"
+STATUS_NEEDS_CODE = "needs_code"
+STATUS_ERROR = "error"
+STATUS_QR = "qr_data_url"
+STATUS_CONNECTED = "channel_connected"
+STATUS_STARTUP = "startup"  # Tiempos de arranque: ready_at (epoch), ready_seconds y desglose
+STATUS_METRICS = "metrics"  # Resumen periódico de botengine/session_metrics.py
+
+MESSAGE_CODE = "code"
+
+
+def status_socket_path(data_path: str) -> str:
+    return os.getenv("STATUS_SOCKET", os.path.join(data_path, SOCKET_NAME))
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class StatusHub:
+    """Servidor del canal. Guarda el último estado de cada sesión y reenvía mensajes a los bots.
+
+    Puede ejecutarse en el event loop de otro componente (`await start()`) o en un hilo propio
+    (`start_in_thread()`), que es lo que usa el panel de Streamlit.
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self._states: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._writers: Dict[Tuple[str, str], asyncio.StreamWriter] = {}
+        self._outbox: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self._version = 0
+        self._cond = threading.Condition()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server = None
+
+    # --- Ciclo de vida ---
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path) # Socket huérfano de una ejecución anterior
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        logger.info(f"Canal de estado escuchando en {self.socket_path}")
+
+    def start_in_thread(self) -> "StatusHub":
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name="status-hub", daemon=True).start()
+        started.wait(timeout=5)
+        return self
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for writer in list(self._writers.values()):
+            writer.close()
+
+    # --- Conexiones de los bots ---
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        key = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                if message.get("type") == "hello":
+                    key = (message.get("platform", ""), message.get("session_id", ""))
+                    self._writers[key] = writer
+                    with self._cond:
+                        state = dict(message.get("state") or {})
+                        state[STATUS_CONNECTED] = True
+                        self._states[key] = state
+                        self._bump()
+                    # Mensajes que llegaron mientras el bot estaba desconectado
+                    for pending in self._outbox.pop(key, []):
+                        writer.write(_encode(pending))
+                    await writer.drain()
+                elif message.get("type") == "status" and key is not None:
+                    self._apply(key, message.get("key"), message.get("value"))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if key is not None and self._writers.get(key) is writer:
+                del self._writers[key]
+                self._apply(key, STATUS_CONNECTED, False)
+            writer.close()
+
+    def _apply(self, key: Tuple[str, str], name: Optional[str], value: Any) -> None:
+        if not name:
+            return
+        with self._cond:
+            state = self._states.setdefault(key, {})
+            if value is None:
+                state.pop(name, None)
+            else:
+                state[name] = value
+            self._bump()
+
+    def _bump(self) -> None:
+        # Se llama con la condición tomada
+        self._version += 1
+        self._cond.notify_all()
+
+    # --- API para el panel (thread-safe) ---
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get_state(self, platform: str, session_id: str) -> Dict[str, Any]:
+        with self._cond:
+            return dict(self._states.get((platform, session_id), {}))
+
+    def clear(self, platform: str, session_id: str) -> None:
+        with self._cond:
+            self._states.pop((platform, session_id), None)
+            self._outbox.pop((platform, session_id), None)
+            self._bump()
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        """Bloquea hasta que el estado cambie respecto a `version` o venza el timeout."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._version != version, timeout=timeout)
+            return self._version
+
+    def send(self, platform: str, session_id: str, message: Dict[str, Any]) -> None:
+        """Envía un mensaje a una sesión; si no está conectada, se entrega al conectarse."""
+        key = (platform, session_id)
+
+        def deliver():
+            writer = self._writers.get(key)
+            if writer is None or writer.is_closing():
+                self._outbox.setdefault(key, []).append(message)
+            else:
+                writer.write(_encode(message))
+
+        if self._loop is None:
+            raise RuntimeError("El canal de estado no está iniciado.")
+        self._loop.call_soon_threadsafe(deliver)
+
+
+class StatusClient:
+    """Cliente asíncrono usado por los bots. Reconecta solo y reenvía su estado al reconectar."""
+
+    def __init__(self, socket_path: str, platform: str, session_id: str, reconnect_max_delay: float = 5.0):
+        self.socket_path = socket_path
+        self.platform = platform
+        self.session_id = session_id
+        self.reconnect_max_delay = reconnect_max_delay
+        self.state: Dict[str, Any] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._inbox: Dict[str, asyncio.Queue] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _queue(self, message_type: str) -> asyncio.Queue:
+        if message_type not in self._inbox:
+            self._inbox[message_type] = asyncio.Queue()
+        return self._inbox[message_type]
+
+    async def _run(self) -> None:
+        delay = 0.1
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+            except (OSError, ConnectionError):
+                await asyncio.sleep(delay)
+                delay = min(self.reconnect_max_delay, delay * 2)
+                continue
+            delay = 0.1
+            self._writer = writer
+            writer.write(_encode({
+                "type": "hello", "platform": self.platform, "session_id": self.session_id, "state": self.state,
+            }))
+            try:
+                await writer.drain()
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._queue(message.get("type", "")).put_nowait(message)
+            except (ConnectionError, OSError):
+                pass
+            finally:
+                self._writer = None
+                writer.close()
+
+    def publish(self, key: str, value: Any) -> None:
+        """Actualiza una clave de estado (None la elimina). No bloquea."""
+        if value is None:
+            self.state.pop(key, None)
+        else:
+            self.state[key] = value
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(_encode({"type": "status", "key": key, "value": value}))
+
+    async def next_message(self, message_type: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Espera el siguiente mensaje del tipo indicado enviado por el panel. None si vence el timeout."""
+        try:
+            return await asyncio.wait_for(self._queue(message_type).get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+def publish_status_sync(socket_path: str, platform: str, session_id: str, state: Dict[str, Any], timeout: float = 1.0) -> bool:
+    """Publicación puntual y bloqueante (p. ej. un error antes de arrancar el event loop)."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(_encode({"type": "hello", "platform": platform, "session_id": session_id, "state": state}))
+        return True
+    except OSError:
+        return False
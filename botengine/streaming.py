@@ -0,0 +1,126 @@
+# streaming.py
+# Envío incremental de respuestas: se manda un primer mensaje en cuanto llegan los primeros
+# tokens del LLM y después se edita en bloques, respetando un intervalo mínimo entre ediciones.
+import os
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Longitud máxima de un mensaje (Telegram); cada canal puede indicar la suya (Discord: 2000)
+DEFAULT_MAX_LENGTH = 4096
+
+
+def streaming_enabled() -> bool:
+    return os.getenv("AGENT_STREAM_REPLIES", "true").strip().lower() in ("1", "true", "yes", "si", "sí")
+
+
+def split_text(text: str, max_length: int = DEFAULT_MAX_LENGTH) -> List[str]:
+    """Parte el texto en mensajes de como mucho `max_length` caracteres, cortando en espacios si es posible."""
+    parts = []
+    while len(text) > max_length:
+        cut = text.rfind(" ", 0, max_length)
+        cut = cut if cut > 0 else max_length
+        parts.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text or not parts:
+        parts.append(text)
+    return parts
+
+
+class StreamingReply:
+    """Consume un flujo de fragmentos de texto y lo refleja en un mensaje que se va editando.
+
+    `send(text)` debe enviar un mensaje nuevo y devolver un objeto que `edit(handle, text)`
+    sepa modificar. Los fragmentos se leen sin esperar a las ediciones, que corren en otra tarea.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[Any]],
+        edit: Callable[[Any, str], Awaitable[Any]],
+        edit_interval: Optional[float] = None,
+        min_first_chars: Optional[int] = None,
+        max_length: int = DEFAULT_MAX_LENGTH,
+    ):
+        self.send = send
+        self.edit = edit
+        self.edit_interval = edit_interval if edit_interval is not None else float(os.getenv("STREAM_EDIT_INTERVAL", 1.0))
+        self.min_first_chars = min_first_chars if min_first_chars is not None else int(os.getenv("STREAM_MIN_FIRST_CHARS", 20))
+        self.max_length = max_length
+
+        self.text = ""
+        self.first_send_latency: Optional[float] = None
+        self.edits = 0
+        self._offset = 0          # Inicio del texto que corresponde al mensaje actual
+        self._handle = None
+        self._shown = ""          # Texto visible en el mensaje actual
+        self._changed = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._done = False
+        self._started_at = 0.0
+
+    async def _publish(self) -> None:
+        pending = self.text[self._offset:]
+        # Si el mensaje actual se llena, se cierra y el resto continúa en uno nuevo
+        while len(pending) > self.max_length:
+            cut = pending.rfind(" ", 0, self.max_length)
+            cut = cut if cut > 0 else self.max_length
+            await self._show(pending[:cut])
+            self._offset += cut
+            self._handle, self._shown = None, ""
+            pending = self.text[self._offset:].lstrip()
+            self._offset = len(self.text) - len(pending)
+        if pending:
+            await self._show(pending)
+
+    async def _show(self, text: str) -> None:
+        if text == self._shown:
+            return
+        if self._handle is None:
+            self._handle = await self.send(text)
+            if self.first_send_latency is None:
+                self.first_send_latency = time.monotonic() - self._started_at
+        else:
+            await self.edit(self._handle, text)
+            self.edits += 1
+        self._shown = text
+
+    async def _editor(self) -> None:
+        while not self._done:
+            await self._changed.wait()
+            self._changed.clear()
+            if self._handle is None and not self._done and len(self.text.strip()) < self.min_first_chars:
+                continue
+            try:
+                await self._publish()
+            except Exception as e:
+                # Un fallo puntual de edición (p. ej. límite de frecuencia) no debe cortar el flujo
+                logger.warning(f"No se pudo actualizar la respuesta en streaming: {e}")
+            if not self._done:
+                # Pausa entre ediciones, interrumpida si el flujo termina
+                try:
+                    await asyncio.wait_for(self._finished.wait(), self.edit_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run(self, chunks: AsyncIterator[str]) -> str:
+        """Envía la respuesta a medida que llegan los fragmentos. Devuelve el texto completo."""
+        self._started_at = time.monotonic()
+        editor = asyncio.ensure_future(self._editor())
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    self.text += chunk
+                    self._changed.set()
+        finally:
+            self._done = True
+            self._finished.set()
+            self._changed.set()
+            await asyncio.gather(editor, return_exceptions=True)
+        # Edición final con el texto completo
+        if self.text.strip():
+            await self._publish()
+        return self.text
@@ -0,0 +1,177 @@
+# structured_log.py
+# Registro estructurado y de bajo coste para los procesos de BotEngine:
+#   - Una línea JSON por registro (LOG_FORMAT=json, por defecto) o texto (LOG_FORMAT=text).
+#   - El formateo se hace en un hilo aparte (QueueHandler + QueueListener): el event loop solo
+#     encola el registro. La cola es acotada; si se llena se descartan registros en vez de bloquear.
+#   - Muestreo por nivel (LOG_SAMPLE_DEBUG, LOG_SAMPLE_INFO, ...: fracción entre 0 y 1). Los
+#     avisos y errores nunca se muestrean.
+#   - Los cuerpos de mensajes (texto, entrada del agente, historial...) se truncan a
+#     LOG_BODY_MAX_CHARS o se ocultan por completo con LOG_REDACT_BODIES=true.
+# Los campos estructurados se pasan con `logger.info("...", extra={"fields": {...}})`.
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+# Claves cuyo valor es contenido de usuario o del agente
+BODY_KEYS = frozenset((
+    "contenidoMensaje", "respuestaBot", "text", "input", "output", "chat_history",
+    "message", "content", "prompt",
+))
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "si", "sí")
+
+
+class BodyRedactor:
+    """Trunca u oculta los cuerpos de mensajes dentro de estructuras anidadas."""
+
+    def __init__(self, max_chars: int = 200, redact: bool = False):
+        self.max_chars = max_chars
+        self.redact = redact
+
+    @classmethod
+    def from_env(cls) -> "BodyRedactor":
+        return cls(int(os.getenv("LOG_BODY_MAX_CHARS", 200)), _env_bool("LOG_REDACT_BODIES", False))
+
+    def body(self, value: Any) -> Any:
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+        if self.redact:
+            return f"[oculto: {len(text)} caracteres]"
+        if len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}… [+{len(text) - self.max_chars} caracteres]"
+        return text
+
+    def fields(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            return {k: self.body(v) if k in BODY_KEYS else self.fields(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.fields(v) for v in value]
+        if isinstance(value, (bytes, bytearray)):
+            return f"[{len(value)} bytes]"
+        return value
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Una línea JSON por registro: ts, level, logger, msg, campos estructurados y excepción."""
+
+    def __init__(self, redactor: Optional[BodyRedactor] = None, service: Optional[str] = None):
+        super().__init__()
+        self.redactor = redactor or BodyRedactor.from_env()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if self.service:
+            entry["service"] = self.service
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry["fields"] = self.redactor.fields(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato de texto clásico; los campos estructurados se añaden como JSON compacto."""
+
+    def __init__(self, redactor: Optional[BodyRedactor] = None):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        self.redactor = redactor or BodyRedactor.from_env()
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + json.dumps(self.redactor.fields(fields), ensure_ascii=False, default=str)
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Deja pasar una fracción de los registros de cada nivel; WARNING y superiores siempre pasan."""
+
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+        self.dropped = 0
+
+    @classmethod
+    def from_env(cls) -> "SamplingFilter":
+        rates = {}
+        for level in (logging.DEBUG, logging.INFO):
+            rate = os.getenv(f"LOG_SAMPLE_{logging.getLevelName(level)}")
+            if rate is not None:
+                rates[level] = max(0.0, min(1.0, float(rate)))
+        return cls(rates)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Encola el registro sin formatearlo; el formateo (y los args) se resuelven en el hilo del listener."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Cola en memoria del mismo proceso: no hace falta volcar msg/args como hace QueueHandler
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1 # Nunca bloquear el event loop por el registro
+
+
+def setup_logging(service: Optional[str] = None, stream=None) -> logging.handlers.QueueListener:
+    """Configura el logger raíz del proceso. Idempotente."""
+    global _listener
+    if _listener is not None:
+        return _listener
+    redactor = BodyRedactor.from_env()
+    if os.getenv("LOG_FORMAT", "json").strip().lower() == "text":
+        formatter: logging.Formatter = TextFormatter(redactor)
+    else:
+        formatter = JsonLinesFormatter(redactor, service)
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter.from_env())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").strip().upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    atexit.register(_listener.stop) # Vaciar la cola al salir
+    return _listener
@@ -0,0 +1,730 @@
+# supervisor.py
+# Demonio supervisor de las sesiones de bots. Es el dueño de todos los procesos:
+#   - Guarda los PIDs y la configuración de cada sesión en DATA_PATH, de modo que al reiniciarse
+#     adopta los procesos que siguen vivos en lugar de perderlos.
+#   - Reinicia los bots caídos con espera exponencial.
+#   - Aplica límites de CPU y memoria (RSS) por sesión con psutil.
+#   - Aloja el canal de estado (StatusHub) y expone una API local (JSON por líneas en un socket Unix).
+#   - Con SUPERVISOR_TELEGRAM_HOST=true, las sesiones de Telegram no tienen proceso propio: se
+#     ejecutan todas en un único proceso host (bots/telegram_host.py) al que se añaden por su API.
+# El panel de Streamlit es solo un cliente de esta API.
+#
+# Uso: python -m botengine.supervisor
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import logging
+import subprocess
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import psutil
+
+from botengine.status_channel import StatusHub, status_socket_path
+from botengine.session_registry import SessionRegistry
+from botengine.structured_log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOTS_DIR = os.path.join(PROJECT_ROOT, "bots")
+
+SOCKET_NAME = "botengine_supervisor.sock"
+STATE_FILE_NAME = "supervisor_state.json"
+
+# Estados de una sesión
+STATE_RUNNING = "running"
+STATE_BACKOFF = "backoff"
+STATE_STOPPED = "stopped"
+
+PLATFORMS = ("telegram", "whatsapp")
+
+# Proceso host de Telegram (modo multisesión)
+HOST_PLATFORM = "telegram_host"
+HOST_SESSION_ID = "host"
+# Variables de la sesión que se pasan al host al añadirla; el resto del entorno es del propio host
+HOSTED_SESSION_KEYS = ("PHONE_NUMBER", "API_ID", "API_HASH")
+
+
+def supervisor_socket_path(data_path: str) -> str:
+    return os.getenv("SUPERVISOR_SOCKET", os.path.join(data_path, SOCKET_NAME))
+
+
+def build_command(platform: str) -> List[str]:
+    if platform == "telegram":
+        return [sys.executable, os.path.join(BOTS_DIR, "telegram.py")]
+    if platform == HOST_PLATFORM:
+        return [sys.executable, os.path.join(BOTS_DIR, "telegram_host.py")]
+    if platform == "whatsapp":
+        # Usar stdbuf para forzar la salida sin búfer para Node.js
+        return ["stdbuf", "-o0", "node", os.path.join(BOTS_DIR, "whatsapp.js")]
+    raise ValueError(f"Plataforma desconocida: {platform}")
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "si", "sí")
+
+
+class SupervisorError(Exception):
+    """Error devuelto por la API del supervisor."""
+
+
+class ManagedSession:
+    """Una sesión de bot supervisada. Lo que se persiste está en `to_dict`."""
+
+    def __init__(self, platform: str, session_id: str, env: Dict[str, str], limits: Dict[str, float], samples: int = 300):
+        self.platform = platform
+        self.session_id = session_id
+        self.env = env
+        self.limits = limits
+        self.desired = STATE_RUNNING
+        self.state = STATE_STOPPED
+        self.pid: Optional[int] = None
+        self.create_time: Optional[float] = None
+        self.started_at: Optional[float] = None
+        self.restarts = 0
+        self.failures = 0
+        self.next_start = 0.0
+        self.last_exit: Optional[int] = None
+        self.last_reason: Optional[str] = None
+        self.rss_mb = 0.0
+        self.cpu_percent = 0.0
+        self.num_fds = 0
+        self.num_threads = 0
+        # Últimas muestras (epoch, cpu %, rss MB, descriptores, hilos), tomadas por el bucle del supervisor
+        self.samples: deque = deque(maxlen=max(1, samples))
+        self.hosted = False  # Sesión ejecutada dentro del proceso host de Telegram
+        self.popen: Optional[subprocess.Popen] = None
+        self.process: Optional[psutil.Process] = None
+        self._tree: Dict[int, psutil.Process] = {}
+        self._over_limit = 0
+        # Parada en curso por exceder los límites; el bucle del supervisor no la espera
+        self._terminating: Optional[asyncio.Task] = None
+
+    @property
+    def key(self) -> str:
+        return f"{self.platform}:{self.session_id}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "platform": self.platform,
+            "session_id": self.session_id,
+            "env": self.env,
+            "limits": self.limits,
+            "desired": self.desired,
+            "pid": self.pid,
+            "create_time": self.create_time,
+            "restarts": self.restarts,
+            "last_exit": self.last_exit,
+            "last_reason": self.last_reason,
+        }
+
+    def info(self) -> Dict[str, Any]:
+        """Vista pública (sin variables de entorno, que pueden contener secretos)."""
+        return {
+            "platform": self.platform,
+            "session_id": self.session_id,
+            "desired": self.desired,
+            "state": self.state,
+            "pid": self.pid,
+            "started_at": self.started_at,
+            "uptime": time.time() - self.started_at if self.started_at and self.state == STATE_RUNNING else None,
+            "restarts": self.restarts,
+            "next_start_in": max(0.0, self.next_start - time.monotonic()) if self.state == STATE_BACKOFF else None,
+            "last_exit": self.last_exit,
+            "last_reason": self.last_reason,
+            "hosted": self.hosted,
+            "rss_mb": round(self.rss_mb, 1),
+            "cpu_percent": round(self.cpu_percent, 1),
+            "num_fds": self.num_fds,
+            "num_threads": self.num_threads,
+            "limits": self.limits,
+        }
+
+
+class Supervisor:
+    def __init__(self, data_path: str):
+        self.data_path = data_path
+        self.socket_path = supervisor_socket_path(data_path)
+        self.state_file = os.path.join(data_path, STATE_FILE_NAME)
+        self.poll_interval = float(os.getenv("SUPERVISOR_POLL_INTERVAL", 1.0))
+        self.backoff_base = float(os.getenv("SUPERVISOR_BACKOFF_BASE", 2.0))
+        self.backoff_max = float(os.getenv("SUPERVISOR_BACKOFF_MAX", 300.0))
+        self.stable_seconds = float(os.getenv("SUPERVISOR_STABLE_SECONDS", 60.0))
+        self.stop_timeout = float(os.getenv("SUPERVISOR_STOP_TIMEOUT", 10.0))
+        # Tiempo que tiene un bot para drenar su trabajo tras SIGTERM antes de terminar su árbol de procesos
+        self.drain_timeout = float(os.getenv("SUPERVISOR_DRAIN_TIMEOUT", 30.0))
+        self.metrics_samples = int(os.getenv("SUPERVISOR_METRICS_SAMPLES", 300))
+        self.limit_grace = max(1, int(os.getenv("SUPERVISOR_LIMIT_GRACE", 3)))
+        self.default_limits = {
+            "max_rss_mb": float(os.getenv("SUPERVISOR_MAX_RSS_MB", 0)),
+            "max_cpu_percent": float(os.getenv("SUPERVISOR_MAX_CPU_PERCENT", 0)),
+        }
+        self.telegram_host = _env_bool("SUPERVISOR_TELEGRAM_HOST", False)
+        self.host_socket_path = os.getenv("TELEGRAM_HOST_SOCKET", os.path.join(data_path, "botengine_telegram_host.sock"))
+        self.sessions: Dict[str, ManagedSession] = {}
+        self.hub = StatusHub(status_socket_path(data_path))
+        self._server = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    # --- Persistencia ---
+
+    def _save(self) -> None:
+        data = {"sessions": [s.to_dict() for s in self.sessions.values()]}
+        tmp_path = f"{self.state_file}.tmp"
+        # El estado incluye credenciales de los bots: solo legible por el propietario
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, self.state_file)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"No se pudo leer el estado del supervisor: {e}")
+            return
+        for item in data.get("sessions", []):
+            session = ManagedSession(
+                item["platform"], item["session_id"], item.get("env", {}), item.get("limits", {}), self.metrics_samples
+            )
+            session.desired = item.get("desired", STATE_STOPPED)
+            session.restarts = item.get("restarts", 0)
+            session.last_exit = item.get("last_exit")
+            session.last_reason = item.get("last_reason")
+            if session.platform == "telegram" and self.telegram_host:
+                # Las sesiones alojadas se vuelven a añadir al host en la reconciliación
+                session.hosted = True
+                self.sessions[session.key] = session
+                continue
+            self._adopt(session, item.get("pid"), item.get("create_time"))
+            self.sessions[session.key] = session
+
+    def _adopt(self, session: ManagedSession, pid: Optional[int], create_time: Optional[float]) -> None:
+        """Recupera un proceso lanzado por una instancia anterior del supervisor si sigue vivo."""
+        if not pid:
+            return
+        try:
+            process = psutil.Process(pid)
+            # El PID puede haberse reutilizado: se comprueba la hora de creación
+            if create_time is None or abs(process.create_time() - create_time) > 1.0:
+                return
+        except psutil.Error:
+            return
+        session.process = process
+        session.pid = pid
+        session.create_time = create_time
+        session.started_at = create_time
+        session.state = STATE_RUNNING
+        logger.info(f"Adoptado el proceso {pid} de la sesión {session.key}")
+
+    # --- Procesos ---
+
+    def _spawn(self, session: ManagedSession) -> None:
+        env = os.environ.copy()
+        env.update(session.env)
+        env.update({"SESSION_ID": session.session_id, "DATA_PATH": self.data_path, "PYTHONUNBUFFERED": "1"})
+        # El bot debe terminar de drenar antes de que venza el plazo del supervisor
+        env.setdefault("BOT_DRAIN_TIMEOUT", str(max(1.0, self.drain_timeout - 5)))
+        try:
+            popen = subprocess.Popen(build_command(session.platform), env=env, cwd=PROJECT_ROOT)
+        except (OSError, ValueError) as e:
+            logger.error(f"No se pudo lanzar la sesión {session.key}: {e}")
+            self._schedule_restart(session, reason=f"spawn_error: {e}")
+            return
+        session.popen = popen
+        session.process = psutil.Process(popen.pid)
+        session.pid = popen.pid
+        session.create_time = session.process.create_time()
+        session.started_at = time.time()
+        session.state = STATE_RUNNING
+        session._tree = {}
+        session._over_limit = 0
+        logger.info(f"Sesión {session.key} iniciada con PID {popen.pid}")
+        self._save()
+
+    def _schedule_restart(self, session: ManagedSession, reason: str) -> None:
+        if session.started_at and time.time() - session.started_at >= self.stable_seconds:
+            session.failures = 0 # Estuvo estable: el contador de fallos vuelve a empezar
+        delay = min(self.backoff_max, self.backoff_base * (2 ** session.failures))
+        session.failures += 1
+        session.restarts += 1
+        session.last_reason = reason
+        session.state = STATE_BACKOFF
+        session.next_start = time.monotonic() + delay
+        session.process = session.popen = None
+        session.pid = None
+        logger.warning(f"Sesión {session.key} caída ({reason}); reinicio en {delay:.1f}s")
+        self._save()
+
+    def _exit_code(self, session: ManagedSession) -> Optional[int]:
+        """Código de salida si el proceso terminó; None si sigue vivo."""
+        if session.popen is not None:
+            return session.popen.poll()
+        if session.process is None:
+            return -1
+        try:
+            if session.process.is_running() and session.process.status() != psutil.STATUS_ZOMBIE:
+                return None
+        except psutil.Error:
+            pass
+        return -1 # Proceso adoptado: no se conoce su código de salida
+
+    async def _terminate(self, session: ManagedSession) -> None:
+        """Detiene la sesión en orden: primero SIGTERM solo al bot, que deja de aceptar mensajes,
+        termina o guarda su trabajo y cierra la sesión; pasado el plazo de drenado se termina todo
+        su árbol de procesos (p. ej. Chromium en WhatsApp) y, si sigue vivo, se mata."""
+        process = session.process
+        if process is None:
+            return
+        try:
+            children = process.children(recursive=True)
+        except psutil.Error:
+            children = []
+        tree = [process] + children
+        try:
+            process.terminate()
+        except psutil.Error:
+            pass
+        if not await self._wait_exit(session, [process], self.drain_timeout):
+            logger.warning(f"La sesión {session.key} no terminó de drenar en {self.drain_timeout:.0f}s")
+        for p in tree:
+            if self._alive(p):
+                try:
+                    p.terminate()
+                except psutil.Error:
+                    pass
+        if await self._wait_exit(session, tree, self.stop_timeout):
+            return
+        for p in tree:
+            if self._alive(p):
+                try:
+                    p.kill()
+                except psutil.Error:
+                    pass
+        await self._wait_exit(session, tree, 1.0)
+
+    async def _wait_exit(self, session: ManagedSession, processes: List[psutil.Process], timeout: float) -> bool:
+        """Espera a que terminen los procesos. Devuelve False si vence el plazo."""
+        deadline = time.monotonic() + timeout
+        while True:
+            if session.popen is not None:
+                session.popen.poll()
+            if not any(self._alive(p) for p in processes):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.1)
+
+    @staticmethod
+    def _alive(process: psutil.Process) -> bool:
+        try:
+            return process.is_running() and process.status() != psutil.STATUS_ZOMBIE
+        except psutil.Error:
+            return False
+
+    def _sample(self, session: ManagedSession) -> None:
+        """Mide CPU, RSS, descriptores abiertos e hilos del árbol de procesos de la sesión."""
+        try:
+            tree = [session.process] + session.process.children(recursive=True)
+        except psutil.Error:
+            return
+        rss = cpu = 0.0
+        fds = threads = 0
+        known = {}
+        for p in tree:
+            # Se reutilizan los objetos Process para que cpu_percent mida desde la muestra anterior
+            p = session._tree.get(p.pid, p)
+            known[p.pid] = p
+            try:
+                with p.oneshot():
+                    rss += p.memory_info().rss
+                    cpu += p.cpu_percent(None)
+                    fds += p.num_fds()
+                    threads += p.num_threads()
+            except psutil.Error:
+                continue
+        session._tree = known
+        session.rss_mb = rss / (1024 * 1024)
+        session.cpu_percent = cpu
+        session.num_fds = fds
+        session.num_threads = threads
+        session.samples.append((round(time.time(), 1), round(cpu, 1), round(session.rss_mb, 1), fds, threads))
+
+    def _limit_exceeded(self, session: ManagedSession) -> Optional[str]:
+        max_rss = session.limits.get("max_rss_mb") or self.default_limits["max_rss_mb"]
+        max_cpu = session.limits.get("max_cpu_percent") or self.default_limits["max_cpu_percent"]
+        reason = None
+        if max_rss and session.rss_mb > max_rss:
+            reason = f"rss_limit ({session.rss_mb:.0f} MB > {max_rss:.0f} MB)"
+        elif max_cpu and session.cpu_percent > max_cpu:
+            reason = f"cpu_limit ({session.cpu_percent:.0f}% > {max_cpu:.0f}%)"
+        # Solo cuenta si se mantiene varias muestras seguidas, para tolerar picos puntuales
+        session._over_limit = session._over_limit + 1 if reason else 0
+        return reason if session._over_limit >= self.limit_grace else None
+
+    async def _monitor(self) -> None:
+        while not self._stopping.is_set():
+            for session in list(self.sessions.values()):
+                if session.hosted:
+                    continue
+                try:
+                    await self._check(session)
+                except Exception as e:
+                    logger.error(f"Error supervisando la sesión {session.key}: {e}")
+            if self.telegram_host:
+                try:
+                    await self._reconcile_host()
+                except Exception as e:
+                    logger.error(f"Error reconciliando el host de Telegram: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _restart_over_limit(self, session: ManagedSession, reason: str) -> None:
+        """Detiene la sesión que excede sus límites y programa su reinicio, fuera del bucle de supervisión."""
+        try:
+            await self._terminate(session)
+            if session.desired != STATE_RUNNING:
+                return # Se detuvo desde la API mientras drenaba: _stop deja el estado final
+            session.last_exit = session.popen.returncode if session.popen is not None else None
+            self._schedule_restart(session, reason=reason)
+        except Exception as e:
+            logger.error(f"Error deteniendo la sesión {session.key}: {e}")
+        finally:
+            session._terminating = None
+
+    async def _check(self, session: ManagedSession) -> None:
+        if session._terminating is not None:
+            return # Drenando por exceder los límites: su salida la gestiona _restart_over_limit
+        if session.state == STATE_RUNNING:
+            code = self._exit_code(session)
+            if code is not None:
+                session.last_exit = code
+                if code == 0 or session.desired != STATE_RUNNING:
+                    # Salida limpia (p. ej. timeout del código de verificación): no se reinicia
+                    logger.info(f"Sesión {session.key} terminó con código {code}")
+                    session.state = STATE_STOPPED
+                    session.desired = STATE_STOPPED
+                    session.process = session.popen = None
+                    session.pid = None
+                    self._save()
+                else:
+                    self._schedule_restart(session, reason=f"exit {code}")
+                return
+            self._sample(session)
+            reason = self._limit_exceeded(session)
+            if reason:
+                # El drenado puede tardar drain_timeout + stop_timeout: mientras, el resto de sesiones
+                # se sigue supervisando
+                session._terminating = asyncio.ensure_future(self._restart_over_limit(session, reason))
+        elif session.state == STATE_BACKOFF and session.desired == STATE_RUNNING:
+            if time.monotonic() >= session.next_start:
+                self.hub.clear(session.platform, session.session_id)
+                self._spawn(session)
+        elif session.state == STATE_STOPPED and session.desired == STATE_RUNNING:
+            self._spawn(session)
+
+    # --- Host de Telegram ---
+
+    async def _host_call(self, method: str, **params: Any) -> Any:
+        reader, writer = await asyncio.open_unix_connection(self.host_socket_path)
+        try:
+            writer.write((json.dumps({"id": 1, "method": method, "params": params}) + "\n").encode("utf-8"))
+            await writer.drain()
+            # Retirar una sesión incluye su drenado
+            line = await asyncio.wait_for(reader.readline(), self.drain_timeout + self.stop_timeout)
+        finally:
+            writer.close()
+        if not line:
+            raise SupervisorError("El host de Telegram cerró la conexión sin responder.")
+        response = json.loads(line)
+        if "error" in response:
+            raise SupervisorError(response["error"])
+        return response.get("result")
+
+    def _host_session(self, env: Optional[Dict[str, str]] = None) -> ManagedSession:
+        key = f"{HOST_PLATFORM}:{HOST_SESSION_ID}"
+        host = self.sessions.get(key)
+        if host is None:
+            # El host hereda el entorno común (p. ej. OPENAI_API_KEY) de la sesión que lo arranca
+            common_env = {k: v for k, v in (env or {}).items() if k not in HOSTED_SESSION_KEYS}
+            host = ManagedSession(HOST_PLATFORM, HOST_SESSION_ID, common_env, {}, self.metrics_samples)
+            host.desired = STATE_STOPPED
+            self.sessions[key] = host
+        return host
+
+    async def _reconcile_host(self) -> None:
+        """Lleva el host al estado deseado: arrancado si hay sesiones alojadas activas y con esas sesiones añadidas."""
+        hosted = [s for s in self.sessions.values() if s.hosted]
+        wanted = [s for s in hosted if s.desired == STATE_RUNNING]
+        host = self.sessions.get(f"{HOST_PLATFORM}:{HOST_SESSION_ID}")
+        if host is None and not wanted:
+            return
+        host = host or self._host_session(wanted[0].env)
+        if wanted and host.desired != STATE_RUNNING:
+            host.desired = STATE_RUNNING
+        elif not wanted and host.desired == STATE_RUNNING:
+            await self._stop(host)
+        if host.state != STATE_RUNNING:
+            for session in wanted:
+                session.state = STATE_BACKOFF if host.state == STATE_BACKOFF else STATE_STOPPED
+                session.next_start = host.next_start
+            return
+
+        try:
+            running = {item["session_id"]: item for item in await self._host_call("list")}
+        except (OSError, SupervisorError, ValueError):
+            return # El host todavía está arrancando
+        changed = False
+        for session in hosted:
+            item = running.get(session.session_id)
+            if session.desired != STATE_RUNNING:
+                if item is not None:
+                    await self._host_call("remove", session_id=session.session_id)
+                continue
+            if item is not None and item.get("running"):
+                session.state = STATE_RUNNING
+                session.pid = host.pid
+                continue
+            if item is not None:
+                # La sesión terminó dentro del host: mismo criterio que la salida de un proceso
+                session.last_reason = item.get("reason")
+                if item.get("reason") == "exit":
+                    session.desired = session.state = STATE_STOPPED
+                    await self._host_call("remove", session_id=session.session_id)
+                    changed = True
+                    continue
+                if session.state != STATE_BACKOFF:
+                    self._schedule_restart(session, reason=item.get("reason") or "error")
+                    continue
+            if session.state == STATE_BACKOFF and time.monotonic() < session.next_start:
+                continue
+            env = session.env
+            try:
+                await self._host_call(
+                    "add", session_id=session.session_id, phone=env.get("PHONE_NUMBER"),
+                    api_id=env.get("API_ID"), api_hash=env.get("API_HASH"),
+                )
+            except SupervisorError as e:
+                self._schedule_restart(session, reason=str(e))
+                continue
+            self.hub.clear(session.platform, session.session_id)
+            session.state = STATE_RUNNING
+            session.started_at = time.time()
+            session.pid = host.pid
+            changed = True
+        if changed:
+            self._save()
+
+    # --- API ---
+
+    async def api_start(self, platform: str, session_id: str, env: Optional[Dict[str, str]] = None,
+                        limits: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        if platform not in PLATFORMS:
+            raise SupervisorError(f"Plataforma desconocida: {platform}")
+        if not session_id:
+            raise SupervisorError("El nombre de la sesión no puede estar vacío.")
+        key = f"{platform}:{session_id}"
+        session = self.sessions.get(key)
+        if session is not None:
+            await self._stop(session)
+            session.env = env if env is not None else session.env
+            session.limits = limits if limits is not None else session.limits
+        else:
+            session = ManagedSession(platform, session_id, env or {}, limits or {}, self.metrics_samples)
+            self.sessions[key] = session
+        session.desired = STATE_RUNNING
+        session.failures = 0
+        self.hub.clear(platform, session_id)
+        if platform == "telegram" and self.telegram_host:
+            # Se añade al host en la siguiente reconciliación (inmediata)
+            session.hosted = True
+            session.state = STATE_STOPPED
+            self._host_session(session.env)
+            await self._reconcile_host()
+            self._save()
+        else:
+            self._spawn(session)
+        return session.info()
+
+    async def _stop(self, session: ManagedSession, purge: bool = False) -> None:
+        session.desired = STATE_STOPPED
+        if session.hosted:
+            try:
+                await self._host_call("remove", session_id=session.session_id, purge=purge)
+            except (OSError, SupervisorError) as e:
+                logger.warning(f"No se pudo retirar la sesión {session.key} del host: {e}")
+        elif session._terminating is not None:
+            await asyncio.shield(session._terminating) # Ya se está deteniendo por exceder los límites
+        else:
+            await self._terminate(session)
+        session.state = STATE_STOPPED
+        session.process = session.popen = None
+        session.pid = None
+        self._save()
+
+    async def api_stop(self, platform: str, session_id: str) -> Dict[str, Any]:
+        session = self._get(platform, session_id)
+        await self._stop(session)
+        return session.info()
+
+    async def api_remove(self, platform: str, session_id: str) -> bool:
+        session = self.sessions.get(f"{platform}:{session_id}")
+        if session is not None:
+            await self._stop(session, purge=True)
+            del self.sessions[session.key]
+            self._save()
+        self.hub.clear(platform, session_id)
+        return True
+
+    async def api_list(self) -> List[Dict[str, Any]]:
+        return [self._describe(s) for s in self.sessions.values()]
+
+    async def api_status(self, platform: str, session_id: str) -> Dict[str, Any]:
+        session = self.sessions.get(f"{platform}:{session_id}")
+        info = session.info() if session is not None else {"platform": platform, "session_id": session_id, "state": STATE_STOPPED}
+        info["status"] = self.hub.get_state(platform, session_id)
+        if session is not None:
+            # En modo host los recursos son los del proceso compartido por todas las cuentas
+            sampled = self.sessions.get(f"{HOST_PLATFORM}:{HOST_SESSION_ID}") if session.hosted else session
+            info["samples"] = list(sampled.samples) if sampled is not None else []
+            if session.hosted and sampled is not None:
+                info.update({k: sampled.info()[k] for k in ("rss_mb", "cpu_percent", "num_fds", "num_threads")})
+        return info
+
+    async def api_send(self, platform: str, session_id: str, message: Dict[str, Any]) -> bool:
+        self.hub.send(platform, session_id, message)
+        return True
+
+    async def api_ping(self) -> Dict[str, Any]:
+        return {"pid": os.getpid(), "sessions": len(self.sessions)}
+
+    def _describe(self, session: ManagedSession) -> Dict[str, Any]:
+        info = session.info()
+        info["status"] = self.hub.get_state(session.platform, session.session_id)
+        return info
+
+    def _get(self, platform: str, session_id: str) -> ManagedSession:
+        session = self.sessions.get(f"{platform}:{session_id}")
+        if session is None:
+            raise SupervisorError(f"La sesión '{session_id}' de {platform} no existe.")
+        return session
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request_id = None
+                try:
+                    request = json.loads(line)
+                    request_id = request.get("id")
+                    method = getattr(self, f"api_{request.get('method', '')}", None)
+                    if method is None:
+                        raise SupervisorError(f"Método desconocido: {request.get('method')}")
+                    response = {"id": request_id, "result": await method(**(request.get("params") or {}))}
+                except (SupervisorError, TypeError, ValueError) as e:
+                    response = {"id": request_id, "error": str(e)}
+                writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # --- Ciclo de vida ---
+
+    async def run(self) -> None:
+        self._stopping = asyncio.Event()
+        os.makedirs(self.data_path, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path) # Socket huérfano de una ejecución anterior
+        await self.hub.start()
+        # Mover los datos del formato plano anterior antes de lanzar o adoptar ningún bot
+        SessionRegistry(self.data_path).migrate_legacy()
+        self._load()
+        self._server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        logger.info(f"Supervisor escuchando en {self.socket_path} ({len(self.sessions)} sesiones)")
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self._stopping.set)
+        try:
+            await self._monitor()
+        finally:
+            # Los bots siguen vivos: la siguiente instancia del supervisor los adopta
+            self._save()
+            self._server.close()
+            await self.hub.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            logger.info("Supervisor detenido.")
+
+
+class SupervisorClient:
+    """Cliente síncrono de la API del supervisor, usado por el panel de Streamlit."""
+
+    def __init__(self, socket_path: str, timeout: float = 60.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._next_id = 0
+
+    def call(self, method: str, **params: Any) -> Any:
+        self._next_id += 1
+        request = {"id": self._next_id, "method": method, "params": params}
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            with sock.makefile("r", encoding="utf-8") as f:
+                line = f.readline()
+        if not line:
+            raise SupervisorError("El supervisor cerró la conexión sin responder.")
+        response = json.loads(line)
+        if "error" in response:
+            raise SupervisorError(response["error"])
+        return response.get("result")
+
+    def is_alive(self) -> bool:
+        try:
+            self.call("ping")
+            return True
+        except (OSError, SupervisorError, ValueError):
+            return False
+
+
+def ensure_supervisor(data_path: str, wait: float = 10.0) -> SupervisorClient:
+    """Devuelve un cliente del supervisor, lanzándolo en segundo plano si no está en marcha."""
+    client = SupervisorClient(supervisor_socket_path(data_path))
+    if client.is_alive():
+        return client
+    env = os.environ.copy()
+    env["DATA_PATH"] = data_path
+    # Nueva sesión de proceso: el supervisor sobrevive a los reinicios del panel
+    subprocess.Popen([sys.executable, "-m", "botengine.supervisor"], cwd=PROJECT_ROOT, env=env, start_new_session=True)
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        if client.is_alive():
+            return client
+        time.sleep(0.1)
+    raise SupervisorError("No se pudo iniciar el supervisor de sesiones.")
+
+
+def main() -> None:
+    setup_logging("supervisor")
+    data_path = os.getenv("DATA_PATH", PROJECT_ROOT)
+    asyncio.run(Supervisor(data_path).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# telegram_adapter.py
+# Adaptador de Telegram (Telethon) al registro común de botengine/messages.py.
+import os
+from datetime import datetime
+from typing import Optional
+
+from telethon.tl.types import Chat, Channel, MessageMediaPhoto, MessageMediaDocument
+
+from botengine.messages import (
+    AttachmentRef, NormalizedMessage, CHAT_GROUP, CHAT_PRIVATE, media_type_from_mime
+)
+
+
+def media_content_id(event) -> Optional[str]:
+    """Identificador estable del archivo: los reenvíos de una misma foto o documento conservan su ID."""
+    if isinstance(event.media, MessageMediaPhoto) and event.media.photo:
+        return f"tg-photo:{event.media.photo.id}"
+    if isinstance(event.media, MessageMediaDocument) and event.media.document:
+        return f"tg-doc:{event.media.document.id}"
+    return None
+
+
+def _attachment(event, client, temp_dir: str, session_id: str) -> Optional[AttachmentRef]:
+    """Referencia al archivo del mensaje, o None si el medio no tiene archivo (encuestas, ubicaciones...)."""
+    media_file = event.file
+    file_size = media_file.size if media_file else None
+    if isinstance(event.media, MessageMediaPhoto):
+        file_type, mime_type = "image", "image/jpeg"
+        media_location = event.media.photo # La foto (no el wrapper) para descargar el tamaño mayor
+    elif isinstance(event.media, MessageMediaDocument):
+        media_location = event.media.document
+        mime_type = event.media.document.mime_type
+        # La API espera "audio"/"image" o el MIME type completo para el resto de documentos
+        file_type = mime_type or "unknown"
+        if file_type.startswith("audio/"):
+            file_type = "audio"
+        elif file_type.startswith("image/"):
+            file_type = "image"
+    else:
+        return None
+
+    extension = (media_file.ext if media_file else "") or ""
+    filename = (media_file.name if media_file else None) or f"telegram_{event.id}{extension}"
+
+    async def download_to_file():
+        # Solo para archivos por encima de MEDIA_TEMP_FILE_MIN_BYTES
+        os.makedirs(temp_dir, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return await event.download_media(file=os.path.join(temp_dir, f"telegram_{session_id}_{event.id}_{timestamp}"))
+
+    return AttachmentRef(
+        type=file_type,
+        filename=filename,
+        size=file_size,
+        mime_type=None, # El esquema de Telegram no incluye mime_type por adjunto
+        download_bytes=lambda: client.download_media(event.message, file=bytes),
+        stream_factory=lambda: client.iter_download(media_location, file_size=file_size),
+        download_to_file=download_to_file,
+        media_id=media_content_id(event),
+    )
+
+
+def normalize_telegram(event, sender, chat, me, client, mentioned: bool, temp_dir: str, session_id: str) -> NormalizedMessage:
+    """Registro común a partir de un evento NewMessage con el remitente y el chat ya resueltos."""
+    sender_name = sender.first_name or "Desconocido"
+    if sender.last_name:
+        sender_name += f" {sender.last_name}"
+    is_group = isinstance(chat, (Chat, Channel))
+
+    message_type, mime_type = "text", None
+    attachments = []
+    if event.media:
+        if isinstance(event.media, MessageMediaPhoto):
+            message_type, mime_type = "image", "image/jpeg"
+        elif isinstance(event.media, MessageMediaDocument):
+            mime_type = event.media.document.mime_type
+            message_type = media_type_from_mime(mime_type)
+        else:
+            message_type, mime_type = "media", "unknown"
+        attachment = _attachment(event, client, temp_dir, session_id)
+        if attachment is not None:
+            attachments.append(attachment)
+
+    return NormalizedMessage(
+        platform="telegram",
+        message_id=event.id,
+        chat_id=event.chat_id,
+        chat_type=CHAT_GROUP if is_group else CHAT_PRIVATE,
+        chat_title=chat.title if is_group else None,
+        sender_id=sender.id,
+        sender_name=sender_name,
+        sender_username=sender.username,
+        sender_is_bot=bool(sender.bot),
+        recipient=me.first_name or "BotEngine",
+        text=event.raw_text,
+        timestamp=event.date,
+        message_type=message_type,
+        mime_type=mime_type,
+        is_forward=bool(event.forward),
+        is_reply=bool(event.is_reply),
+        mentioned=mentioned,
+        attachments=attachments,
+    )
@@ -0,0 +1,182 @@
+# verdict_cache.py
+# Caché de veredictos de la API de Phishing indexada por contenido.
+# La clave combina el hash del texto normalizado y los hashes de los adjuntos, de modo que una
+# misma estafa reenviada a muchos chats solo se analiza una vez. Dos niveles:
+#   - L1: LRU en memoria del proceso (microsegundos).
+#   - L2: SQLite en modo WAL bajo DATA_PATH, compartido por todas las sesiones de bots. Las lecturas y
+#     escrituras en disco se hacen en el pool de tareas bloqueantes (botengine/runtime.py), nunca en el
+#     event loop: la base es compartida y una escritura de otro proceso puede retenerla hasta 5 s.
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from typing import Any, Dict, Iterable, Optional
+
+from botengine.ttl_cache import TTLCache
+from botengine.runtime import run_blocking
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Normaliza el texto para que variaciones triviales (mayúsculas, espacios) compartan veredicto."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def verdict_key(text: Optional[str], attachment_hashes: Iterable[str] = ()) -> Optional[str]:
+    """Clave de la caché, o None si el mensaje no tiene contenido que analizar."""
+    normalized = normalize_text(text)
+    hashes = sorted(h for h in attachment_hashes if h)
+    if not normalized and not hashes:
+        return None
+    digest = hashlib.sha256(normalized.encode("utf-8"))
+    for h in hashes:
+        digest.update(b"\x00" + h.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def content_hash(content: bytes) -> str:
+    return "sha256:" + hashlib.sha256(content).hexdigest()
+
+
+class VerdictCache:
+    """Caché de dos niveles (memoria + SQLite compartido) con TTL y expulsión LRU."""
+
+    def __init__(
+        self,
+        path: Optional[str],
+        ttl: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        memory_size: Optional[int] = None,
+    ):
+        self.ttl = ttl if ttl is not None else float(os.getenv("VERDICT_CACHE_TTL", 6 * 3600))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("VERDICT_CACHE_MAX_ENTRIES", 50000))
+        self.memory = TTLCache(
+            maxsize=memory_size if memory_size is not None else int(os.getenv("VERDICT_CACHE_MEMORY_SIZE", 5000)),
+            ttl=self.ttl,
+        )
+        self.path = path
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.stores = 0
+        self._sets_since_trim = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS verdicts ("
+                    "key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS verdicts_last_access ON verdicts(last_access)")
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"No se pudo abrir la caché de veredictos en {path}, se usará solo memoria: {e}")
+                self._conn = None
+
+    @classmethod
+    def from_env(cls, data_path: str) -> "VerdictCache":
+        enabled = os.getenv("VERDICT_CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes", "si", "sí")
+        path = os.getenv("VERDICT_CACHE_FILE", os.path.join(data_path, "verdict_cache.sqlite"))
+        return cls(path if enabled else None, max_entries=None if enabled else 0)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _lookup(self, key: str, now: float) -> Optional[tuple]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, expires_at FROM verdicts WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE verdicts SET last_access = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+        return row
+
+    async def get(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Busca un veredicto: primero en memoria y, si no está, en disco fuera del event loop."""
+        if key is None or not self.enabled:
+            return None
+        response = self.memory.get(key)
+        if response is not None:
+            self.hits_memory += 1
+            return response
+        if self._conn is not None:
+            now = time.time()
+            try:
+                row = await run_blocking(self._lookup, key, now)
+            except sqlite3.Error as e:
+                logger.warning(f"Error al leer la caché de veredictos: {e}")
+                row = None
+            if row is not None:
+                response = json.loads(row[0])
+                self.memory.set(key, response, ttl=row[1] - now)
+                self.hits_disk += 1
+                return response
+        self.misses += 1
+        return None
+
+    def _store(self, key: str, payload: str, expires_at: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO verdicts (key, response, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, expires_at, now),
+            )
+            self._sets_since_trim += 1
+            if self._sets_since_trim >= 100:
+                # Limpieza periódica: caducados y, si se supera el máximo, los menos usados
+                self._sets_since_trim = 0
+                self._conn.execute("DELETE FROM verdicts WHERE expires_at <= ?", (now,))
+                self._conn.execute(
+                    "DELETE FROM verdicts WHERE key IN (SELECT key FROM verdicts ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    async def set(self, key: Optional[str], response: Optional[Dict[str, Any]]) -> None:
+        """Guarda un veredicto. La escritura en disco se hace fuera del event loop."""
+        if key is None or not response or not self.enabled:
+            return
+        self.memory.set(key, response)
+        self.stores += 1
+        if self._conn is None:
+            return
+        try:
+            payload = json.dumps(response, ensure_ascii=False)
+            await run_blocking(self._store, key, payload, time.time() + self.ttl)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"Error al guardar en la caché de veredictos: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+            "memory_size": len(self.memory),
+        }
+
+    def close(self) -> None:
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+            self._conn = None
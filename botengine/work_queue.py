@@ -0,0 +1,289 @@
+# work_queue.py
+# Colas acotadas por chat procesadas por un pool de workers.
+# Los mensajes de un mismo chat se procesan en orden (nunca hay dos a la vez del mismo chat),
+# mientras que chats distintos avanzan en paralelo hasta el número de workers configurado.
+# Con la política delay, los productores que esperan hueco forman una cola FIFO por chat: cada hueco
+# que libera un worker pasa al primero de ellos, y los envíos nuevos esperan detrás, así que el orden
+# de llegada se mantiene también bajo contrapresión.
+import os
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+POLICY_DROP = "drop"          # Descarta el mensaje nuevo si la cola del chat está llena
+POLICY_COALESCE = "coalesce"  # Fusiona el mensaje nuevo con el último pendiente
+POLICY_DELAY = "delay"        # Espera a que haya hueco (hasta max_delay) antes de descartar
+POLICIES = (POLICY_DROP, POLICY_COALESCE, POLICY_DELAY)
+
+
+class _ChatQueue:
+    __slots__ = ("items", "scheduled", "waiters")
+
+    def __init__(self):
+        self.items: Deque[Any] = deque()
+        self.scheduled = False  # True si el chat está en la cola de listos o en proceso
+        # Productores esperando hueco (política delay), en orden de llegada: (futuro, elemento)
+        self.waiters: Deque[Tuple["asyncio.Future[bool]", Any]] = deque()
+
+    def prune_waiters(self) -> None:
+        """Quita los productores que ya no esperan (plazo vencido o cancelados)."""
+        while self.waiters and self.waiters[0][0].done():
+            self.waiters.popleft()
+
+
+class ChatWorkQueue:
+    """Pool de workers con una cola acotada por chat y política de contrapresión."""
+
+    def __init__(
+        self,
+        process: Callable[[Any], Awaitable[None]],
+        num_workers: int = 8,
+        max_queue_per_chat: int = 20,
+        policy: str = POLICY_DELAY,
+        max_delay: float = 10.0,
+        coalesce: Optional[Callable[[Any, Any], Any]] = None,
+        name: str = "chat-queue",
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Política de cola desconocida: {policy}. Opciones: {', '.join(POLICIES)}")
+        self.process = process
+        self.num_workers = max(1, num_workers)
+        self.max_queue_per_chat = max(1, max_queue_per_chat)
+        self.policy = policy
+        self.max_delay = max_delay
+        # Por defecto, al fusionar se conserva el elemento más reciente
+        self.coalesce = coalesce or (lambda old, new: new)
+        self.name = name
+
+        self._chats: Dict[Hashable, _ChatQueue] = {}
+        self._ready: Optional["asyncio.Queue[Hashable]"] = None
+        self._idle: Optional[asyncio.Event] = None  # Activo cuando no hay nada encolado ni en proceso
+        self._queued = 0
+        self._workers = []
+        self._accepting = True
+        self._processing: Dict[int, Any] = {}  # worker -> (chat, elemento) en proceso
+        # Elementos (chat, elemento) sin terminar al detener la cola sin vaciarla del todo
+        self.unfinished: List[Tuple[Hashable, Any]] = []
+
+        # Métricas
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.delayed = 0
+        self.in_flight = 0
+        self.max_depth_seen = 0
+
+    @classmethod
+    def from_env(cls, process: Callable[[Any], Awaitable[None]], prefix: str, **kwargs) -> "ChatWorkQueue":
+        """Crea la cola leyendo <prefix>_WORKERS, _CHAT_QUEUE_SIZE, _QUEUE_POLICY y _QUEUE_MAX_DELAY.
+
+        Los argumentos explícitos en `kwargs` tienen prioridad sobre las variables de entorno.
+        """
+        options = {
+            "num_workers": int(os.getenv(f"{prefix}_WORKERS", 8)),
+            "max_queue_per_chat": int(os.getenv(f"{prefix}_CHAT_QUEUE_SIZE", 20)),
+            "policy": os.getenv(f"{prefix}_QUEUE_POLICY", POLICY_DELAY).lower(),
+            "max_delay": float(os.getenv(f"{prefix}_QUEUE_MAX_DELAY", 10)),
+        }
+        options.update(kwargs)
+        return cls(process, **options)
+
+    # --- Ciclo de vida ---
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._accepting = True
+        # La cola se crea aquí para quedar ligada al event loop en ejecución
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+            self._idle = asyncio.Event()
+            self._idle.set()
+        self._workers = [
+            asyncio.ensure_future(self._worker(i)) for i in range(self.num_workers)
+        ]
+        logger.info(f"[{self.name}] {self.num_workers} workers iniciados (cola por chat={self.max_queue_per_chat}, política={self.policy}).")
+
+    async def join(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que se vacíen las colas. Devuelve False si vence el timeout."""
+        if self._idle is None or self._idle.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def stop(self, drain: bool = True, timeout: Optional[float] = None) -> bool:
+        """Deja de aceptar elementos, opcionalmente vacía las colas y detiene los workers.
+
+        Lo que quede sin procesar (en curso y encolado, en ese orden) se guarda en `unfinished`.
+        """
+        self._accepting = False
+        self._reject_waiters()
+        drained = await self.join(timeout) if drain else False
+        self.unfinished = self.pending()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        return drained
+
+    # --- Encolado ---
+
+    def _schedule(self, key: Hashable, chat: _ChatQueue) -> None:
+        if not chat.scheduled:
+            chat.scheduled = True
+            self._ready.put_nowait(key)
+
+    def _push(self, key: Hashable, chat: _ChatQueue, item: Any) -> None:
+        chat.items.append(item)
+        self._queued += 1
+        self._idle.clear()
+        self.enqueued += 1
+        self.max_depth_seen = max(self.max_depth_seen, len(chat.items))
+        self._schedule(key, chat)
+
+    async def submit(self, key: Hashable, item: Any) -> bool:
+        """Encola un elemento para el chat `key`. Devuelve False si fue descartado."""
+        if not self._accepting:
+            self.dropped += 1
+            return False
+
+        chat = self._chats.get(key)
+        if chat is None:
+            chat = self._chats[key] = _ChatQueue()
+
+        chat.prune_waiters()
+        # Con productores esperando, el hueco libre es del primero de ellos: el nuevo se pone detrás
+        if len(chat.items) < self.max_queue_per_chat and not chat.waiters:
+            self._push(key, chat, item)
+            return True
+
+        if self.policy == POLICY_COALESCE:
+            chat.items[-1] = self.coalesce(chat.items[-1], item)
+            self.coalesced += 1
+            return True
+
+        if self.policy == POLICY_DELAY:
+            self.delayed += 1
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            chat.waiters.append((waiter, item))
+            # Al vencer el plazo se descarta; si antes se libera un hueco, el worker encola el elemento
+            timer = loop.call_later(self.max_delay, self._expire_waiter, waiter)
+            try:
+                if await waiter:
+                    return True
+            finally:
+                timer.cancel()
+
+        self.dropped += 1
+        logger.warning(f"[{self.name}] Cola del chat {key} llena ({self.max_queue_per_chat}). Mensaje descartado.")
+        return False
+
+    @staticmethod
+    def _expire_waiter(waiter: "asyncio.Future[bool]") -> None:
+        if not waiter.done():
+            waiter.set_result(False)
+
+    def _admit_waiters(self, key: Hashable, chat: _ChatQueue) -> None:
+        """Pasa los huecos libres del chat a los productores que esperan, por orden de llegada."""
+        chat.prune_waiters()
+        while chat.waiters and len(chat.items) < self.max_queue_per_chat:
+            waiter, item = chat.waiters.popleft()
+            if waiter.done():
+                continue
+            if self._accepting:
+                self._push(key, chat, item)
+            waiter.set_result(self._accepting)
+
+    def _reject_waiters(self) -> None:
+        """Al detener la cola, los productores que esperaban hueco se descartan sin esperar al plazo."""
+        for chat in self._chats.values():
+            while chat.waiters:
+                waiter, _ = chat.waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(False)
+
+    # --- Workers ---
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            key = await self._ready.get()
+            chat = self._chats.get(key)
+            if chat is None or not chat.items:
+                if chat is not None:
+                    chat.scheduled = False
+                continue
+
+            item = chat.items.popleft()
+            self._queued -= 1
+            self._admit_waiters(key, chat)
+            self.in_flight += 1
+            self._processing[worker_id] = (key, item)
+            try:
+                await self.process(item)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"[{self.name}] Error procesando elemento del chat {key}: {e}")
+            finally:
+                self.in_flight -= 1
+                self._processing.pop(worker_id, None)
+            if not self._queued and not self.in_flight:
+                self._idle.set()
+
+            if chat.items:
+                # Se reencola al final para repartir los workers entre chats
+                self._ready.put_nowait(key)
+            else:
+                chat.scheduled = False
+                chat.prune_waiters()
+                if not chat.waiters and self._chats.get(key) is chat:
+                    del self._chats[key]
+
+    # --- Métricas ---
+
+    def pending(self) -> List[Tuple[Hashable, Any]]:
+        """Elementos en proceso y encolados, como pares (chat, elemento)."""
+        items = list(self._processing.values())
+        for key, chat in self._chats.items():
+            items.extend((key, item) for item in chat.items)
+        return items
+
+    def depth(self) -> int:
+        return sum(len(chat.items) for chat in self._chats.values())
+
+    def queued(self, key: Hashable, match: Optional[Callable[[Any], bool]] = None) -> int:
+        """Elementos encolados (sin contar el que está en proceso) del chat `key` que cumplen `match`."""
+        chat = self._chats.get(key)
+        if chat is None:
+            return 0
+        if match is None:
+            return len(chat.items)
+        return sum(1 for item in chat.items if match(item))
+
+    def stats(self) -> Dict[str, Any]:
+        depths = {key: len(chat.items) for key, chat in self._chats.items() if chat.items}
+        return {
+            "depth": sum(depths.values()),
+            "active_chats": len(self._chats),
+            "max_chat_depth": max(depths.values(), default=0),
+            "max_depth_seen": self.max_depth_seen,
+            "in_flight": self.in_flight,
+            "workers": len(self._workers),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "delayed": self.delayed,
+        }
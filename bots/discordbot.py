@@ -1,11 +1,9 @@
 import discord
 import os
-import json
-import requests
-from datetime import datetime
 from dotenv import load_dotenv
 from discord.ext import commands
 import sys 
+import logging
 
 # Añadir el directorio padre al sys.path para encontrar el módulo langgraph
 current_script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -15,7 +13,23 @@ sys.path.append(project_root)
 dotenv_path = os.path.join(project_root, '.env') # Ruta explícita al .env en la raíz
 load_dotenv(dotenv_path) # Cargar el .env desde la ruta especificada
 
-from langgraph.agente_impersonador import create_langgraph_agent # <--- Nueva importación
+# langchain/langgraph se importan en segundo plano al construir el agente (AgentLoader)
+from botengine.agent_loader import AgentLoader
+from botengine.phishing_api import create_phishing_client_from_env
+from botengine.verdict_cache import VerdictCache
+from botengine.work_queue import ChatWorkQueue
+from botengine.messages import ReplyChannel, handle_message
+from botengine.reply_gate import ReplyGate
+from botengine.discord_adapter import normalize_discord
+from botengine.structured_log import setup_logging
+from botengine.runtime import install_event_loop_policy
+from botengine.session_metrics import SessionMetrics, METRIC_HANDLER, METRIC_RECEIVED
+from botengine.prometheus_metrics import (
+    REGISTRY, start_process_metrics, work_queue_samples, verdict_cache_samples, token_samples
+)
+
+# Registro en líneas JSON con muestreo y cuerpos truncados, fuera del event loop (LOG_FORMAT, LOG_LEVEL...)
+setup_logging("discord")
 
 # Credenciales del Bot de Discord (debe estar en .env)
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
@@ -37,11 +51,29 @@ if not (PHISHING_API_USER and PHISHING_API_PASSWORD and TOKEN_URL and PHISHING_A
     print("Asegúrate de definir PHISHING_API_USER, PHISHING_API_PASSWORD, TOKEN_URL, y PHISHING_API_URL en tu archivo .env")
     sys.exit(1)
 
-# Variable global para el token
-phishing_jwt_token = None
+# Memoria persistente del agente bajo DATA_PATH
+DATA_PATH = os.getenv("DATA_PATH", project_root)
+AGENT_MEMORY_FILE = os.path.join(DATA_PATH, "agent_memory_discord.sqlite")
+TEMP_MEDIA_DIR = os.path.join(DATA_PATH, "temp_media")
 
-# Instancia del agente impersonador
-impersonator_agent = None # Se inicializará en on_ready
+# Discord rechaza mensajes de más de 2000 caracteres: las respuestas largas se reparten
+DISCORD_MAX_MESSAGE_LENGTH = 2000
+
+# Memoria del agente en servidores: "channel" (un hilo por canal) o "user" (por usuario y canal).
+# En mensajes directos siempre es un hilo por usuario.
+DISCORD_THREAD_SCOPE = os.getenv("DISCORD_THREAD_SCOPE", "channel").strip().lower()
+
+# Caché de veredictos compartida con las sesiones de Telegram
+verdict_cache = VerdictCache.from_env(DATA_PATH)
+
+# Latencias y contadores exportados en /metrics (botengine/prometheus_metrics.py)
+DISCORD_SESSION_ID = os.getenv("SESSION_ID", "discord")
+metrics = SessionMetrics.from_env(labels={"platform": "discord", "session_id": DISCORD_SESSION_ID})
+# Filtro de mensajes triviales, agrupado de ráfagas y presupuesto de llamadas al LLM (botengine/reply_gate.py)
+reply_gate = ReplyGate.from_env(labels={"platform": "discord", "session_id": DISCORD_SESSION_ID})
+
+# Agente impersonador (se construye en segundo plano; handle_message lo espera si aún no está listo)
+agent_loader = AgentLoader(checkpoint_path=AGENT_MEMORY_FILE)
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -50,241 +82,129 @@ intents.members = True # Podría ser útil para obtener más info del autor
 
 bot = commands.Bot(command_prefix='!', intents=intents)
 
-# --- Funciones para la API de Phishing (adaptadas de telegram.py) ---
-def generate_jwt_token():
-    global phishing_jwt_token
-    print(f"Generando token JWT desde: {TOKEN_URL}")
-    payload = {
-        "username": PHISHING_API_USER,
-        "password": PHISHING_API_PASSWORD
-    }
-    try:
-        response = requests.post(TOKEN_URL, json=payload)
-        response.raise_for_status()
-        token_data = response.json()
-        access_token = token_data.get("access")
-        if access_token:
-            print("Token de ACCESO JWT generado exitosamente.")
-            phishing_jwt_token = access_token
-            return access_token
-        else:
-            print("Error: El campo 'access' no se encontró en la respuesta del token.")
-            phishing_jwt_token = None
-            return None
-    except requests.exceptions.HTTPError as http_err:
-        print(f"Error HTTP al generar token: {http_err} - Respuesta: {response.text}")
-    except requests.exceptions.RequestException as req_err:
-        print(f"Error de conexión al generar token: {req_err}")
-    except json.JSONDecodeError:
-        print("Error al decodificar la respuesta JSON del token.")
-    phishing_jwt_token = None
-    return None
-
-def send_to_phishing_api(sample_data):
-    global phishing_jwt_token
-    if not phishing_jwt_token:
-        print("No se puede enviar la muestra: token JWT no disponible. Intentando generar uno nuevo.")
-        generate_jwt_token()
-        if not phishing_jwt_token:
-            print("Fallo al generar nuevo token. No se enviará la muestra.")
-            return None
-
-    print(f"Enviando muestra a la API de Phishing: {PHISHING_API_URL}")
-    headers = {
-        "Authorization": f"Bearer {phishing_jwt_token}",
-        "Content-Type": "application/json"
-    }
-    try:
-        response = requests.post(PHISHING_API_URL, json=sample_data, headers=headers)
-        response.raise_for_status()
-        print("Muestra enviada exitosamente a la API de Phishing.")
-        api_response = response.json()
-        print(f"Respuesta de la API de Phishing: {json.dumps(api_response, indent=2, ensure_ascii=False)}")
-        return api_response
-    except requests.exceptions.HTTPError as http_err:
-        print(f"Error HTTP al enviar la muestra a Phishing API: {http_err} - Respuesta: {response.text}")
-        if response.status_code == 401: # Unauthorized
-            print("Token posiblemente expirado. Intentando regenerar y reenviar una vez.")
-            generate_jwt_token()
-            if phishing_jwt_token:
-                headers["Authorization"] = f"Bearer {phishing_jwt_token}"
-                try:
-                    response_retry = requests.post(PHISHING_API_URL, json=sample_data, headers=headers)
-                    response_retry.raise_for_status()
-                    print("Reenvío exitoso tras regenerar token.")
-                    api_response_retry = response_retry.json()
-                    print(f"Respuesta de la API de Phishing (tras reenvío): {json.dumps(api_response_retry, indent=2, ensure_ascii=False)}")
-                    return api_response_retry
-                except Exception as retry_err:
-                    print(f"Error en el reenvío a Phishing API: {retry_err}")
-            else:
-                print("No se pudo regenerar el token para el reenvío.")
-    except requests.exceptions.RequestException as req_err:
-        print(f"Error de conexión al enviar la muestra a Phishing API: {req_err}")
-    except json.JSONDecodeError:
-        print(f"Error al decodificar la respuesta JSON de la API de Phishing. Respuesta cruda: {response.text if 'response' in locals() and hasattr(response, 'text') else 'No response object'}")
-    return None
+# --- Cliente asíncrono de la API de Phishing (compartido con telegram.py) ---
+phishing_client = create_phishing_client_from_env()
+
+@bot.event
+async def setup_hook():
+    # El agente se construye mientras el bot inicia sesión en Discord
+    agent_loader.start()
+    # Endpoint /metrics y monitor del event loop; viven lo mismo que el proceso
+    bot.metrics_endpoint = await start_process_metrics(DATA_PATH, "discord", DISCORD_SESSION_ID)
 
 @bot.event
 async def on_ready():
-    global impersonator_agent
     print(f'{bot.user.name} ha iniciado sesión.')
-    generate_jwt_token() # Generar token al iniciar
-    impersonator_agent = create_langgraph_agent() #instancia del agente
-    print("Agente impersonador cargado.")
+    if agent_loader.ready:
+        return # on_ready se repite en cada reconexión: el agente ya está cargado
+    await phishing_client.generate_token() # Generar token al iniciar
+    await agent_loader.get()
+    print(f"Agente impersonador cargado ({agent_loader.build_seconds:.1f}s).")
+
+def discord_thread_id(message):
+    if message.guild is None:
+        return f"dm:{message.author.id}"
+    thread_id = f"guild:{message.guild.id}:{message.channel.id}"
+    if DISCORD_THREAD_SCOPE == "user":
+        thread_id += f":{message.author.id}"
+    return thread_id
+
+
+class GuildQueues:
+    """Una cola con pocos workers por servidor y otra para los mensajes directos.
+
+    Un servidor muy activo solo agota sus propios workers, nunca los de los DMs ni los de otros
+    servidores. Dentro de cada cola los mensajes de un mismo canal se procesan en orden.
+    """
+
+    def __init__(self, process):
+        self.process = process
+        self.guild_workers = int(os.getenv("DISCORD_GUILD_WORKERS", 2))
+        self.dm_workers = int(os.getenv("DISCORD_DM_WORKERS", 4))
+        self.queues = {}
+
+    def queue_for(self, guild):
+        key = guild.id if guild else "dm"
+        queue = self.queues.get(key)
+        if queue is None:
+            workers = self.guild_workers if guild else self.dm_workers
+            queue = ChatWorkQueue.from_env(self.process, prefix="DISCORD", num_workers=workers, name=f"discord-{key}")
+            queue.start()
+            self.queues[key] = queue
+        return queue
+
+    async def submit(self, message):
+        return await self.queue_for(message.guild).submit(message.channel.id, message)
+
+    def metric_samples(self):
+        samples = []
+        for queue in list(self.queues.values()):
+            samples += work_queue_samples(queue)
+        return samples
+
+
+def metric_samples():
+    """Colas, token JWT y caché de veredictos, leídos al hacer scrape."""
+    return guild_queues.metric_samples() + token_samples(phishing_client) + verdict_cache_samples(verdict_cache)
+
 
 @bot.event
 async def on_message(message):
     if message.author == bot.user: # Ignorar mensajes del propio bot
         return
+    metrics.increment(METRIC_RECEIVED)
+    await guild_queues.submit(message)
 
-    print("---- Nuevo Mensaje de Discord Recibido ----")
-
-    # Imprimir el objeto message completo en formato JSON
-    # Para esto, necesitamos una forma de serializar el objeto Message de discord.py
-    # No tiene un método to_dict() directo como Telethon, así que extraemos manualmente.
-    # Esto será una representación simplificada, ya que el objeto Message es complejo.
-    # Una serialización completa requeriría un manejo más detallado de sus atributos.
-    try:
-        message_attributes = {
-            "id": message.id,
-            "channel_id": message.channel.id,
-            "guild_id": message.guild.id if message.guild else None,
-            "author_id": message.author.id,
-            "author_name": message.author.name,
-            "author_discriminator": message.author.discriminator,
-            "content": message.content,
-            "created_at": message.created_at.isoformat() if message.created_at else None,
-            "edited_at": message.edited_at.isoformat() if message.edited_at else None,
-            "attachments_count": len(message.attachments),
-            "embeds_count": len(message.embeds),
-            "mentions_count": len(message.mentions),
-            "mention_everyone": message.mention_everyone,
-            "tts": message.tts,
-            "pinned": message.pinned,
-            "type": str(message.type),
-            "reference_message_id": message.reference.message_id if message.reference else None,
-            "flags": str(message.flags) # Convertir flags a string para evitar problemas de serialización
-        }
-        print(f"Objeto MENSAJE de Discord (JSON aproximado): \n{json.dumps(message_attributes, indent=4, default=str)}")
-    except Exception as e:
-        print(f"Error al serializar el mensaje de Discord a JSON: {e}")
-
-    # Recopilar datos del mensaje en un diccionario message_data
-    message_data = {}
-    message_data['plataforma'] = "Discord"
-    message_data['remitenteID'] = message.author.id
-    message_data['nombreRemitente'] = message.author.name
-    message_data['discriminadorRemitente'] = message.author.discriminator # Específico de Discord
-    message_data['esBotRemitente'] = message.author.bot
-
-    if message.guild: # Si el mensaje es de un servidor (guild)
-        message_data['servidorID'] = message.guild.id
-        message_data['nombreServidor'] = message.guild.name
-        message_data['canalID'] = message.channel.id
-        message_data['nombreCanal'] = message.channel.name
-        message_data['tipoCanal'] = str(message.channel.type)
-    else: # Mensaje directo (DM)
-        message_data['servidorID'] = None
-        message_data['nombreServidor'] = "Mensaje Directo"
-        message_data['canalID'] = message.channel.id # Es el ID del DM channel
-        message_data['nombreCanal'] = "Mensaje Directo con Usuario"
-        message_data['tipoCanal'] = str(message.channel.type)
-
-
-    message_data['contenidoMensaje'] = message.content
-    
-    # Timestamp
-    timestamp_unix = message.created_at.timestamp()
-    message_datetime_utc = message.created_at # message.created_at ya está en UTC y es timezone-aware
-    message_datetime_local = message_datetime_utc.astimezone()
-
-    message_data['timestampUnix'] = timestamp_unix
-    message_data['fechaHoraUTC'] = message_datetime_utc.strftime('%Y-%m-%d %H:%M:%S UTC')
-    message_data['fechaHoraLocal'] = message_datetime_local.strftime('%Y-%m-%d %H:%M:%S %Z%z')
-    message_data['idMensaje'] = message.id
-
-    # Información de referencia (si es una respuesta)
-    if message.reference and message.reference.message_id:
-        message_data['esRespuesta'] = True
-        message_data['mensajeReferenciadoID'] = message.reference.message_id
-        # Obtener el mensaje referenciado podría requerir otra llamada async
-        # try:
-        #   referenced_msg = await message.channel.fetch_message(message.reference.message_id)
-        #   message_data['mensajeReferenciadoContenido'] = referenced_msg.content
-        #   message_data['mensajeReferenciadoAutorID'] = referenced_msg.author.id
-        # except Exception as e:
-        #   message_data['mensajeReferenciadoError'] = str(e)
-    else:
-        message_data['esRespuesta'] = False
-
-    # Campos para el payload de la API de Phishing
-    # (Adaptar según el payload esperado por la API que definimos en test_phishing_api.py)
-    phishing_payload = {
-        "id_user": str(message.author.id), # ID del usuario que envió el mensaje
-        "id_message": str(message.id),     # ID del mensaje
-        "message": message.content,        # Contenido del mensaje
-        "source": "discord",               # Plataforma
-        "application_version": "1.0",      # Versión de tu bot/aplicación
-        "timestamp_send": int(timestamp_unix), # Timestamp Unix del envío
-        "to": bot.user.name if bot.user else "DiscordBot", # Nombre del bot que recibe
-        "chat_type": "guild" if message.guild else "dm", # Tipo de chat
-        "id_group": str(message.guild.id) if message.guild else str(message.channel.id), # ID del servidor o DM
-        "name_group": message.guild.name if message.guild else "DM with " + message.author.name, # Nombre del servidor o DM
-        "message_type": "text" # Asumimos texto por ahora, podría expandirse
-    }
-    # Puedes añadir más campos si son necesarios para la API
-
-    print(f"Datos del mensaje para la API (message_data): \n{json.dumps(message_data, indent=4, default=str)}")
-    print(f"Payload para la API de Phishing: \n{json.dumps(phishing_payload, indent=4, default=str)}")
-
-    # Enviar a la API de Phishing
-    if message.content: # Solo enviar si hay contenido de texto
-        api_response = send_to_phishing_api(phishing_payload)
-        if api_response:
-            print("Respuesta de la API de Phishing recibida y procesada.")
-            # Extraer y enviar la respuesta técnica de la API de phishing
-            try:
-                technical_text = api_response.get("bot_responses", {}).get("technical_response", {}).get("text")
-                if technical_text:
-                    print(f"Enviando respuesta técnica de la API de Phishing: {technical_text}")
-                    try:
-                        await message.channel.send(f"Alerta de Seguridad: {technical_text}") # Se envía al canal
-                    except Exception as send_err:
-                        print(f"Error al enviar la respuesta técnica al canal de Discord: {send_err}")
-                else:
-                    print("No se encontró 'text' en bot_responses.technical_response de la API de Phishing.")
-            except Exception as e:
-                print(f"Error al procesar o enviar la respuesta técnica de la API de Phishing: {e}")
-        else:
-            print("No se obtuvo respuesta de la API de Phishing o hubo un error.")
-    else:
-        print("Mensaje sin contenido de texto, no se envía a la API de phishing.")
-
-    # Procesar mensaje con el agente impersonador
-    if impersonator_agent and message.content:
-        print(f"Enviando al agente impersonador: '{message.content}'")
-        try:
-            agent_response = await impersonator_agent.invoke({"input": message.content})
-            if agent_response and "output" in agent_response:
-                print(f"Respuesta del agente: '{agent_response['output']}'")
-                try:
-                    await message.channel.send(agent_response['output'])
-                except Exception as send_err:
-                    print(f"Error al enviar la respuesta del agente al canal de Discord: {send_err}")
-            else:
-                print("El agente no devolvió una respuesta válida.")
-        except Exception as e:
-            print(f"Error al invocar el agente impersonador: {e}")
-    elif not message.content:
-        print("Mensaje sin contenido, no se procesa con el agente impersonador.")
+
+async def process_message(message):
+    with metrics.timer(METRIC_HANDLER):
+        await handle_discord_message(message)
+
+
+async def handle_discord_message(message):
+    logging.debug("Nuevo mensaje de Discord recibido (%s)", message.id)
+    # Mismo registro y mismo camino de análisis y respuesta que Telegram (botengine/messages.py),
+    # incluidos los adjuntos
+    normalized = normalize_discord(message, bot.user, phishing_client.session, TEMP_MEDIA_DIR)
+    if not normalized.text and not normalized.attachments:
+        logging.debug("Mensaje %s sin texto ni adjuntos: no se analiza ni se responde", message.id)
+        return
+
+    queue = guild_queues.queue_for(message.guild)
+    # Mensajes del mismo autor ya en cola del canal (y que llegarán al agente): se responden juntos
+    followup = lambda: queue.queued(
+        message.channel.id, lambda m: m.author.id == message.author.id and bool(m.content or m.attachments)
+    ) > 0
+    await handle_message(
+        normalized,
+        phishing_client=phishing_client,
+        verdict_cache=verdict_cache,
+        agent=agent_loader,
+        thread_id=discord_thread_id(message),
+        channel=ReplyChannel(
+            send=message.channel.send, # Las alertas y respuestas se envían al canal
+            edit=lambda msg, text: msg.edit(content=text),
+            max_length=DISCORD_MAX_MESSAGE_LENGTH,
+        ),
+        metrics=metrics,
+        reply_gate=reply_gate,
+        followup=followup,
+    )
 
     # Ya no se procesan comandos con prefijo de la misma manera
     # await bot.process_commands(message) # <--- Eliminado o comentado
 
-if DISCORD_TOKEN is None:
-    print("Error: No se encontró el DISCORD_TOKEN en las variables de entorno.")
-    print("Asegúrate de haber creado un archivo .env con DISCORD_TOKEN='tu_token_aqui'")
-    print("Y también las variables para la API de Phishing: PHISHING_API_USER, PHISHING_API_PASSWORD, TOKEN_URL, PHISHING_API_URL")
-else:
-    bot.run(DISCORD_TOKEN)
\ No newline at end of file
+
+guild_queues = GuildQueues(process_message)
+REGISTRY.register_collector(metric_samples)
+
+# Solo al ejecutarse como script: benchmarks/e2e_benchmark.py importa el módulo sin conectar
+if __name__ == "__main__":
+    if DISCORD_TOKEN is None:
+        print("Error: No se encontró el DISCORD_TOKEN en las variables de entorno.")
+        print("Asegúrate de haber creado un archivo .env con DISCORD_TOKEN='tu_token_aqui'")
+        print("Y también las variables para la API de Phishing: PHISHING_API_USER, PHISHING_API_PASSWORD, TOKEN_URL, PHISHING_API_URL")
+    else:
+        install_event_loop_policy() # asyncio o uvloop según BOT_EVENT_LOOP
+        # log_handler=None: discord.py usa el registro ya configurado por setup_logging
+        bot.run(DISCORD_TOKEN, log_handler=None)
\ No newline at end of file
@@ -0,0 +1,221 @@
+// prometheus_metrics.js
+// Registro de métricas en formato de texto de Prometheus (ver botengine/prometheus_metrics.py).
+// Counter, Gauge e Histogram con etiquetas platform/session_id, colectores leídos en cada scrape,
+// endpoint GET /metrics en un socket Unix (y en METRICS_PORT si se define) y retraso del event loop.
+const fs = require('fs');
+const path = require('path');
+const http = require('http');
+
+const BASE_LABELS = ['platform', 'session_id'];
+const DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60];
+const LAG_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5];
+const CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8';
+
+function escapeLabel(value) {
+    return String(value).replace(/\\/g, '\\\\').replace(/\n/g, '\\n').replace(/"/g, '\\"');
+}
+
+function formatLabels(pairs) {
+    if (!pairs.length) return '';
+    return '{' + pairs.map(([name, value]) => `${name}="${escapeLabel(value)}"`).join(',') + '}';
+}
+
+function formatValue(value) {
+    if (value === Infinity) return '+Inf';
+    if (value === -Infinity) return '-Inf';
+    return String(value);
+}
+
+class Family {
+    constructor(registry, kind, name, help, labelNames = [], buckets = DEFAULT_BUCKETS) {
+        this.registry = registry;
+        this.kind = kind;
+        this.name = name;
+        this.help = help;
+        this.labelNames = BASE_LABELS.concat(labelNames.filter(n => !BASE_LABELS.includes(n)));
+        this.buckets = [...buckets].sort((a, b) => a - b);
+        this.children = new Map();
+    }
+
+    // Serie con esas etiquetas; conviene guardarla si se usa en cada mensaje
+    labels(labels = {}) {
+        const values = this.labelNames.map(n => String(n in labels ? labels[n] : (this.registry.defaultLabels[n] || '')));
+        const key = JSON.stringify(values);
+        let child = this.children.get(key);
+        if (!child) {
+            child = this._newChild(values);
+            this.children.set(key, child);
+        }
+        return child;
+    }
+
+    _newChild(values) {
+        const child = { values, value: 0 };
+        if (this.kind === 'counter' || this.kind === 'gauge') {
+            child.inc = (amount = 1) => { child.value += amount; };
+            child.set = value => { child.value = value; };
+            return child;
+        }
+        child.counts = new Array(this.buckets.length + 1).fill(0); // El último es +Inf
+        child.sum = 0;
+        child.count = 0;
+        child.observe = value => {
+            let index = this.buckets.findIndex(bound => value <= bound);
+            if (index < 0) index = this.buckets.length;
+            child.counts[index] += 1;
+            child.sum += value;
+            child.count += 1;
+        };
+        return child;
+    }
+
+    render() {
+        const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} ${this.kind}`];
+        for (const child of this.children.values()) {
+            const pairs = this.labelNames.map((n, i) => [n, child.values[i]]);
+            if (this.kind !== 'histogram') {
+                lines.push(`${this.name}${formatLabels(pairs)} ${formatValue(child.value)}`);
+                continue;
+            }
+            let cumulative = 0;
+            this.buckets.concat([Infinity]).forEach((bound, i) => {
+                cumulative += child.counts[i];
+                lines.push(`${this.name}_bucket${formatLabels(pairs.concat([['le', formatValue(bound)]]))} ${cumulative}`);
+            });
+            lines.push(`${this.name}_sum${formatLabels(pairs)} ${formatValue(child.sum)}`);
+            lines.push(`${this.name}_count${formatLabels(pairs)} ${child.count}`);
+        }
+        return lines;
+    }
+}
+
+class MetricsRegistry {
+    constructor() {
+        this.defaultLabels = {};
+        this.families = new Map();
+        this.collectors = [];
+    }
+
+    setDefaultLabels(labels) {
+        Object.assign(this.defaultLabels, labels);
+    }
+
+    _family(kind, name, help, labelNames, buckets) {
+        let family = this.families.get(name);
+        if (!family) {
+            family = new Family(this, kind, name, help, labelNames, buckets);
+            this.families.set(name, family);
+        } else if (family.kind !== kind) {
+            throw new Error(`La métrica ${name} ya existe con otro tipo.`);
+        }
+        return family;
+    }
+
+    counter(name, help, labelNames = []) { return this._family('counter', name, help, labelNames); }
+    gauge(name, help, labelNames = []) { return this._family('gauge', name, help, labelNames); }
+    histogram(name, help, labelNames = [], buckets = DEFAULT_BUCKETS) { return this._family('histogram', name, help, labelNames, buckets); }
+
+    // collector() devuelve [[nombre, tipo, ayuda, etiquetas, valor], ...]
+    registerCollector(collector) {
+        this.collectors.push(collector);
+        return collector;
+    }
+
+    render() {
+        const lines = [];
+        for (const family of this.families.values()) lines.push(...family.render());
+        const collected = new Map();
+        for (const collector of this.collectors) {
+            let samples;
+            try {
+                samples = collector();
+            } catch (err) {
+                console.error('[metrics] Error en un colector de métricas:', err);
+                continue;
+            }
+            for (const [name, kind, help, labels, value] of samples) {
+                const pairs = BASE_LABELS.map(n => [n, n in labels ? labels[n] : (this.defaultLabels[n] || '')])
+                    .concat(Object.entries(labels).filter(([n]) => !BASE_LABELS.includes(n)));
+                if (!collected.has(name)) collected.set(name, { kind, help, samples: [] });
+                collected.get(name).samples.push(`${name}${formatLabels(pairs)} ${formatValue(value)}`);
+            }
+        }
+        for (const [name, { kind, help, samples }] of collected) {
+            lines.push(`# HELP ${name} ${help}`, `# TYPE ${name} ${kind}`, ...samples);
+        }
+        return lines.join('\n') + '\n';
+    }
+}
+
+const REGISTRY = new MetricsRegistry();
+const LOOP_LAG = REGISTRY.histogram('botengine_event_loop_lag_seconds', 'Retraso del event loop respecto a lo programado', [], LAG_BUCKETS);
+
+function metricsEnabled() {
+    return ['1', 'true', 'yes', 'si', 'sí'].includes((process.env.METRICS_ENABLED || 'true').trim().toLowerCase());
+}
+
+function metricsSocketPath(dataPath, platform, sessionId) {
+    const template = process.env.METRICS_SOCKET || path.join(dataPath, 'metrics', '{platform}-{session_id}.sock');
+    return template.replace('{platform}', platform).replace('{session_id}', sessionId);
+}
+
+// Duerme `interval` segundos en bucle y registra cuánto se retrasa el despertar; no mantiene vivo el proceso
+function monitorLoopLag(interval = parseFloat(process.env.METRICS_LOOP_LAG_INTERVAL || '0.5')) {
+    const child = LOOP_LAG.labels();
+    let expected = Date.now() + interval * 1000;
+    const timer = setInterval(() => {
+        const now = Date.now();
+        child.observe(Math.max(0, now - expected) / 1000);
+        expected = now + interval * 1000;
+    }, interval * 1000);
+    timer.unref();
+    return timer;
+}
+
+// Etiquetas por defecto del proceso, endpoint /metrics y monitor del event loop
+function startProcessMetrics(dataPath, platform, sessionId) {
+    REGISTRY.setDefaultLabels({ platform, session_id: sessionId });
+    if (!metricsEnabled()) return { servers: [], close() {} };
+    const handler = (req, res) => {
+        if (req.method === 'GET' && ['/metrics', '/'].includes(req.url.split('?')[0])) {
+            res.writeHead(200, { 'Content-Type': CONTENT_TYPE });
+            res.end(REGISTRY.render());
+        } else {
+            res.writeHead(404, { 'Content-Type': CONTENT_TYPE });
+            res.end('not found\n');
+        }
+    };
+    const servers = [];
+    const socketPath = metricsSocketPath(dataPath, platform, sessionId);
+    try {
+        fs.mkdirSync(path.dirname(socketPath), { recursive: true });
+        if (fs.existsSync(socketPath)) fs.unlinkSync(socketPath); // Socket huérfano de una ejecución anterior
+        const server = http.createServer(handler);
+        server.on('error', err => console.error(`[metrics] No se pudo abrir el socket de métricas ${socketPath}:`, err.message));
+        server.listen(socketPath);
+        server.unref();
+        servers.push(server);
+    } catch (err) {
+        console.error(`[metrics] No se pudo abrir el socket de métricas ${socketPath}:`, err.message);
+    }
+    if (process.env.METRICS_PORT) {
+        const host = process.env.METRICS_HOST || '127.0.0.1';
+        const server = http.createServer(handler);
+        // Otro proceso ya usa el puerto: el bot sigue funcionando sin el endpoint TCP
+        server.on('error', err => console.error(`[metrics] No se pudo abrir el puerto de métricas ${host}:${process.env.METRICS_PORT}:`, err.message));
+        server.listen(parseInt(process.env.METRICS_PORT, 10), host);
+        server.unref();
+        servers.push(server);
+    }
+    const lagTimer = monitorLoopLag();
+    return {
+        servers,
+        close() {
+            clearInterval(lagTimer);
+            servers.forEach(server => server.close());
+            try { fs.unlinkSync(socketPath); } catch (err) { /* ya eliminado */ }
+        },
+    };
+}
+
+module.exports = { REGISTRY, MetricsRegistry, startProcessMetrics, metricsSocketPath, monitorLoopLag, DEFAULT_BUCKETS };
@@ -0,0 +1,145 @@
+// session_metrics.js
+// Métricas de trabajo de una sesión (ver botengine/session_metrics.py): mensajes por segundo y
+// p50/p95 de las latencias sobre una ventana deslizante, guardadas en búferes circulares fijos.
+// Con `labels` (platform, session_id) cada observación se exporta además a Prometheus.
+const { REGISTRY } = require('./prometheus_metrics');
+
+const METRIC_HANDLER = 'handler';
+const METRIC_PHISHING = 'phishing';
+const METRIC_LLM = 'llm';
+const METRIC_REPLY_SEND = 'reply_send';
+const METRIC_LLM_TOKENS = 'llm_tokens';
+const METRIC_RECEIVED = 'messages_received';
+
+// Nombre y ayuda de cada métrica exportada; el resto se exporta como botengine_<nombre>_seconds/_total
+const EXPORTED = {
+    [METRIC_HANDLER]: ['botengine_handler_seconds', 'Duración del procesado completo de un mensaje'],
+    [METRIC_PHISHING]: ['botengine_scan_seconds', 'Latencia del análisis en la API de Phishing'],
+    [METRIC_LLM]: ['botengine_llm_seconds', 'Latencia de la respuesta del LLM'],
+    [METRIC_REPLY_SEND]: ['botengine_reply_send_seconds', 'Latencia del envío del primer mensaje de respuesta'],
+    [METRIC_LLM_TOKENS]: ['botengine_llm_tokens_total', 'Fragmentos de texto (tokens) emitidos por el LLM en streaming'],
+    [METRIC_RECEIVED]: ['botengine_messages_received_total', 'Mensajes recibidos por el bot'],
+};
+
+function nowSeconds() {
+    return Number(process.hrtime.bigint()) / 1e9;
+}
+
+class RingBuffer {
+    constructor(capacity) {
+        this.capacity = Math.max(1, capacity | 0);
+        this.data = new Float64Array(this.capacity);
+        this.next = 0;
+        this.size = 0;
+    }
+
+    append(value) {
+        this.data[this.next] = value;
+        this.next = (this.next + 1) % this.capacity;
+        this.size = Math.min(this.size + 1, this.capacity);
+    }
+
+    // Valores en orden de inserción (el más antiguo primero)
+    values() {
+        if (this.size < this.capacity) return Array.from(this.data.subarray(0, this.size));
+        return Array.from(this.data.subarray(this.next)).concat(Array.from(this.data.subarray(0, this.next)));
+    }
+}
+
+// Percentil q (0-100) por el método del rango más cercano
+function percentile(values, q) {
+    if (!values.length) return null;
+    const ordered = [...values].sort((a, b) => a - b);
+    const index = Math.max(0, Math.min(ordered.length - 1, Math.ceil(q / 100 * ordered.length) - 1));
+    return ordered[index];
+}
+
+class SessionMetrics {
+    constructor(window = 60, capacity = 2048, labels = null) {
+        this.window = window;
+        this.capacity = capacity;
+        this.labels = labels;
+        this.started = nowSeconds();
+        this.series = new Map();
+        this.exported = new Map(); // nombre -> serie de Prometheus con las etiquetas de la sesión
+    }
+
+    static fromEnv(labels = null) {
+        return new SessionMetrics(
+            parseFloat(process.env.SESSION_METRICS_WINDOW || '60'),
+            parseInt(process.env.SESSION_METRICS_SAMPLES || '2048', 10),
+            labels,
+        );
+    }
+
+    _export(name, counter) {
+        let child = this.exported.get(name);
+        if (!child) {
+            const [metric, help] = EXPORTED[name] || [`botengine_${name}_${counter ? 'total' : 'seconds'}`, name];
+            const family = counter ? REGISTRY.counter(metric, help) : REGISTRY.histogram(metric, help);
+            child = family.labels(this.labels);
+            this.exported.set(name, child);
+        }
+        return child;
+    }
+
+    observe(name, seconds) {
+        let series = this.series.get(name);
+        if (!series) {
+            series = { times: new RingBuffer(this.capacity), durations: new RingBuffer(this.capacity), total: 0 };
+            this.series.set(name, series);
+        }
+        series.times.append(nowSeconds());
+        series.durations.append(seconds);
+        series.total += 1;
+        if (this.labels) this._export(name, false).observe(seconds);
+    }
+
+    // Contador sin ventana: solo se exporta a Prometheus
+    increment(name, amount = 1) {
+        if (this.labels) this._export(name, true).inc(amount);
+    }
+
+    // Mide la duración de una función asíncrona, termine bien o con excepción
+    async time(name, fn) {
+        const started = nowSeconds();
+        try {
+            return await fn();
+        } finally {
+            this.observe(name, nowSeconds() - started);
+        }
+    }
+
+    snapshot() {
+        const now = nowSeconds();
+        const start = now - this.window;
+        const span = Math.max(1, Math.min(this.window, now - this.started));
+        const result = { window: this.window };
+        for (const [name, series] of this.series) {
+            const times = series.times.values();
+            const recent = series.durations.values().filter((_, i) => times[i] >= start);
+            result[name] = {
+                count: recent.length,
+                total: series.total,
+                p50: percentile(recent, 50),
+                p95: percentile(recent, 95),
+            };
+        }
+        const handled = result[METRIC_HANDLER] ? result[METRIC_HANDLER].count : 0;
+        result.messages_per_second = Math.round(handled / span * 1000) / 1000;
+        return result;
+    }
+
+    // Publica el resumen en el canal de estado cada `interval` segundos; no mantiene vivo el proceso
+    publishPeriodically(status, key, interval) {
+        if (!(interval > 0)) return null;
+        const timer = setInterval(() => status.publish(key, this.snapshot()), interval * 1000);
+        timer.unref();
+        return timer;
+    }
+}
+
+module.exports = {
+    SessionMetrics, RingBuffer, percentile,
+    METRIC_HANDLER, METRIC_PHISHING, METRIC_LLM, METRIC_REPLY_SEND, METRIC_LLM_TOKENS, METRIC_RECEIVED,
+};
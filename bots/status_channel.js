@@ -0,0 +1,101 @@
+// status_channel.js
+// Cliente del canal de estado del panel (ver botengine/status_channel.py).
+// Socket Unix bajo DATA_PATH con mensajes JSON por líneas; reconecta solo y reenvía su estado.
+const net = require('net');
+const path = require('path');
+const { EventEmitter } = require('events');
+
+const SOCKET_NAME = 'botengine_status.sock';
+
+const STATUS_AUTH = 'auth_status';
+const STATUS_ERROR = 'error';
+const STATUS_QR = 'qr_data_url';
+const STATUS_STARTUP = 'startup';
+const STATUS_METRICS = 'metrics';
+
+function statusSocketPath(dataPath) {
+    return process.env.STATUS_SOCKET || path.join(dataPath, SOCKET_NAME);
+}
+
+class StatusClient extends EventEmitter {
+    constructor(socketPath, platform, sessionId, reconnectMaxDelay = 5000) {
+        super();
+        this.socketPath = socketPath;
+        this.platform = platform;
+        this.sessionId = sessionId;
+        this.reconnectMaxDelay = reconnectMaxDelay;
+        this.state = {};
+        this.socket = null;
+        this.connected = false;
+        this.closed = false;
+        this.delay = 100;
+    }
+
+    start() {
+        this.closed = false;
+        this._connect();
+        return this;
+    }
+
+    close() {
+        this.closed = true;
+        if (this.socket) this.socket.destroy();
+    }
+
+    _write(message) {
+        if (this.connected && this.socket) {
+            this.socket.write(JSON.stringify(message) + '\n');
+        }
+    }
+
+    _connect() {
+        const socket = net.createConnection(this.socketPath);
+        let buffer = '';
+        this.socket = socket;
+
+        socket.on('connect', () => {
+            this.connected = true;
+            this.delay = 100;
+            this._write({ type: 'hello', platform: this.platform, session_id: this.sessionId, state: this.state });
+        });
+        socket.on('data', (data) => {
+            buffer += data.toString('utf-8');
+            let index;
+            while ((index = buffer.indexOf('\n')) >= 0) {
+                const line = buffer.slice(0, index);
+                buffer = buffer.slice(index + 1);
+                try {
+                    const message = JSON.parse(line);
+                    // Los comandos del panel se emiten como eventos con su tipo
+                    this.emit(message.type || 'message', message);
+                } catch {
+                    // Línea corrupta: se ignora
+                }
+            }
+        });
+        socket.on('error', () => {});
+        socket.on('close', () => {
+            this.connected = false;
+            if (this.socket === socket) this.socket = null;
+            if (!this.closed) {
+                setTimeout(() => this._connect(), this.delay);
+                this.delay = Math.min(this.reconnectMaxDelay, this.delay * 2);
+            }
+        });
+        // No mantener vivo el proceso solo por el canal
+        socket.unref();
+    }
+
+    // Actualiza una clave de estado (null la elimina). No bloquea.
+    publish(key, value) {
+        if (value === null || value === undefined) {
+            delete this.state[key];
+            value = null;
+        } else {
+            this.state[key] = value;
+        }
+        this._write({ type: 'status', key, value });
+    }
+}
+
+module.exports = { StatusClient, statusSocketPath, STATUS_AUTH, STATUS_ERROR, STATUS_QR, STATUS_STARTUP, STATUS_METRICS };
@@ -1,452 +1,461 @@
 # telegram.py
+import time
+_IMPORTS_STARTED = time.monotonic() # Referencia para medir el coste de las importaciones
+
 import os
 from telethon import TelegramClient, events
 import logging
 import sys
 import asyncio
-import nest_asyncio
-from datetime import datetime, timezone
-import requests
+import signal
 import json
-from telethon.tl.types import (
-    MessageEntityMention, MessageEntityMentionName, User, Chat, Channel,
-    MessageMediaPhoto, MessageMediaDocument, MessageEntityUrl,
-    MessageEntityTextUrl, MessageEntityEmail, MessageEntityBotCommand
-)
-
-nest_asyncio.apply()
+from typing import Optional
+from telethon.tl.types import MessageEntityMention, MessageEntityMentionName
 
 # Directorio padre
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(project_root)
-from langgraph.agente_impersonador import create_langgraph_agent
+# langchain/langgraph se importan en segundo plano al construir el agente (AgentLoader)
+from botengine.agent_loader import AgentLoader
+from botengine.phishing_api import create_phishing_client_from_env
+from botengine.work_queue import ChatWorkQueue
+from botengine.ttl_cache import TTLCache
+from botengine.verdict_cache import VerdictCache
+from botengine.messages import ReplyChannel, handle_message
+from botengine.reply_gate import ReplyGate
+from botengine.telegram_adapter import normalize_telegram
+from botengine.session_registry import session_dir, telegram_session_file, agent_memory_file
+from botengine.session_metrics import SessionMetrics, metrics_interval, METRIC_HANDLER, METRIC_RECEIVED
+from botengine.prometheus_metrics import (
+    REGISTRY, start_process_metrics, work_queue_samples, cache_samples, verdict_cache_samples, token_samples
+)
+from botengine.structured_log import setup_logging
+from botengine import runtime
+from botengine.runtime import run_blocking
+from botengine.status_channel import (
+    StatusClient, publish_status_sync, status_socket_path,
+    STATUS_AUTH, STATUS_NEEDS_CODE, STATUS_ERROR, STATUS_STARTUP, MESSAGE_CODE
+)
 
-# --- ID de Sesión y Rutas de Datos ---
-SESSION_ID = os.getenv("SESSION_ID", "default_telegram")
+IMPORTS_SECONDS = time.monotonic() - _IMPORTS_STARTED
+
+# --- Rutas de Datos ---
 # Si DATA_PATH no está definida, usar la raíz del proyecto como fallback.
 DATA_PATH = os.getenv("DATA_PATH", project_root)
-logging.info(f"Iniciando sesión de Telegram con ID: {SESSION_ID}")
-logging.info(f"Usando DATA_PATH: {DATA_PATH}")
 
 # Usar rutas absolutas basadas en DATA_PATH para evitar problemas de CWD
-NEED_TELEGRAM_CODE_FILE = os.path.join(DATA_PATH, f"telegram_needs_code_{SESSION_ID}.txt")
-TELEGRAM_CODE_FILE = os.path.join(DATA_PATH, f"telegram_code_{SESSION_ID}.txt")
-TELEGRAM_AUTH_STATUS_FILE = os.path.join(DATA_PATH, f"telegram_auth_status_{SESSION_ID}.txt")
-TELEGRAM_ERROR_FILE = os.path.join(DATA_PATH, f"telegram_error_{SESSION_ID}.txt")
-SESSION_FILE = os.path.join(DATA_PATH, f"chatbot_session_{SESSION_ID}.session")
+STATUS_SOCKET = status_socket_path(DATA_PATH)
+TELEGRAM_CODE_TIMEOUT = float(os.getenv("TELEGRAM_CODE_TIMEOUT", 300))
+# Plazo para terminar el trabajo en curso al detenerse; lo que no dé tiempo se guarda y se retoma al arrancar
+BOT_DRAIN_TIMEOUT = float(os.getenv("BOT_DRAIN_TIMEOUT", 20))
+PENDING_MESSAGES_NAME = "pending_messages.json"
 AUTH_CONNECTED = "connected"
 AUTH_AUTHENTICATED = "authenticated"
+# Cómo terminó una sesión: el supervisor solo reinicia las que no se detuvieron a propósito
+END_STOPPED = "exit"   # Parada pedida (supervisor, señal de drenado) o código de verificación no recibido
+END_CRASHED = "crash"  # Error o desconexión inesperada
 
-# --- Obtener credenciales de variables de entorno ---
-api_id_str = os.getenv("API_ID")
-api_hash = os.getenv("API_HASH") 
-phone_number = os.getenv("PHONE_NUMBER")
-PHISHING_API_USER = os.getenv("PHISHING_API_USER")
-PHISHING_API_PASSWORD = os.getenv("PHISHING_API_PASSWORD")
-TOKEN_URL = os.getenv("TOKEN_URL")
-PHISHING_API_URL = os.getenv("PHISHING_API_URL")
-
-phishing_jwt_token = None # Variable global para el token
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-# --- Verificar credenciales ---
-if not all([api_id_str, api_hash, phone_number, PHISHING_API_USER, PHISHING_API_PASSWORD, TOKEN_URL, PHISHING_API_URL]):
-    error_msg = "Error: Faltan variables de entorno críticas para Telegram o la API de Phishing."
-    logging.error(error_msg)
-    with open(TELEGRAM_ERROR_FILE, "w") as f:
-        f.write(error_msg)
-    sys.exit(1)
-
-try:
-    api_id = int(api_id_str)
-except ValueError:
-    error_msg = "Error: API_ID debe ser un número entero."
-    logging.error(error_msg)
-    with open(TELEGRAM_ERROR_FILE, "w") as f:
-        f.write(error_msg)
-    sys.exit(1)
-
-# --- Funciones para la API de Phishing ---
-def generate_jwt_token():
-    global phishing_jwt_token
-    logging.info(f"Generando token JWT desde: {TOKEN_URL}")
-    payload = {"username": PHISHING_API_USER, "password": PHISHING_API_PASSWORD}
-    try:
-        response = requests.post(TOKEN_URL, json=payload)
-        response.raise_for_status()
-        token_data = response.json()
-        access_token = token_data.get("access")
-        if access_token:
-            logging.info("Token de ACCESO JWT generado exitosamente.")
-            phishing_jwt_token = access_token
-        else:
-            logging.error("Error: El campo 'access' no se encontró en la respuesta del token.")
-            phishing_jwt_token = None
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error de conexión al generar token: {e}")
-        phishing_jwt_token = None
-
-def send_to_phishing_api(sample_data):
-    global phishing_jwt_token
-    if not phishing_jwt_token:
-        logging.warning("Token JWT no disponible. Intentando generar uno nuevo.")
-        generate_jwt_token()
-        if not phishing_jwt_token:
-            logging.error("Fallo al generar nuevo token. No se enviará la muestra.")
-            return None
+# Registro en líneas JSON con muestreo y cuerpos truncados, fuera del event loop (LOG_FORMAT, LOG_LEVEL...)
+setup_logging("telegram")
 
-    try:
-        # Preparar los archivos adjuntos si existen
-        files = {}
-        file_handles = []  # Lista para mantener los archivos abiertos
-        
-        if 'message_content' in sample_data['sample'] and 'attachments' in sample_data['sample']['message_content']:
-            attachments = sample_data['sample']['message_content']['attachments']
-            for idx, attachment in enumerate(attachments):
-                if 'file_path' in attachment:
-                    file_path = attachment['file_path']
-                    if os.path.exists(file_path):
-                        # Abrir el archivo en modo binario y mantenerlo abierto
-                        f = open(file_path, 'rb')
-                        file_handles.append(f)  # Guardar referencia para cerrar después
-                        files[f'file_{idx}'] = (
-                            attachment['filename'],
-                            f,
-                            'application/octet-stream'
-                        )
-                        # Eliminar la ruta del archivo del payload JSON
-                        attachment_copy = attachment.copy()
-                        del attachment_copy['file_path']
-                        sample_data['sample']['message_content']['attachments'][idx] = attachment_copy
-
-        # Preparar headers y datos
-        headers = {"Authorization": f"Bearer {phishing_jwt_token}"}
-        
-        # Si hay archivos, usar multipart/form-data
-        if files:
-            logging.info("Detectados adjuntos. Preparando envío multipart/form-data.")
-            # Eliminar la ruta del archivo del payload JSON antes de enviarlo
-            sanitized_sample_data = json.loads(json.dumps(sample_data)) # Copia profunda
-            if 'attachments' in sanitized_sample_data.get('sample', {}).get('message_content', {}):
-                for att in sanitized_sample_data['sample']['message_content']['attachments']:
-                    att.pop('file_path', None)
-            
-            response = requests.post(
-                PHISHING_API_URL,
-                headers=headers,
-                data={'sample': json.dumps(sanitized_sample_data)},
-                files=files
-            )
-        else:
-            # Si no hay archivos, usar JSON directo
-            headers["Content-Type"] = "application/json"
-            response = requests.post(PHISHING_API_URL, json=sample_data, headers=headers)
 
-        response.raise_for_status()
-        logging.info("Muestra enviada exitosamente a la API de Phishing.")
+# Cada sesión guarda sus archivos en DATA_PATH/sessions/telegram/<session_id>/ (ver botengine/session_registry.py)
+def session_file_path(session_id):
+    return telegram_session_file(DATA_PATH, session_id)
 
-        # Cerrar todos los archivos abiertos
-        for f in file_handles:
-            try:
-                f.close()
-            except Exception as e:
-                logging.error(f"Error al cerrar archivo: {e}")
-
-        # Limpiar archivos temporales después del envío exitoso
-        if file_handles:
-            if 'message_content' in sample_data['sample'] and 'attachments' in sample_data['sample']['message_content']:
-                attachments = sample_data['sample']['message_content']['attachments']
-                for attachment in attachments:
-                    if 'file_path' in attachment:
-                        try:
-                            os.remove(attachment['file_path'])
-                            logging.info(f"Archivo temporal eliminado: {attachment['file_path']}")
-                        except Exception as e:
-                            logging.error(f"Error al eliminar archivo temporal: {e}")
-
-        return response.json()
-
-    except requests.exceptions.HTTPError as http_err:
-        if http_err.response.status_code == 401:
-            logging.info("Token posiblemente expirado. Regenerando y reenviando.")
-            generate_jwt_token()
-            if phishing_jwt_token:
-                return send_to_phishing_api(sample_data)  # Reintentar con nuevo token
-        logging.error(f"Error HTTP: {http_err}")
-    except requests.exceptions.RequestException as req_err:
-        logging.error(f"Error de conexión al enviar la muestra: {req_err}")
-    except Exception as e:
-        logging.error(f"Error inesperado al enviar la muestra: {e}")
-    
-    # Asegurarse de cerrar y limpiar archivos en caso de cualquier error
-    for f in file_handles:
-        try:
-            f.close()
-        except Exception as e:
-            logging.error(f"Error al cerrar archivo en bloque de error: {e}")
+def agent_memory_path(session_id):
+    return agent_memory_file(DATA_PATH, "telegram", session_id)
 
-    if 'message_content' in sample_data['sample'] and 'attachments' in sample_data['sample']['message_content']:
-        for attachment in sample_data['sample']['message_content']['attachments']:
-            if 'file_path' in attachment and os.path.exists(attachment['file_path']):
-                try:
-                    os.remove(attachment['file_path'])
-                    logging.info(f"Archivo temporal eliminado después de error: {attachment['file_path']}")
-                except Exception as e:
-                    logging.error(f"Error al limpiar archivos temporales en bloque de error: {e}")
-    
-    return None
+def pending_messages_path(session_id):
+    return os.path.join(session_dir(DATA_PATH, "telegram", session_id, create=True), PENDING_MESSAGES_NAME)
 
 
-client = TelegramClient(SESSION_FILE, api_id, api_hash)
-compiled_graph, _ = create_langgraph_agent()
+def phishing_config_error():
+    """Mensaje de error si falta configuración de la API de Phishing, o None."""
+    required = [os.getenv("PHISHING_API_USER"), os.getenv("PHISHING_API_PASSWORD"), os.getenv("TOKEN_URL"), os.getenv("PHISHING_API_URL")]
+    if not all(required):
+        return "Error: Faltan variables de entorno críticas para Telegram o la API de Phishing."
+    return None
 
-async def main():
-    try:
-        logging.info("Iniciando cliente de Telegram...")
-        await client.connect()
-        logging.info("Cliente de Telegram conectado.")
 
-        is_authorized = await client.is_user_authorized()
+class VerificationCodeTimeout(Exception):
+    """No llegó el código de verificación desde el panel: reintentar solo enviaría más códigos."""
+
+
+class TelegramShared:
+    """Recursos compartidos por todas las sesiones de un proceso: pool HTTP, caché de veredictos y agente.
+
+    El agente se construye una sola vez y en segundo plano mientras las sesiones se autentican.
+    """
+
+    def __init__(self, memory_path):
+        self.phishing_client = create_phishing_client_from_env()
+        self.verdict_cache = VerdictCache.from_env(DATA_PATH)
+        self.agent = AgentLoader(checkpoint_path=memory_path).start()
+        REGISTRY.register_collector(self.metric_samples)
+
+    def metric_samples(self):
+        """Token JWT y caché de veredictos, compartidos por todas las sesiones del proceso."""
+        return token_samples(self.phishing_client) + verdict_cache_samples(self.verdict_cache)
+
+    @property
+    def checkpointer(self):
+        return self.agent.checkpointer
+
+    async def close(self):
+        await self.phishing_client.close()
+        self.verdict_cache.close()
+        if hasattr(self.checkpointer, "close"):
+            self.checkpointer.close() # Vuelca las conversaciones pendientes a disco
+
+
+class TelegramSession:
+    """Una cuenta de Telegram: cliente, autenticación, caché de entidades y cola de mensajes.
+
+    Con `thread_namespace` los hilos del agente se prefijan con la sesión, necesario cuando
+    varias cuentas comparten el mismo agente (modo host).
+    """
+
+    def __init__(self, session_id, phone_number, api_id, api_hash, shared, thread_namespace: Optional[str] = None):
+        self.created_at = time.monotonic()
+        self.session_id = session_id
+        self.phone_number = phone_number
+        self.shared = shared
+        self.thread_namespace = thread_namespace
+        self.client = TelegramClient(session_file_path(session_id), api_id, api_hash)
+        # Canal de estado con el panel (sustituye a los archivos de estado)
+        self.status = StatusClient(STATUS_SOCKET, "telegram", session_id)
+        # --- Caché de entidades (remitentes y chats) ---
+        self.entity_cache = TTLCache(
+            maxsize=int(os.getenv("TELEGRAM_ENTITY_CACHE_SIZE", 2000)),
+            ttl=float(os.getenv("TELEGRAM_ENTITY_CACHE_TTL", 600)),
+        )
+        self.me = None # Cuenta propia, se resuelve una sola vez tras la autenticación
+        self.work_queue = None
+        self.draining = False
+        self._task = None
+        self.end_reason = END_CRASHED # Pasa a END_STOPPED solo en una parada deliberada
+        # Mensajes/s y latencias; se publican en el canal de estado para el panel y se exportan a Prometheus
+        self.metrics = SessionMetrics.from_env(labels={"platform": "telegram", "session_id": session_id})
+        # Filtro de mensajes triviales, agrupado de ráfagas y presupuesto de llamadas al LLM de esta cuenta
+        self.reply_gate = ReplyGate.from_env(labels={"platform": "telegram", "session_id": session_id})
+
+    def thread_id(self, sender_id):
+        if self.thread_namespace:
+            return f"{self.thread_namespace}:{sender_id}"
+        return str(sender_id)
+
+    def stats(self):
+        return {
+            "cola": self.work_queue.stats() if self.work_queue else None,
+            "entidades": self.entity_cache.stats(),
+        }
+
+    def metric_samples(self):
+        """Profundidad de la cola y caché de entidades, leídas al hacer scrape."""
+        samples = cache_samples("entities", self.entity_cache.hits, self.entity_cache.misses, session_id=self.session_id)
+        if self.work_queue is not None:
+            samples += work_queue_samples(self.work_queue, session_id=self.session_id)
+        return samples
+
+    async def get_cached_sender(self, event):
+        """Devuelve el remitente usando la caché, la entidad ya incluida en el update o, en último caso, la red."""
+        key = ("user", event.sender_id)
+        sender = self.entity_cache.get(key)
+        if sender is None:
+            sender = event.sender or await event.get_sender()
+            if sender is not None:
+                self.entity_cache.set(key, sender)
+        return sender
+
+    async def get_cached_chat(self, event):
+        key = ("chat", event.chat_id)
+        chat = self.entity_cache.get(key)
+        if chat is None:
+            chat = event.chat or await event.get_chat()
+            if chat is not None:
+                self.entity_cache.set(key, chat)
+        return chat
+
+    def is_bot_mentioned(self, event):
+        """Comprueba las entidades del mensaje sin peticiones adicionales a Telegram."""
+        if not event.mentioned:
+            return False
+        my_username = (self.me.username or "").lower()
+        for entity, text in event.get_entities_text():
+            if isinstance(entity, MessageEntityMentionName) and entity.user_id == self.me.id:
+                return True
+            if isinstance(entity, MessageEntityMention) and my_username and text.lstrip("@").lower() == my_username:
+                return True
+        return False
+
+    async def authenticate(self):
+        """Conecta y, si hace falta, espera el código de verificación enviado desde el panel. Devuelve si se autenticó."""
+        status = self.status
+        logging.info(f"[{self.session_id}] Iniciando cliente de Telegram...")
+        await self.client.connect()
+        logging.info(f"[{self.session_id}] Cliente de Telegram conectado.")
+
+        is_authorized = await self.client.is_user_authorized()
+        status.publish(STATUS_AUTH, AUTH_CONNECTED if is_authorized else None)
         if is_authorized:
-            with open(TELEGRAM_AUTH_STATUS_FILE, "w") as f: f.write(AUTH_CONNECTED)
-        else:
-            if os.path.exists(TELEGRAM_AUTH_STATUS_FILE): os.remove(TELEGRAM_AUTH_STATUS_FILE)
+            return True
 
-        if not is_authorized:
-            try:
-                await client.send_code_request(phone_number)
-                with open(NEED_TELEGRAM_CODE_FILE, "w") as f: f.write("waiting")
-                logging.info("Código enviado. Esperando entrada del usuario desde la interfaz.")
-                
-                code_verified = False
-                for _ in range(60):
-                    if os.path.exists(TELEGRAM_CODE_FILE):
-                        with open(TELEGRAM_CODE_FILE, "r") as f: code = f.read().strip()
-                        os.remove(TELEGRAM_CODE_FILE)
-                        try:
-                            await client.sign_in(phone_number, code)
-                            if os.path.exists(NEED_TELEGRAM_CODE_FILE): os.remove(NEED_TELEGRAM_CODE_FILE)
-                            with open(TELEGRAM_AUTH_STATUS_FILE, "w") as f: f.write(AUTH_CONNECTED)
-                            code_verified = True
-                            break
-                        except Exception as e:
-                            logging.error(f"Error al iniciar sesión con el código: {e}")
-                            with open(TELEGRAM_ERROR_FILE, "w") as f: f.write(str(e))
-                    await asyncio.sleep(5)
-                
-                if not code_verified: raise Exception("Timeout: No se recibió código válido.")
-            except Exception as e:
-                logging.error(f"Error durante la autenticación: {e}")
-                with open(TELEGRAM_ERROR_FILE, "w") as f: f.write(str(e))
-                await client.disconnect()
-                return
-
-        @client.on(events.NewMessage(incoming=True))
-        async def handler(event):
-            if await event.get_sender() and (await event.get_sender()).bot:
-                return # Ignorar mensajes de otros bots
-
-            me = await client.get_me()
-            if event.sender_id == me.id:
-                return # Ignorar mensajes propios
-
-            logging.info("---- Nuevo Mensaje de Telegram Recibido ----")
-            message_data = {}
-
-            # 1. Remitente (ID y Nombre)
-            sender = await event.get_sender()
-            message_data['remitenteID'] = sender.id
-            sender_name = sender.first_name or "Desconocido"
-            if sender.last_name:
-                sender_name += f" {sender.last_name}"
-            message_data['nombreRemitente'] = sender_name
-            message_data['usernameRemitente'] = sender.username or "N/A"
-
-            # 2. Chat ID y Título del Chat / Es un Grupo
-            chat = await event.get_chat()
-            is_group = isinstance(chat, (Chat, Channel))
-            message_data['esUnGrupo'] = is_group
-            message_data['tituloChat'] = chat.title if is_group else "Chat Privado"
-
-            # 3. Contenido del Mensaje
-            message_text = event.raw_text
-            message_data['contenidoMensaje'] = message_text
-
-            # 5. Hora y 6. ID
-            message_data['timestampUnix'] = event.date.timestamp()
-            message_data['idMensaje'] = event.id
-            
-            # 7. Mensaje reenviado
-            message_data['esReenviado'] = bool(event.forward)
-
-            # 8. Mensaje citado
-            message_data['esRespuesta'] = event.is_reply
-
-            # 9. Tipo de Mensaje y MIME Type
-            if event.media:
-                if isinstance(event.media, MessageMediaPhoto):
-                    message_data['tipoMensaje'] = "image"
-                    message_data['mimeType'] = "image/jpeg"
-                elif isinstance(event.media, MessageMediaDocument):
-                    mime_type = event.media.document.mime_type
-                    message_data['mimeType'] = mime_type
-                    
-                    # Determinar tipo de mensaje basado en MIME type
-                    if mime_type:
-                        if mime_type.startswith('audio/') or mime_type == 'application/ogg':
-                            message_data['tipoMensaje'] = "audio"
-                        elif mime_type.startswith('image/'):
-                            message_data['tipoMensaje'] = "image"
-                        elif mime_type.startswith('video/'):
-                            message_data['tipoMensaje'] = "video"
-                        else:
-                            message_data['tipoMensaje'] = "document"
-                    else:
-                        message_data['tipoMensaje'] = "document"
-                else:
-                    message_data['tipoMensaje'] = "media"
-                    message_data['mimeType'] = "unknown"
-            else:
-                message_data['tipoMensaje'] = "text"
-                message_data['mimeType'] = None
-
-            # 10. Menciones
-            bot_was_mentioned = False
-            if event.mentioned:
-                if me.id in [user.id for user in await event.get_mentioned_users()]:
-                    bot_was_mentioned = True
-            message_data['botFueMencionado'] = bot_was_mentioned
-
-            # --- Procesar archivos adjuntos ---
-            attachments = []
-            if event.media:
+        try:
+            await self.client.send_code_request(self.phone_number)
+            status.publish(STATUS_NEEDS_CODE, True)
+            logging.info(f"[{self.session_id}] Código enviado. Esperando entrada del usuario desde la interfaz.")
+
+            # El panel envía el código por el canal: se recibe al instante, sin sondeo
+            deadline = asyncio.get_running_loop().time() + TELEGRAM_CODE_TIMEOUT
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                message = await status.next_message(MESSAGE_CODE, timeout=max(0, remaining))
+                if message is None:
+                    raise VerificationCodeTimeout("Timeout: No se recibió código válido.")
                 try:
-                    # Crear directorio temporal dentro de DATA_PATH si no existe
-                    temp_dir = os.path.join(DATA_PATH, "temp_media")
-                    os.makedirs(temp_dir, exist_ok=True)
-                    
-                    # Generar nombre único para el archivo
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    file_path = os.path.join(temp_dir, f"telegram_{event.id}_{timestamp}")
-                    
-                    # Descargar el archivo
-                    downloaded_file = await event.download_media(file=file_path)
-                    
-                    if downloaded_file:
-                        # Obtener información del archivo
-                        file_size = os.path.getsize(downloaded_file)
-                        file_type = "unknown"
-                        if isinstance(event.media, MessageMediaPhoto):
-                            file_type = "image"
-                        elif isinstance(event.media, MessageMediaDocument):
-                            if event.media.document.mime_type:
-                                file_type = event.media.document.mime_type
-                                if file_type.startswith("audio/"):
-                                    file_type = "audio"
-                                elif file_type.startswith("image/"):
-                                    file_type = "image"
-                        
-                        # Crear datos del adjunto
-                        attachment_data = {
-                            "type": file_type,
-                            "filename": os.path.basename(downloaded_file),
-                            "size": file_size,
-                            "file_path": downloaded_file
-                        }
-                        attachments.append(attachment_data)
-                        logging.info(f"Archivo adjunto procesado: {attachment_data}")
+                    await self.client.sign_in(self.phone_number, str(message.get("code", "")).strip())
+                    status.publish(STATUS_NEEDS_CODE, None)
+                    status.publish(STATUS_ERROR, None)
+                    status.publish(STATUS_AUTH, AUTH_CONNECTED)
+                    return True
                 except Exception as e:
-                    logging.error(f"Error al procesar archivo adjunto: {e}")
+                    logging.error(f"[{self.session_id}] Error al iniciar sesión con el código: {e}")
+                    status.publish(STATUS_ERROR, str(e))
+        except Exception as e:
+            logging.error(f"[{self.session_id}] Error durante la autenticación: {e}")
+            if isinstance(e, VerificationCodeTimeout):
+                self.end_reason = END_STOPPED # Se vuelve a iniciar desde el panel cuando el usuario tenga el código
+            status.publish(STATUS_NEEDS_CODE, None)
+            status.publish(STATUS_ERROR, str(e))
+            await self.client.disconnect()
+            return False
+
+    async def handle_message(self, event):
+        with self.metrics.timer(METRIC_HANDLER):
+            await self.process_message(event)
+
+    async def process_message(self, event):
+        if event.sender_id == self.me.id:
+            return # Ignorar mensajes propios
+
+        sender = await self.get_cached_sender(event)
+        if sender is None or getattr(sender, "bot", False):
+            return # Ignorar mensajes de otros bots
+
+        logging.debug("Nuevo mensaje de Telegram recibido (%s)", self.session_id)
+        # En chats privados el chat es el propio remitente: no hace falta resolverlo
+        chat = sender if event.is_private else await self.get_cached_chat(event)
+        message = normalize_telegram(
+            event, sender, chat, self.me, self.client,
+            mentioned=self.is_bot_mentioned(event),
+            temp_dir=os.path.join(DATA_PATH, "temp_media"),
+            session_id=self.session_id,
+        )
+        followup = None
+        if event.is_private:
+            # En privado todos los mensajes en cola llegan al agente: los siguientes del mismo usuario
+            # se responden juntos en un solo turno
+            followup = lambda: self.work_queue.queued(event.chat_id, lambda e: e.sender_id == sender.id) > 0
+        await handle_message(
+            message,
+            phishing_client=self.shared.phishing_client,
+            verdict_cache=self.shared.verdict_cache,
+            agent=self.shared.agent,
+            thread_id=self.thread_id(sender.id),
+            channel=ReplyChannel(send=event.reply, edit=lambda msg, text: msg.edit(text)),
+            metrics=self.metrics,
+            reply_gate=self.reply_gate,
+            followup=followup,
+        )
+
+    async def run(self):
+        """Autentica la cuenta y atiende mensajes hasta que se desconecte."""
+        metrics_task = None
+        self._task = asyncio.current_task()
+        REGISTRY.register_collector(self.metric_samples)
+        try:
+            self.status.start()
+            if not await self.authenticate():
+                return
+            auth_seconds = time.monotonic() - self.created_at
+
+            self.me = await self.client.get_me()
+
+            # Cola acotada por chat: orden dentro de cada chat, paralelismo entre chats
+            self.work_queue = ChatWorkQueue.from_env(self.handle_message, prefix="TELEGRAM", name=f"telegram-{self.session_id}")
+            self.work_queue.start()
+
+            self.client.add_event_handler(self.on_new_message, events.NewMessage(incoming=True))
+            # Mensajes que quedaron sin procesar en la parada anterior
+            await self.replay_pending()
+
+            # "authenticated" significa listo para responder: el agente se ha construido en paralelo
+            await self.shared.agent.get()
+            self.status.publish(STATUS_STARTUP, {
+                "ready_at": time.time(),
+                "ready_seconds": round(time.monotonic() - self.created_at, 3),
+                "auth_seconds": round(auth_seconds, 3),
+                "agent_seconds": round(self.shared.agent.build_seconds or 0.0, 3),
+                "imports_seconds": round(IMPORTS_SECONDS, 3),
+            })
+            # Publicar el estado final "authenticated"
+            self.status.publish(STATUS_AUTH, AUTH_AUTHENTICATED)
+            logging.info(f"[{self.session_id}] Estado AUTENTICADO publicado para el panel.")
+            if metrics_interval() > 0:
+                metrics_task = asyncio.ensure_future(self.metrics.publish_periodically(self.status, metrics_interval()))
+            print(f"🤖 BotEngine activo en Telegram ({self.session_id})... esperando mensajes")
+            await self.client.run_until_disconnected()
+            if not self.draining:
+                logging.error(f"[{self.session_id}] Cliente de Telegram desconectado inesperadamente.")
 
-            # --- Lógica de la API de Phishing ---
+        except Exception as e:
+            logging.error(f"[{self.session_id}] Error general en Telegram: {e}")
+            self.status.publish(STATUS_ERROR, str(e))
+            if self.client.is_connected():
+                await self.client.disconnect()
+        finally:
+            if metrics_task is not None:
+                metrics_task.cancel()
+            REGISTRY.unregister_collector(self.metric_samples)
+            if self.work_queue is not None and not self.draining:
+                # Caída: lo que quedaba en la cola se retoma en el siguiente arranque
+                await self.work_queue.stop(drain=False)
+                await run_blocking(self.save_pending, self.work_queue.unfinished)
+            await self.status.close()
+
+    async def on_new_message(self, event):
+        self.metrics.increment(METRIC_RECEIVED)
+        await self.work_queue.submit(event.chat_id, event)
+
+    async def drain(self, timeout=BOT_DRAIN_TIMEOUT):
+        """Parada ordenada: deja de aceptar mensajes, termina el trabajo en curso hasta `timeout`,
+        guarda lo que no haya dado tiempo a procesar y cierra la sesión de Telethon."""
+        if self.draining:
+            return
+        self.draining = True
+        self.end_reason = END_STOPPED
+        self.client.remove_event_handler(self.on_new_message)
+        if self.work_queue is None:
+            # Aún autenticando (p. ej. esperando el código): no hay trabajo que terminar
+            if self._task is not None and not self._task.done():
+                self._task.cancel()
+        else:
+            started = time.monotonic()
+            drained = await self.work_queue.stop(drain=True, timeout=timeout)
+            if not drained:
+                await run_blocking(self.save_pending, self.work_queue.unfinished)
+            logging.info(f"[{self.session_id}] Drenado en {time.monotonic() - started:.1f}s ({'completo' if drained else 'parcial'})")
+        if self.client.is_connected():
+            await self.client.disconnect() # Guarda el estado y cierra el archivo de sesión
+
+    def save_pending(self, items):
+        """Guarda los mensajes sin terminar (chat, ID) para retomarlos al arrancar. Entrega al menos una vez:
+        un mensaje interrumpido a medias se vuelve a procesar."""
+        if not items:
+            return
+        path = pending_messages_path(self.session_id)
+        pending = self._load_pending(path)
+        known = {(item["chat_id"], item["message_id"]) for item in pending}
+        for chat_id, event in items:
+            if (chat_id, event.id) not in known:
+                pending.append({"chat_id": chat_id, "message_id": event.id})
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(pending, f)
+        os.replace(tmp_path, path)
+        logging.info(f"[{self.session_id}] {len(pending)} mensajes pendientes guardados para el siguiente arranque")
+
+    @staticmethod
+    def _load_pending(path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    async def replay_pending(self):
+        path = pending_messages_path(self.session_id)
+        pending = await run_blocking(self._load_pending, path)
+        if not pending:
+            return
+        by_chat = {}
+        for item in pending:
+            by_chat.setdefault(item["chat_id"], []).append(item["message_id"])
+        replayed = 0
+        for chat_id, message_ids in by_chat.items():
             try:
-                phishing_payload = {
-                    "sample": {
-                        "message_id": str(event.id),
-                        "platform": "telegram",
-                        "chat_type": "group" if is_group else "private",
-                        "from": sender_name,
-                        "to": me.first_name or "BotEngine",
-                        "sender_info": {"user_id": str(sender.id), "username": sender.username or "N/A", "is_bot": 1 if sender.bot else 0},
-                        "message_content": {
-                            "text": message_text,
-                            "attachments": attachments
-                        },
-                        "timestamp": event.date.isoformat(),
-                    }
-                }
-                api_response = send_to_phishing_api(phishing_payload)
-                message_data['phishingApiResponse'] = api_response or "No se obtuvo respuesta"
-                if api_response and api_response.get("bot_responses", {}).get("technical_response", {}).get("text"):
-                    await event.reply(f"Alerta de Seguridad: {api_response['bot_responses']['technical_response']['text']}")
+                messages = await self.client.get_messages(chat_id, ids=message_ids)
             except Exception as e:
-                logging.error(f"Error al procesar con la API de Phishing: {e}")
+                logging.error(f"[{self.session_id}] No se pudieron recuperar los mensajes pendientes del chat {chat_id}: {e}")
+                continue
+            for message in messages:
+                if message is None:
+                    continue # Borrado mientras el bot estaba parado
+                event = events.NewMessage.Event(message)
+                event._set_client(self.client)
+                if await self.work_queue.submit(chat_id, event):
+                    replayed += 1
+        await run_blocking(os.remove, path) # Si se vuelven a interrumpir, se guardan de nuevo al parar
+        logging.info(f"[{self.session_id}] {replayed} mensajes pendientes retomados")
+
+    async def stop(self):
+        await self.drain()
+
+
+async def log_stats_periodically(sessions, shared, interval):
+    while True:
+        await asyncio.sleep(interval)
+        for session in list(sessions):
+            logging.info(f"Métricas [{session.session_id}]: {session.stats()}")
+        logging.info(f"Métricas: veredictos={shared.verdict_cache.stats()}")
 
-            # --- Lógica del Agente Conversacional ---
-            if (is_group and bot_was_mentioned) or (not is_group):
-                try:
-                    # Preparar el mensaje para el agente
-                    input_message = message_text
-                    if not input_message:
-                        # Construir mensaje basado en el tipo de contenido y resultado del análisis
-                        tipo_mensaje = message_data.get('tipoMensaje')
-                        phishing_response = message_data.get('phishingApiResponse', {})
-                        is_phishing = phishing_response.get('analysis_results', {}).get('is_phishing', False)
-                        
-                        if is_phishing:
-                            # Si se detectó phishing, incluir esa información en el mensaje
-                            input_message = f"[Se ha detectado contenido sospechoso en el {tipo_mensaje} enviado]"
-                        else:
-                            # Mensaje específico según el tipo de contenido
-                            if tipo_mensaje == "image":
-                                input_message = "[El usuario ha enviado una imagen]"
-                            elif tipo_mensaje == "audio":
-                                input_message = "[El usuario ha enviado un mensaje de voz o archivo de audio]"
-                            elif tipo_mensaje == "video":
-                                input_message = "[El usuario ha enviado un video]"
-                            elif tipo_mensaje == "document":
-                                mime_type = message_data.get('mimeType', '')
-                                input_message = f"[El usuario ha enviado un archivo de tipo: {mime_type or 'desconocido'}]"
-                            else:
-                                input_message = "[El usuario ha enviado un archivo multimedia]"
-
-                    result = await compiled_graph.ainvoke(
-                        {"input": input_message},
-                        config={"configurable": {"thread_id": str(sender.id)}}
-                    )
-                    reply = result["output"]
-                    message_data['respuestaBot'] = reply
-                    await event.reply(reply)
-                except Exception as e:
-                    logging.error(f"Error al generar respuesta para {sender_name}: {e}")
-                    message_data['errorAgente'] = str(e)
-            else:
-                 message_data['respuestaBot'] = "No se respondió (mensaje en grupo sin mención)."
-
-            # --- JSON Output Final ---
-            logging.info(f"--- Datos del Mensaje en JSON ---\n{json.dumps(message_data, indent=2, ensure_ascii=False, default=str)}")
-            logging.info("--- Fin del Procesamiento de Mensaje ---")
-
-        # Indicar que el agente está listo
-        logging.info("Creando agente LangGraph...")
-        global compiled_graph
-        compiled_graph, _ = create_langgraph_agent()
-        logging.info("Agente LangGraph creado.")
-
-        # Escribir el estado final "authenticated"
-        with open(TELEGRAM_AUTH_STATUS_FILE, "w") as f:
-            f.write(AUTH_AUTHENTICATED)
-        logging.info("Estado AUTENTICADO para Streamlit guardado.")
-
-        generate_jwt_token() # Generar token al inicio
-        print("🤖 BotEngine activo en Telegram... esperando mensajes")
-        await client.run_until_disconnected()
-
-    except Exception as e:
-        logging.error(f"Error general en Telegram: {e}")
-        if client.is_connected():
-            await client.disconnect()
+
+async def main():
+    # --- ID de Sesión y credenciales desde variables de entorno (un proceso por cuenta) ---
+    session_id = os.getenv("SESSION_ID", "default_telegram")
+    logging.info(f"Iniciando sesión de Telegram con ID: {session_id}")
+    logging.info(f"Usando DATA_PATH: {DATA_PATH}")
+    api_id_str = os.getenv("API_ID")
+    api_hash = os.getenv("API_HASH")
+    phone_number = os.getenv("PHONE_NUMBER")
+
+    # --- Verificar credenciales ---
+    error_msg = phishing_config_error()
+    if error_msg is None and not all([api_id_str, api_hash, phone_number]):
+        error_msg = "Error: Faltan variables de entorno críticas para Telegram o la API de Phishing."
+    if error_msg is None and not (api_id_str or "").isdigit():
+        error_msg = "Error: API_ID debe ser un número entero."
+    if error_msg:
+        logging.error(error_msg)
+        publish_status_sync(STATUS_SOCKET, "telegram", session_id, {STATUS_ERROR: error_msg})
+        sys.exit(1)
+
+    shared = TelegramShared(agent_memory_path(session_id))
+    session = TelegramSession(session_id, phone_number, int(api_id_str), api_hash, shared)
+    # SIGTERM (supervisor, docker stop) drena la sesión en lugar de cortarla
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, lambda: asyncio.ensure_future(session.drain()))
+    stats_interval = float(os.getenv("TELEGRAM_QUEUE_STATS_INTERVAL", 60))
+    stats_task = asyncio.ensure_future(log_stats_periodically([session], shared, stats_interval)) if stats_interval > 0 else None
+    # Endpoint /metrics de Prometheus y retraso del event loop
+    metrics_server, lag_task = await start_process_metrics(DATA_PATH, "telegram", session_id)
+    try:
+        await shared.phishing_client.generate_token() # Generar token al inicio
+        await session.run()
+    except asyncio.CancelledError:
+        logging.info(f"Sesión {session_id} detenida durante la autenticación.")
+    finally:
+        if stats_task is not None:
+            stats_task.cancel()
+        if lag_task is not None:
+            lag_task.cancel()
+        await metrics_server.close()
+        await shared.close() # Vuelca la memoria del agente a disco
+    return 0 if session.end_reason == END_STOPPED else 1
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # Un único event loop propio (asyncio o uvloop según BOT_EVENT_LOOP)
+    # Código de salida distinto de 0 si la sesión terminó sin que se pidiera: el supervisor la reinicia
+    sys.exit(runtime.run(main()))
@@ -0,0 +1,164 @@
+# telegram_host.py
+# Modo host: muchas cuentas de Telegram en un solo proceso y un solo event loop.
+# Todas las sesiones comparten el agente LangGraph, el pool HTTP de la API de Phishing y la caché
+# de veredictos, así que añadir una cuenta cuesta un TelegramClient y no un intérprete completo.
+# Las sesiones se añaden y eliminan con una API local (JSON por líneas en un socket Unix),
+# normalmente desde el supervisor (SUPERVISOR_TELEGRAM_HOST=true).
+import os
+import sys
+import json
+import asyncio
+import logging
+import signal
+
+from telegram import (
+    DATA_PATH, BOT_DRAIN_TIMEOUT, TelegramShared, TelegramSession, log_stats_periodically, phishing_config_error
+)
+from botengine.prometheus_metrics import start_process_metrics
+from botengine import runtime
+
+HOST_MEMORY_FILE = os.path.join(DATA_PATH, "agent_memory_telegram_host.sqlite")
+
+
+def host_socket_path(data_path):
+    return os.getenv("TELEGRAM_HOST_SOCKET", os.path.join(data_path, "botengine_telegram_host.sock"))
+
+
+class HostError(Exception):
+    """Error devuelto por la API del host."""
+
+
+class TelegramHost:
+    def __init__(self, shared):
+        self.shared = shared
+        self.sessions = {}  # session_id -> TelegramSession
+        self.tasks = {}     # session_id -> asyncio.Task
+        self.finished = {}  # session_id -> motivo de fin de las sesiones que ya no se ejecutan
+
+    async def api_ping(self):
+        return {"pid": os.getpid(), "sessions": len(self.sessions)}
+
+    async def api_add(self, session_id, phone, api_id, api_hash):
+        if session_id in self.sessions:
+            await self.api_remove(session_id)
+        try:
+            api_id = int(api_id)
+        except (TypeError, ValueError):
+            raise HostError("API_ID debe ser un número entero.")
+        if not phone or not api_hash:
+            raise HostError("Faltan el teléfono o el API Hash de la sesión.")
+        session = TelegramSession(session_id, phone, api_id, api_hash, self.shared, thread_namespace=session_id)
+        self.sessions[session_id] = session
+        self.finished.pop(session_id, None)
+        task = asyncio.ensure_future(session.run())
+        self.tasks[session_id] = task
+        task.add_done_callback(lambda t, sid=session_id, s=session: self._on_done(sid, s, t))
+        logging.info(f"Sesión {session_id} añadida al host ({len(self.sessions)} activas)")
+        return True
+
+    def _on_done(self, session_id, session, task):
+        if self.sessions.get(session_id) is not session:
+            return # La sesión se eliminó o se reemplazó
+        del self.sessions[session_id]
+        self.tasks.pop(session_id, None)
+        if task.cancelled():
+            return
+        error = task.exception()
+        # Igual que la salida de un proceso: "exit" solo en una parada deliberada; el supervisor
+        # reinicia las sesiones que terminan con error o por una desconexión
+        self.finished[session_id] = f"error: {error}" if error else session.end_reason
+        logging.info(f"Sesión {session_id} terminada en el host ({self.finished[session_id]})")
+
+    async def api_remove(self, session_id, purge=False):
+        session = self.sessions.pop(session_id, None)
+        task = self.tasks.pop(session_id, None)
+        self.finished.pop(session_id, None)
+        if session is not None:
+            await session.stop() # Drena la sesión: termina o guarda sus mensajes pendientes
+        if task is not None:
+            # asyncio.wait no propaga la cancelación de la tarea (sesión parada mientras se autenticaba)
+            done, _ = await asyncio.wait({task}, timeout=10)
+            if not done:
+                task.cancel()
+        if purge and hasattr(self.shared.checkpointer, "delete_threads"):
+            # Conversaciones de la sesión en la memoria compartida del agente
+            removed = self.shared.checkpointer.delete_threads(f"{session_id}:")
+            logging.info(f"Eliminados {removed} hilos del agente de la sesión {session_id}")
+        return True
+
+    async def api_list(self):
+        sessions = [{"session_id": sid, "running": True} for sid in self.sessions]
+        sessions += [{"session_id": sid, "running": False, "reason": reason} for sid, reason in self.finished.items()]
+        return sessions
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request_id = None
+                try:
+                    request = json.loads(line)
+                    request_id = request.get("id")
+                    method = getattr(self, f"api_{request.get('method', '')}", None)
+                    if method is None:
+                        raise HostError(f"Método desconocido: {request.get('method')}")
+                    response = {"id": request_id, "result": await method(**(request.get("params") or {}))}
+                except (HostError, TypeError, ValueError) as e:
+                    response = {"id": request_id, "error": str(e)}
+                writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        """Drena todas las sesiones a la vez, de modo que la parada dura lo que la más lenta."""
+        logging.info(f"Drenando {len(self.sessions)} sesiones (plazo {BOT_DRAIN_TIMEOUT:.0f}s)...")
+        await asyncio.gather(*(self.api_remove(sid) for sid in list(self.sessions)), return_exceptions=True)
+
+
+async def main():
+    error_msg = phishing_config_error()
+    if error_msg:
+        logging.error(error_msg)
+        sys.exit(1)
+
+    shared = TelegramShared(HOST_MEMORY_FILE)
+    host = TelegramHost(shared)
+    socket_path = host_socket_path(DATA_PATH)
+    if os.path.exists(socket_path):
+        os.remove(socket_path) # Socket huérfano de una ejecución anterior
+    server = await asyncio.start_unix_server(host.handle, path=socket_path)
+    logging.info(f"Host de Telegram escuchando en {socket_path}")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    stats_interval = float(os.getenv("TELEGRAM_QUEUE_STATS_INTERVAL", 60))
+    stats_task = asyncio.ensure_future(
+        log_stats_periodically(host.sessions.values(), shared, stats_interval)
+    ) if stats_interval > 0 else None
+    # Un solo endpoint para todas las cuentas: cada serie lleva el session_id de su sesión
+    metrics_server, lag_task = await start_process_metrics(DATA_PATH, "telegram", "host")
+    try:
+        await shared.phishing_client.generate_token() # Generar token al inicio
+        await stopping.wait()
+    finally:
+        server.close()
+        if stats_task is not None:
+            stats_task.cancel()
+        if lag_task is not None:
+            lag_task.cancel()
+        await metrics_server.close()
+        await host.close()
+        await shared.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+if __name__ == "__main__":
+    runtime.run(main())
@@ -8,6 +8,9 @@ const axios = require('axios');
 const FormData = require('form-data');
 const { createLangGraphAgent } = require('../langgraph/agente_impersonador_wa');
 const nodemailer = require('nodemailer');
+const { StatusClient, statusSocketPath, STATUS_AUTH, STATUS_QR, STATUS_STARTUP, STATUS_METRICS } = require('./status_channel');
+const { SessionMetrics, METRIC_HANDLER, METRIC_PHISHING, METRIC_LLM, METRIC_RECEIVED } = require('./session_metrics');
+const { REGISTRY, startProcessMetrics } = require('./prometheus_metrics');
 
 // Cargar .env desde la raíz del proyecto
 require('dotenv').config({ path: path.resolve(__dirname, '../../.env') });
@@ -20,12 +23,17 @@ console.log(`[whatsapp.js] Iniciando sesión con ID: ${SESSION_ID}`);
 console.log(`[whatsapp.js] Usando DATA_PATH: ${DATA_PATH}`);
 
 
-// --- Constantes y Rutas para Streamlit ---
-const AUTH_STATUS_FILE = path.join(DATA_PATH, `whatsapp_auth_status_${SESSION_ID}.txt`);
-const QR_DATA_URL_FILE = path.join(DATA_PATH, `whatsapp_qr_data_url_${SESSION_ID}.txt`);
+// --- Canal de Estado con Streamlit ---
+const status = new StatusClient(statusSocketPath(DATA_PATH), 'whatsapp', SESSION_ID).start();
 const AUTH_CONNECTED = 'connected';
 const AUTH_AUTHENTICATED = 'authenticated';
 
+// Mensajes/s y latencias de la sesión, publicados periódicamente para el panel y exportados en /metrics
+const metrics = SessionMetrics.fromEnv({ platform: 'whatsapp', session_id: SESSION_ID });
+metrics.publishPeriodically(status, STATUS_METRICS, parseFloat(process.env.SESSION_METRICS_INTERVAL || '5'));
+const metricsEndpoint = startProcessMetrics(DATA_PATH, 'whatsapp', SESSION_ID);
+let tokenRefreshes = 0;
+
 // --- Configuración de Email ---
 const WHATSAPP_QR_EMAIL = process.env.WHATSAPP_QR_EMAIL;
 const EMAIL_HOST = process.env.EMAIL_HOST;
@@ -69,7 +77,8 @@ console.log("[whatsapp.js] Creando cliente de WhatsApp...");
 const whatsapp = new Client({
     authStrategy: new LocalAuth({
         clientId: SESSION_ID,
-        dataPath: DATA_PATH // Especificar el directorio raíz para las sesiones
+        // Cada sesión en su propio directorio (ver botengine/session_registry.py)
+        dataPath: path.join(DATA_PATH, 'sessions', 'whatsapp', SESSION_ID)
     }),
     puppeteer: {
         args: ['--no-sandbox', '--disable-setuid-sandbox'],
@@ -79,22 +88,18 @@ const whatsapp = new Client({
 console.log("[whatsapp.js] Cliente de WhatsApp creado.");
 
 // --- Lógica de Autenticación y QR para Streamlit ---
-async function isAuthenticated() {
-    try {
-        const status = (await fsPromises.readFile(AUTH_STATUS_FILE, 'utf-8')).trim();
-        return status === AUTH_AUTHENTICATED || status === AUTH_CONNECTED;
-    } catch {
-        return false;
-    }
+function isAuthenticated() {
+    const authStatus = status.state[STATUS_AUTH];
+    return authStatus === AUTH_AUTHENTICATED || authStatus === AUTH_CONNECTED;
 }
 
 whatsapp.on('qr', async (qr) => {
-    if (!(await isAuthenticated())) {
+    if (!isAuthenticated()) {
         console.log('Generando código QR como URL de datos para Streamlit...');
         try {
             const qrDataURL = await qrcode.toDataURL(qr);
-            await fsPromises.writeFile(QR_DATA_URL_FILE, qrDataURL, 'utf-8');
-            console.log('Código QR (URL de datos) guardado.');
+            status.publish(STATUS_QR, qrDataURL);
+            console.log('Código QR (URL de datos) publicado.');
 
             // Enviar el QR por correo si está configurado
             if (WHATSAPP_QR_EMAIL && mailTransporter) {
@@ -108,30 +113,30 @@ whatsapp.on('qr', async (qr) => {
 });
 
 whatsapp.on('authenticated', async () => {
-    console.log('[whatsapp.js] Cliente autenticado. Escribiendo estado CONECTADO.');
-    try {
-        await fsPromises.writeFile(AUTH_STATUS_FILE, AUTH_CONNECTED);
-        await fsPromises.unlink(QR_DATA_URL_FILE).catch(() => {});
-    } catch (error) {
-        console.error('[whatsapp.js] Error al guardar el estado de conexión:', error);
-    }
+    console.log('[whatsapp.js] Cliente autenticado. Publicando estado CONECTADO.');
+    status.publish(STATUS_AUTH, AUTH_CONNECTED);
+    status.publish(STATUS_QR, null);
 });
 
 whatsapp.on('ready', async () => {
     console.log('🤖 BotEngine activo en WhatsApp... esperando mensajes');
     
     console.log("[whatsapp.js] Creando agente LangGraph...");
+    const agentStarted = process.hrtime.bigint();
     ({ compiledGraph } = createLangGraphAgent());
+    const agentSeconds = Number(process.hrtime.bigint() - agentStarted) / 1e9;
     console.log("[whatsapp.js] Agente LangGraph creado.");
 
     generateJwtToken();
 
-    try {
-        await fsPromises.writeFile(AUTH_STATUS_FILE, AUTH_AUTHENTICATED);
-        console.log('[whatsapp.js] Estado AUTENTICADO para Streamlit guardado.');
-    } catch (error) {
-        console.error('[whatsapp.js] Error al guardar el estado de autenticación final:', error);
-    }
+    // Tiempos de arranque para el panel (time-to-ready de la sesión)
+    status.publish(STATUS_STARTUP, {
+        ready_at: Date.now() / 1000,
+        ready_seconds: Math.round(process.uptime() * 1000) / 1000,
+        agent_seconds: Math.round(agentSeconds * 1000) / 1000,
+    });
+    status.publish(STATUS_AUTH, AUTH_AUTHENTICATED);
+    console.log('[whatsapp.js] Estado AUTENTICADO publicado para Streamlit.');
 });
 
 //fecha y hora
@@ -197,6 +202,7 @@ async function generateJwtToken() {
         if (response.data && response.data.access) {
             console.log("Token de ACCESO JWT generado exitosamente.");
             phishingJwtToken = response.data.access;
+            tokenRefreshes++;
         } else {
             console.error("Error: El campo 'access' no se encontró en la respuesta del token.", response.data);
             phishingJwtToken = null;
@@ -294,8 +300,34 @@ async function sendToPhishingApi(sampleData) {
 
 
 // --- Manejo de Mensajes (tu código con adaptaciones) ---
+// Mensajes en curso, para drenarlos al parar
+const inFlight = new Set();
+let draining = false;
+let ignoredWhileDraining = 0;
+
+// Contadores leídos en cada scrape de /metrics
+REGISTRY.registerCollector(() => [
+    ['botengine_token_refreshes_total', 'counter', 'Tokens JWT obtenidos para la API de Phishing', {}, tokenRefreshes],
+    ['botengine_queue_in_flight', 'gauge', 'Mensajes en proceso', { queue: `whatsapp-${SESSION_ID}` }, inFlight.size],
+]);
+
 whatsapp.on('message', async msg => {
     if (msg.fromMe) return;
+    metrics.increment(METRIC_RECEIVED);
+    if (draining) {
+        ignoredWhileDraining++;
+        return;
+    }
+    const task = metrics.time(METRIC_HANDLER, () => handleMessage(msg));
+    inFlight.add(task);
+    try {
+        await task;
+    } finally {
+        inFlight.delete(task);
+    }
+});
+
+async function handleMessage(msg) {
 
     const messageData = {};
     console.log('--- Nuevo Mensaje Recibido ---');
@@ -399,7 +431,7 @@ whatsapp.on('message', async msg => {
     console.log('\n--- Payload para API Phishing ---');
     console.log(JSON.stringify(phishingPayload, null, 2));
 
-    const phishingApiResponse = await sendToPhishingApi(phishingPayload);
+    const phishingApiResponse = await metrics.time(METRIC_PHISHING, () => sendToPhishingApi(phishingPayload));
     messageData.phishingApiResponse = phishingApiResponse || { error: "No se obtuvo respuesta" };
     
     if (phishingApiResponse && phishingApiResponse.bot_responses?.technical_response?.text) {
@@ -411,10 +443,10 @@ whatsapp.on('message', async msg => {
     // --- Interacción con el Agente Conversacional ---
     if (compiledGraph) {
         try {
-            const result = await compiledGraph.invoke(
+            const result = await metrics.time(METRIC_LLM, () => compiledGraph.invoke(
                 { input: userMessage },
                 { configurable: { thread_id: senderId } }
-            );
+            ));
             const reply = result.output;
             messageData.respuestaBot = reply;
             await msg.reply(reply);
@@ -428,7 +460,39 @@ whatsapp.on('message', async msg => {
     console.log('\n--- Datos del Mensaje en JSON ---');
     console.log(JSON.stringify(messageData, null, 2));
     console.log('--- Fin del Procesamiento de Mensaje ---');
-});
+}
+
+// --- Parada Ordenada (drenado) ---
+// SIGTERM (supervisor, docker stop): deja de aceptar mensajes, espera a los que están en curso
+// hasta BOT_DRAIN_TIMEOUT y cierra el cliente (Chromium guarda el perfil de LocalAuth) antes de salir.
+const BOT_DRAIN_TIMEOUT = parseFloat(process.env.BOT_DRAIN_TIMEOUT || '20');
+
+async function drain(signal) {
+    if (draining) return;
+    draining = true;
+    console.log(`[whatsapp.js] ${signal} recibido: drenando ${inFlight.size} mensajes en curso (plazo ${BOT_DRAIN_TIMEOUT}s)...`);
+    let timer;
+    const deadline = new Promise(resolve => { timer = setTimeout(resolve, BOT_DRAIN_TIMEOUT * 1000, 'timeout'); });
+    const result = await Promise.race([Promise.allSettled([...inFlight]).then(() => 'ok'), deadline]);
+    clearTimeout(timer);
+    if (result === 'timeout') {
+        console.warn(`[whatsapp.js] Plazo de drenado vencido con ${inFlight.size} mensajes sin terminar.`);
+    }
+    if (ignoredWhileDraining) {
+        console.warn(`[whatsapp.js] ${ignoredWhileDraining} mensajes recibidos durante el drenado no se procesaron.`);
+    }
+    try {
+        await whatsapp.destroy();
+    } catch (err) {
+        console.error('[whatsapp.js] Error al cerrar el cliente de WhatsApp:', err);
+    }
+    status.close();
+    metricsEndpoint.close();
+    process.exit(0);
+}
+
+process.on('SIGTERM', () => drain('SIGTERM'));
+process.on('SIGINT', () => drain('SIGINT'));
 
 // --- Inicialización y Manejo de Errores ---
 process.on('unhandledRejection', (reason, promise) => {
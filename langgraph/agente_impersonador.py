@@ -3,13 +3,15 @@ import os
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langgraph.graph import StateGraph, END
 from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
-from typing import List, TypedDict, Dict, Any
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, AIMessageChunk, SystemMessage
+from typing import List, TypedDict, Dict, Any, Optional, AsyncIterator
+
+from langgraph.memoria import HistoryPolicy, BoundedMemorySaver, trim_history, summarize_messages
+from langgraph.persistencia import SqliteCheckpointSaver
 
 import logging
 
-logging.basicConfig(level=logging.INFO)
+# La configuración del registro la hace cada proceso (botengine/structured_log.py)
 logger = logging.getLogger(__name__)
 
 # No es necesario obtener la key aquí si se pasa en la inicialización o ya está en el entorno
@@ -18,10 +20,13 @@ logger = logging.getLogger(__name__)
 class AgentState(TypedDict):
     input: str
     chat_history: List[BaseMessage]
+    summary: str
     output: str
 
-def create_langgraph_agent():
+def create_langgraph_agent(history_policy: Optional[HistoryPolicy] = None, checkpoint_path: Optional[str] = None):
     logger.info("DEBUG: create_langgraph_agent() en Python ha sido llamado.")
+    # Política de memoria: ventana por tokens, resumen opcional y límite de hilos
+    policy = history_policy or HistoryPolicy.from_env()
 
     openai_key = os.getenv("OPENAI_API_KEY")
     if not openai_key:
@@ -39,28 +44,40 @@ def create_langgraph_agent():
     ])
 
     llm_chain = prompt | llm
+    summary_llm = ChatOpenAI(model=policy.summary_model, api_key=openai_key, temperature=0) if policy.summarize else None
 
     async def run_agent_node(state: AgentState) -> Dict[str, Any]:
         # Construir la entrada para el LLM, asegurando que chat_history siempre exista
+        chat_history = state.get("chat_history", [])  # Usar .get() con una lista vacía como valor por defecto
+        if state.get("summary"):
+            # El resumen de los turnos antiguos precede a la ventana de mensajes recientes
+            chat_history = [SystemMessage(content=f"Resumen de la conversación anterior: {state['summary']}")] + chat_history
         agent_input = {
             "input": state["input"],
-            "chat_history": state.get("chat_history", [])  # Usar .get() con una lista vacía como valor por defecto
+            "chat_history": chat_history
         }
-        logger.info(f"INPUT a la cadena LLM: {agent_input}")
+        # Solo en DEBUG y con formateo diferido: el historial completo crece con cada turno
+        logger.debug("Entrada a la cadena LLM", extra={"fields": {"input": state["input"], "chat_history_len": len(chat_history)}})
         response_message = await llm_chain.ainvoke(agent_input)
-        logger.info(f"SALIDA de la cadena LLM (BaseMessage): {response_message}")
+        logger.debug("Salida de la cadena LLM", extra={"fields": {"output": response_message.content}})
         return {"output": response_message.content}
 
-    def update_chat_history_node(state: AgentState) -> Dict[str, List[BaseMessage]]:
+    async def update_chat_history_node(state: AgentState) -> Dict[str, Any]:
         # Obtener el historial existente o una lista vacía si es el primer turno
-        chat_history = state.get("chat_history", [])
+        chat_history = list(state.get("chat_history", []))
         
         # Añadir el último intercambio (humano y IA) al historial
         chat_history.append(HumanMessage(content=state["input"]))
         chat_history.append(AIMessage(content=state["output"]))
 
+        # Recortar el historial al presupuesto de tokens
+        chat_history, overflow = trim_history(chat_history, policy)
+        update: Dict[str, Any] = {"chat_history": chat_history}
+        if overflow and summary_llm is not None:
+            update["summary"] = await summarize_messages(summary_llm, state.get("summary", ""), overflow, policy.summary_max_words)
+
         # Devolver el historial actualizado para que se guarde en el estado
-        return {"chat_history": chat_history}
+        return update
 
     workflow = StateGraph(AgentState)
 
@@ -72,9 +89,23 @@ def create_langgraph_agent():
     workflow.add_edge("agent", "update_history")
     workflow.add_edge("update_history", END)
 
-    # El checkpointer es necesario para mantener la memoria entre invocaciones
-    checkpointer = MemorySaver()
+    # El checkpointer es necesario para mantener la memoria entre invocaciones.
+    # Con checkpoint_path las conversaciones sobreviven a reinicios (SQLite bajo DATA_PATH).
+    if checkpoint_path:
+        checkpointer = SqliteCheckpointSaver(checkpoint_path, max_threads=policy.max_threads, keep_checkpoints=policy.keep_checkpoints)
+    else:
+        checkpointer = BoundedMemorySaver(max_threads=policy.max_threads, keep_checkpoints=policy.keep_checkpoints)
     compiled_graph = workflow.compile(checkpointer=checkpointer)
     
     # Devolvemos el grafo y el checkpointer como una tupla
-    return compiled_graph, checkpointer
\ No newline at end of file
+    return compiled_graph, checkpointer
+
+
+async def astream_agent_reply(compiled_graph, agent_input: Dict[str, Any], config: Dict[str, Any]) -> AsyncIterator[str]:
+    """Ejecuta el grafo y produce los fragmentos de texto del LLM del nodo 'agent' según llegan.
+
+    El estado (historial, resumen) se guarda igual que con ainvoke al terminar el flujo.
+    """
+    async for chunk, metadata in compiled_graph.astream(agent_input, config=config, stream_mode="messages"):
+        if metadata.get("langgraph_node") == "agent" and isinstance(chunk, AIMessageChunk) and isinstance(chunk.content, str):
+            yield chunk.content
@@ -0,0 +1,156 @@
+# memoria.py
+# Política de memoria conversacional del agente: ventana deslizante limitada por tokens,
+# resumen acumulado opcional de los turnos antiguos y expulsión LRU de hilos inactivos.
+import os
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+logger = logging.getLogger(__name__)
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "si", "sí")
+
+
+@dataclass
+class HistoryPolicy:
+    max_tokens: int = 2000          # Presupuesto de tokens del historial enviado al LLM
+    low_watermark: float = 0.75     # Al recortar, se baja hasta este porcentaje del presupuesto
+    summarize: bool = False         # Resumir los turnos expulsados en lugar de descartarlos
+    summary_model: str = "gpt-4o-mini"
+    summary_max_words: int = 150
+    max_threads: int = 1000         # Hilos (conversaciones) máximos en memoria
+    keep_checkpoints: int = 2       # Checkpoints conservados por hilo
+
+    @classmethod
+    def from_env(cls) -> "HistoryPolicy":
+        return cls(
+            max_tokens=int(os.getenv("AGENT_HISTORY_MAX_TOKENS", cls.max_tokens)),
+            low_watermark=float(os.getenv("AGENT_HISTORY_LOW_WATERMARK", cls.low_watermark)),
+            summarize=_env_bool("AGENT_HISTORY_SUMMARY", cls.summarize),
+            summary_model=os.getenv("AGENT_SUMMARY_MODEL", cls.summary_model),
+            summary_max_words=int(os.getenv("AGENT_SUMMARY_MAX_WORDS", cls.summary_max_words)),
+            max_threads=int(os.getenv("AGENT_MAX_THREADS", cls.max_threads)),
+            keep_checkpoints=int(os.getenv("AGENT_KEEP_CHECKPOINTS", cls.keep_checkpoints)),
+        )
+
+
+def estimate_tokens(message: BaseMessage) -> int:
+    """Estimación barata (~4 caracteres por token) más el coste fijo por mensaje."""
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return len(content) // 4 + 4
+
+
+def trim_history(history: List[BaseMessage], policy: HistoryPolicy) -> Tuple[List[BaseMessage], List[BaseMessage]]:
+    """Devuelve (historial conservado, mensajes expulsados).
+
+    Solo se recorta cuando se supera el presupuesto, y entonces se baja hasta el
+    `low_watermark` para que los recortes (y los resúmenes) no ocurran en cada turno.
+    """
+    total = sum(estimate_tokens(m) for m in history)
+    if total <= policy.max_tokens:
+        return history, []
+
+    target = int(policy.max_tokens * policy.low_watermark)
+    start = 0
+    while start < len(history) and total > target:
+        total -= estimate_tokens(history[start])
+        start += 1
+    # El historial conservado siempre empieza por un mensaje del usuario
+    while start < len(history) and not isinstance(history[start], HumanMessage):
+        start += 1
+    return history[start:], history[:start]
+
+
+async def summarize_messages(llm, previous_summary: str, messages: List[BaseMessage], max_words: int) -> str:
+    """Integra los mensajes expulsados en el resumen acumulado de la conversación."""
+    transcript = "\n".join(
+        f"{'Usuario' if isinstance(m, HumanMessage) else 'Tú'}: {m.content}" for m in messages
+    )
+    instructions = (
+        f"Actualiza el resumen de la conversación con los nuevos mensajes. "
+        f"Conserva datos personales, preferencias y temas pendientes. Máximo {max_words} palabras.\n\n"
+        f"Resumen actual:\n{previous_summary or '(vacío)'}\n\nNuevos mensajes:\n{transcript}"
+    )
+    try:
+        response = await llm.ainvoke([SystemMessage(content=instructions)])
+        return response.content
+    except Exception as e:
+        logger.error(f"Error al resumir el historial, se conserva el resumen anterior: {e}")
+        return previous_summary
+
+
+class BoundedMemorySaver(MemorySaver):
+    """MemorySaver que conserva pocos checkpoints por hilo y expulsa los hilos menos usados."""
+
+    def __init__(self, max_threads: int = 1000, keep_checkpoints: int = 2, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max(1, max_threads)
+        self.keep_checkpoints = max(1, keep_checkpoints)
+        self._lru: "OrderedDict[str, None]" = OrderedDict()
+        self.evicted_threads = 0
+
+    def _touch(self, thread_id: Optional[str]) -> None:
+        if thread_id is None:
+            return
+        self._lru[thread_id] = None
+        self._lru.move_to_end(thread_id)
+        while len(self._lru) > self.max_threads:
+            old_thread_id, _ = self._lru.popitem(last=False)
+            self._evict(old_thread_id)
+            self.evicted_threads += 1
+            logger.info(f"Hilo inactivo expulsado de la memoria: {old_thread_id}")
+
+    def _evict(self, thread_id: str) -> None:
+        """Libera un hilo de la memoria. Sin persistencia, equivale a borrarlo."""
+        self.delete_thread(thread_id)
+
+    def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_checkpoints:
+            return
+        # Los IDs de checkpoint son ordenables cronológicamente
+        stale_ids = sorted(checkpoints)[:-self.keep_checkpoints]
+        stale_versions = set()
+        for checkpoint_id in stale_ids:
+            saved_checkpoint, _, _ = checkpoints.pop(checkpoint_id)
+            stale_versions.update(self.serde.loads_typed(saved_checkpoint)["channel_versions"].items())
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+        # Un blob solo se borra si ningún checkpoint restante lo referencia
+        for saved_checkpoint, _, _ in checkpoints.values():
+            stale_versions.difference_update(self.serde.loads_typed(saved_checkpoint)["channel_versions"].items())
+        for channel, version in stale_versions:
+            self.blobs.pop((thread_id, checkpoint_ns, channel, version), None)
+
+    def get_tuple(self, config):
+        self._touch(config["configurable"].get("thread_id"))
+        return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = result["configurable"]["thread_id"]
+        self._prune(thread_id, result["configurable"]["checkpoint_ns"])
+        self._touch(thread_id)
+        return result
+
+    def delete_thread(self, thread_id: str) -> None:
+        self._lru.pop(thread_id, None)
+        super().delete_thread(thread_id)
+
+    def thread_ids(self) -> List[str]:
+        return list(self.storage.keys())
+
+    def delete_threads(self, prefix: str) -> int:
+        """Borra todos los hilos cuyo ID empieza por `prefix` (p. ej. los de una sesión). Devuelve cuántos."""
+        thread_ids = [t for t in self.thread_ids() if t.startswith(prefix)]
+        for thread_id in thread_ids:
+            self.delete_thread(thread_id)
+        return len(thread_ids)
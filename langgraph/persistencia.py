@@ -0,0 +1,422 @@
+# persistencia.py
+# Checkpointer persistente del agente: SQLite en modo WAL bajo DATA_PATH.
+# Los hilos activos viven en memoria (BoundedMemorySaver) y se cargan de disco bajo demanda;
+# las escrituras se agrupan y las vuelca un hilo en segundo plano, sin bloquear el event loop.
+# Los métodos asíncronos leen de disco en el executor del loop, y el lock solo protege copias
+# superficiales: ni la deserialización ni SQLite se ejecutan con él tomado.
+import os
+import time
+import atexit
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from langgraph.memoria import BoundedMemorySaver
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    checkpoint_type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    parent_checkpoint_id TEXT,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    version,
+    type TEXT,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    blob BLOB,
+    task_path TEXT,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+class SqliteCheckpointSaver(BoundedMemorySaver):
+    """Checkpointer con caché en memoria y persistencia diferida en SQLite."""
+
+    def __init__(
+        self,
+        path: str,
+        max_threads: int = 1000,
+        keep_checkpoints: int = 2,
+        flush_interval: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        max_idle_days: Optional[float] = None,
+        compact_interval: float = 6 * 3600,
+        **kwargs,
+    ):
+        super().__init__(max_threads=max_threads, keep_checkpoints=keep_checkpoints, **kwargs)
+        self.path = path
+        self.flush_interval = flush_interval if flush_interval is not None else float(os.getenv("AGENT_CHECKPOINT_FLUSH_INTERVAL", 2))
+        self.batch_size = batch_size if batch_size is not None else int(os.getenv("AGENT_CHECKPOINT_BATCH_SIZE", 50))
+        self.max_idle_days = max_idle_days if max_idle_days is not None else float(os.getenv("AGENT_CHECKPOINT_MAX_IDLE_DAYS", 30))
+        self.compact_interval = compact_interval
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._write_conn = _connect(path)
+        self._write_conn.executescript(_SCHEMA)
+        self._read_conn = _connect(path)
+        self._read_lock = threading.Lock()  # La conexión de lectura se usa desde el loop y el executor
+        self._write_lock = threading.Lock()  # Un solo volcado o compactación a la vez sobre la conexión de escritura
+
+        self._lock = threading.RLock()
+        self._loaded = set()        # Hilos presentes en memoria (o que se sabe que no existen en disco)
+        self._dirty = set()         # Hilos con cambios pendientes de volcar
+        self._deleted = set()       # Hilos borrados explícitamente pendientes de borrar en disco
+        self._flushing = set()      # Hilos copiados por el volcado en curso, aún sin sus blobs
+        self._pending: Dict[str, Dict[str, Any]] = {}  # Instantáneas de hilos expulsados sin volcar
+        self.flushes = 0
+        self.loads = 0
+
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._last_compaction = 0.0
+        self._flusher = threading.Thread(target=self._flush_loop, name="checkpoint-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    # --- Instantáneas en memoria ---
+
+    def _copy_thread(self, thread_id: str) -> Dict[str, Any]:
+        """Copia superficial de los checkpoints y escrituras de un hilo, sin blobs. Se llama con el lock tomado."""
+        storage = {ns: dict(checkpoints) for ns, checkpoints in self.storage.get(thread_id, {}).items()}
+        writes = {}
+        for ns, checkpoints in storage.items():
+            for checkpoint_id in checkpoints:
+                outer_key = (thread_id, ns, checkpoint_id)
+                if outer_key in self.writes:
+                    writes[outer_key] = dict(self.writes[outer_key])
+        return {"storage": storage, "blobs": {}, "writes": writes}
+
+    def _blob_keys(self, thread_id: str, storage: Dict[str, Any]) -> Set[tuple]:
+        """Blobs referenciados por los checkpoints copiados. Deserializa, así que no necesita el lock."""
+        keys = set()
+        for ns, checkpoints in storage.items():
+            for saved_checkpoint, _, _ in checkpoints.values():
+                for channel, version in self.serde.loads_typed(saved_checkpoint)["channel_versions"].items():
+                    keys.add((thread_id, ns, channel, version))
+        return keys
+
+    def _copy_blobs(self, keys: Set[tuple]) -> Dict[tuple, Any]:
+        return {key: self.blobs[key] for key in keys if key in self.blobs}
+
+    def _snapshot(self, thread_id: str) -> Dict[str, Any]:
+        """Copia completa de los datos de un hilo. Se llama con el lock tomado."""
+        snapshot = self._copy_thread(thread_id)
+        snapshot["blobs"] = self._copy_blobs(self._blob_keys(thread_id, snapshot["storage"]))
+        return snapshot
+
+    def _restore(self, thread_id: str, snapshot: Dict[str, Any]) -> None:
+        for ns, checkpoints in snapshot["storage"].items():
+            self.storage[thread_id][ns].update(checkpoints)
+        self.blobs.update(snapshot["blobs"])
+        for outer_key, inner in snapshot["writes"].items():
+            self.writes[outer_key].update(inner)
+
+    def _drop_from_memory(self, thread_id: str, snapshot: Dict[str, Any]) -> None:
+        self.storage.pop(thread_id, None)
+        for key in snapshot["blobs"]:
+            self.blobs.pop(key, None)
+        for outer_key in snapshot["writes"]:
+            self.writes.pop(outer_key, None)
+
+    # --- Carga perezosa ---
+
+    def _load_from_db(self, thread_id: str) -> Dict[str, Any]:
+        with self._read_lock:
+            return self._read_thread(thread_id)
+
+    def _read_thread(self, thread_id: str) -> Dict[str, Any]:
+        snapshot = {"storage": {}, "blobs": {}, "writes": {}}
+        rows = self._read_conn.execute(
+            "SELECT checkpoint_ns, checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata, parent_checkpoint_id "
+            "FROM checkpoints WHERE thread_id = ?", (thread_id,)
+        ).fetchall()
+        for ns, checkpoint_id, c_type, c_blob, m_type, m_blob, parent_id in rows:
+            snapshot["storage"].setdefault(ns, {})[checkpoint_id] = ((c_type, c_blob), (m_type, m_blob), parent_id)
+        for ns, channel, version, b_type, blob in self._read_conn.execute(
+            "SELECT checkpoint_ns, channel, version, type, blob FROM blobs WHERE thread_id = ?", (thread_id,)
+        ):
+            snapshot["blobs"][(thread_id, ns, channel, version)] = (b_type, blob)
+        for ns, checkpoint_id, task_id, idx, channel, w_type, blob, task_path in self._read_conn.execute(
+            "SELECT checkpoint_ns, checkpoint_id, task_id, idx, channel, type, blob, task_path FROM writes WHERE thread_id = ?",
+            (thread_id,)
+        ):
+            snapshot["writes"].setdefault((thread_id, ns, checkpoint_id), {})[(task_id, idx)] = (
+                task_id, channel, (w_type, blob), task_path
+            )
+        return snapshot
+
+    def _ensure_loaded(self, thread_id: Optional[str]) -> None:
+        if thread_id is None or thread_id in self._loaded:
+            return
+        with self._lock:
+            if thread_id in self._loaded:
+                return
+            snapshot = self._pending.pop(thread_id, None)
+            if snapshot is not None:
+                # La instantánea aún no se había volcado: vuelve a memoria como cambio pendiente
+                self._dirty.add(thread_id)
+                self._restore(thread_id, snapshot)
+                self._loaded.add(thread_id)
+                return
+        # La lectura de disco se hace sin el lock para no frenar a los hilos ya cargados ni al volcado.
+        # Un hilo que no está cargado no tiene cambios sin volcar, así que lo leído está al día.
+        snapshot = self._load_from_db(thread_id)
+        with self._lock:
+            if thread_id in self._loaded:
+                return # Otra llamada lo cargó (o se borró) mientras se leía
+            self.loads += 1
+            self._restore(thread_id, snapshot)
+            self._loaded.add(thread_id)
+
+    async def _aensure_loaded(self, thread_id: Optional[str]) -> None:
+        if thread_id is not None and thread_id not in self._loaded:
+            await asyncio.get_running_loop().run_in_executor(None, self._ensure_loaded, thread_id)
+
+    # --- API del checkpointer ---
+
+    def get_tuple(self, config):
+        self._ensure_loaded(config["configurable"].get("thread_id"))
+        with self._lock:
+            return super().get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        if config:
+            self._ensure_loaded(config["configurable"].get("thread_id"))
+        with self._lock:
+            items = list(super().list(config, filter=filter, before=before, limit=limit))
+        yield from items
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        self._ensure_loaded(thread_id)
+        with self._lock:
+            result = super().put(config, checkpoint, metadata, new_versions)
+            self._mark_dirty(thread_id)
+        return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        self._ensure_loaded(thread_id)
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+            self._mark_dirty(thread_id)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            super().delete_thread(thread_id)
+            self._dirty.discard(thread_id)
+            self._pending.pop(thread_id, None)
+            self._deleted.add(thread_id)
+            # El hilo queda "cargado" y vacío para no releerlo de disco hasta que se vuelque el borrado
+            self._loaded.add(thread_id)
+        self._wakeup.set()
+
+    # Versiones asíncronas: la carga perezosa desde disco va al executor; el resto solo toca memoria
+
+    async def aget_tuple(self, config):
+        await self._aensure_loaded(config["configurable"].get("thread_id"))
+        return self.get_tuple(config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        if config:
+            await self._aensure_loaded(config["configurable"].get("thread_id"))
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        await self._aensure_loaded(config["configurable"]["thread_id"])
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await self._aensure_loaded(config["configurable"]["thread_id"])
+        self.put_writes(config, writes, task_id, task_path)
+
+    def thread_ids(self) -> List[str]:
+        # Hilos en memoria, expulsados sin volcar y guardados en disco
+        with self._lock:
+            thread_ids = set(self.storage.keys()) | set(self._pending.keys())
+            deleted = set(self._deleted)
+        with self._read_lock:
+            rows = self._read_conn.execute("SELECT thread_id FROM threads").fetchall()
+        thread_ids.update(row[0] for row in rows)
+        return sorted(thread_ids - deleted)
+
+    def _mark_dirty(self, thread_id: str) -> None:
+        self._dirty.add(thread_id)
+        if len(self._dirty) >= self.batch_size:
+            self._wakeup.set()
+
+    def _evict(self, thread_id: str) -> None:
+        # Se libera la memoria; si hay cambios sin volcar se conservan como instantánea pendiente
+        with self._lock:
+            snapshot = self._snapshot(thread_id)
+            # Si el volcado en curso aún no ha copiado sus blobs, la instantánea completa queda para el siguiente
+            if thread_id in self._dirty or thread_id in self._flushing:
+                self._dirty.discard(thread_id)
+                self._pending[thread_id] = snapshot
+                self._wakeup.set()
+            self._drop_from_memory(thread_id, snapshot)
+            self._loaded.discard(thread_id)
+
+    # --- Volcado a disco ---
+
+    def _write_snapshot(self, thread_id: str, snapshot: Dict[str, Any], now: float) -> None:
+        conn = self._write_conn
+        for table in ("checkpoints", "blobs", "writes"):
+            conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+        conn.executemany(
+            "INSERT INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (thread_id, ns, checkpoint_id, c[0], c[1], m[0], m[1], parent_id)
+                for ns, checkpoints in snapshot["storage"].items()
+                for checkpoint_id, (c, m, parent_id) in checkpoints.items()
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO blobs VALUES (?, ?, ?, ?, ?, ?)",
+            [(t, ns, channel, version, b[0], b[1]) for (t, ns, channel, version), b in snapshot["blobs"].items()],
+        )
+        conn.executemany(
+            "INSERT INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (t, ns, checkpoint_id, task_id, idx, channel, value[0], value[1], task_path)
+                for (t, ns, checkpoint_id), inner in snapshot["writes"].items()
+                for (task_id, idx), (_, channel, value, task_path) in inner.items()
+            ],
+        )
+        conn.execute("INSERT OR REPLACE INTO threads VALUES (?, ?)", (thread_id, now))
+
+    def flush(self) -> int:
+        """Vuelca en una sola transacción todos los hilos modificados. Devuelve cuántos se escribieron."""
+        with self._write_lock:
+            return self._flush()
+
+    def _flush(self) -> int:
+        with self._lock:
+            deleted = self._deleted
+            self._deleted = set()
+            pending = self._pending
+            self._pending = {}
+            snapshots = dict(pending)
+            copied = {thread_id: self._copy_thread(thread_id) for thread_id in self._dirty}
+            snapshots.update(copied)
+            self._dirty = set()
+            self._flushing = set(copied)
+        if not deleted and not snapshots:
+            return 0
+
+        # La deserialización para localizar los blobs se hace fuera del lock; después solo se copian
+        blob_keys = {thread_id: self._blob_keys(thread_id, snapshot["storage"]) for thread_id, snapshot in copied.items()}
+        with self._lock:
+            for thread_id, keys in blob_keys.items():
+                copied[thread_id]["blobs"] = self._copy_blobs(keys)
+            self._flushing = set()
+
+        now = time.time()
+        try:
+            with self._write_conn:
+                for thread_id in deleted:
+                    for table in ("checkpoints", "blobs", "writes", "threads"):
+                        self._write_conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+                for thread_id, snapshot in snapshots.items():
+                    self._write_snapshot(thread_id, snapshot, now)
+        except sqlite3.Error as e:
+            logger.error(f"Error al volcar checkpoints a {self.path}: {e}")
+            # Se reintentará en el siguiente volcado
+            with self._lock:
+                self._deleted |= deleted
+                for thread_id, snapshot in snapshots.items():
+                    if thread_id in self._loaded:
+                        self._dirty.add(thread_id)
+                    else:
+                        self._pending.setdefault(thread_id, snapshot)
+            return 0
+        if deleted:
+            with self._lock:
+                # Ya borrados en disco: una lectura posterior lo encontrará vacío, así que dejan de
+                # contar como cargados salvo que se hayan vuelto a usar entretanto
+                self._loaded.difference_update(t for t in deleted if t not in self.storage)
+        self.flushes += 1
+        return len(snapshots) + len(deleted)
+
+    def compact(self) -> int:
+        """Borra los hilos inactivos más de `max_idle_days` y trunca el WAL."""
+        with self._write_lock:
+            return self._compact()
+
+    def _compact(self) -> int:
+        removed = 0
+        if self.max_idle_days > 0:
+            cutoff = time.time() - self.max_idle_days * 86400
+            with self._write_conn:
+                stale = [row[0] for row in self._write_conn.execute(
+                    "SELECT thread_id FROM threads WHERE updated_at < ?", (cutoff,)
+                )]
+                for thread_id in stale:
+                    for table in ("checkpoints", "blobs", "writes", "threads"):
+                        self._write_conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            removed = len(stale)
+            if removed:
+                logger.info(f"Compactación: {removed} hilos inactivos eliminados de {self.path}")
+        self._write_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._last_compaction = time.time()
+        return removed
+
+    def _flush_loop(self) -> None:
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if time.time() - self._last_compaction >= self.compact_interval:
+                    self.compact()
+            except Exception as e:
+                logger.error(f"Error en el hilo de volcado de checkpoints: {e}")
+
+    def close(self) -> None:
+        """Detiene el hilo de volcado y escribe los cambios pendientes."""
+        if self._stopping:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._flusher.join(timeout=10)
+        self.flush()
+        self._write_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._write_conn.close()
+        self._read_conn.close()
@@ -1,227 +1,279 @@
 import streamlit as st
 import subprocess
 import os
-import sys
-import time
-import psutil
 import shutil
-import json
+
+from botengine.status_channel import (
+    STATUS_AUTH, STATUS_NEEDS_CODE, STATUS_ERROR, STATUS_QR, STATUS_STARTUP, STATUS_METRICS, MESSAGE_CODE
+)
+from botengine.session_registry import SessionRegistry, session_dir
+from botengine.supervisor import (
+    SupervisorError, ensure_supervisor, STATE_RUNNING, STATE_BACKOFF
+)
 
 # --- Constantes y Rutas ---
 script_dir = os.path.dirname(os.path.abspath(__file__))
 # DATA_PATH será el directorio raíz para todos los datos persistentes (sesiones, configs, etc.)
 # Si la variable de entorno no está, usa el directorio del script como fallback para desarrollo local.
 DATA_PATH = os.getenv("DATA_PATH", script_dir)
-BOTS_DIR = os.path.join(script_dir, "bots")
-SESSIONS_CONFIG_FILE = os.path.join(DATA_PATH, "sessions_config.json")
-
-# Rutas de Telegram (modificadas para multisesión y DATA_PATH)
-def get_telegram_session_files(session_id):
-    base_name = f"_{session_id}"
-    session_file_path = os.path.join(DATA_PATH, f"chatbot_session{base_name}.session")
-    return {
-        "need_code": os.path.join(DATA_PATH, f"telegram_needs_code{base_name}.txt"),
-        "code": os.path.join(DATA_PATH, f"telegram_code{base_name}.txt"),
-        "auth_status": os.path.join(DATA_PATH, f"telegram_auth_status{base_name}.txt"),
-        "error": os.path.join(DATA_PATH, f"telegram_error{base_name}.txt"),
-        "session": session_file_path,
-        "journal": f"{session_file_path}-journal"
-    }
+# Intervalo de refresco del estado en la interfaz; es una consulta local al supervisor, no bloquea el panel
+PANEL_STATUS_REFRESH = float(os.getenv("PANEL_STATUS_REFRESH", 1.0))
 
 AUTH_CONNECTED = "connected"
 AUTH_AUTHENTICATED = "authenticated"
 
-# Rutas de WhatsApp (modificadas para multisesión y DATA_PATH)
-def get_whatsapp_auth_status_file(session_id):
-    return os.path.join(DATA_PATH, f"whatsapp_auth_status_{session_id}.txt")
 
-def get_whatsapp_qr_data_url_file(session_id):
-    return os.path.join(DATA_PATH, f"whatsapp_qr_data_url_{session_id}.txt")
+# --- Registro de Sesiones ---
+# Índice de sesiones en DATA_PATH/sessions/index.json; los datos de cada sesión viven en su
+# propio directorio (DATA_PATH/sessions/<plataforma>/<session_id>/).
+@st.cache_resource
+def get_registry():
+    """Registro compartido entre ejecuciones del script; solo relee el índice si cambió su mtime."""
+    registry = SessionRegistry(DATA_PATH)
+    registry.migrate_legacy()
+    return registry
 
-def get_whatsapp_session_dir(session_id):
-    # Corregido: La sesión se guarda directamente en DATA_PATH, no en una subcarpeta .wwebjs_auth
-    return os.path.join(DATA_PATH, f"session-{session_id}")
 
+# --- Supervisor de Sesiones ---
+# Los procesos de los bots pertenecen al supervisor (botengine/supervisor.py), no al panel:
+# sobreviven a recargas del navegador y reinicios de Streamlit, y se reinician si se caen.
+@st.cache_resource
+def get_supervisor():
+    """Cliente del supervisor, que se lanza en segundo plano si no está en marcha."""
+    return ensure_supervisor(DATA_PATH)
 
-# --- Funciones de Gestión de Configuración de Sesiones ---
-def load_sessions_config():
-    """Carga la configuración de las sesiones desde el archivo JSON."""
-    if not os.path.exists(SESSIONS_CONFIG_FILE):
-        return {}
-    with open(SESSIONS_CONFIG_FILE, 'r') as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
+def get_session_status(platform, session_id):
+    """Estado del proceso y último estado publicado por el bot. Vacío si el supervisor no responde."""
+    try:
+        return get_supervisor().call("status", platform=platform, session_id=session_id)
+    except (OSError, SupervisorError) as e:
+        return {"status": {}, "supervisor_error": str(e)}
 
-def save_sessions_config(config):
-    """Guarda la configuración de las sesiones en el archivo JSON."""
-    with open(SESSIONS_CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=4)
+def sync_sessions(platform, sessions):
+    """Añade las sesiones que conoce el supervisor y actualiza si están en ejecución."""
+    try:
+        supervised = get_supervisor().call("list")
+    except (OSError, SupervisorError) as e:
+        st.error(f"No se pudo contactar con el supervisor de sesiones: {e}")
+        return
+    for info in supervised:
+        if info["platform"] != platform:
+            continue
+        session = sessions.setdefault(info["session_id"], {})
+        session["running"] = info["desired"] == STATE_RUNNING
+        session["pid"] = info.get("pid")
+
+def stop_session(platform, session_id):
+    try:
+        get_supervisor().call("stop", platform=platform, session_id=session_id)
+        st.info(f"Sesión '{session_id}' detenida.")
+    except (OSError, SupervisorError) as e:
+        st.warning(f"No se pudo detener la sesión '{session_id}': {e}")
+
+def remove_session(platform, session_id):
+    try:
+        get_supervisor().call("remove", platform=platform, session_id=session_id)
+    except (OSError, SupervisorError) as e:
+        st.warning(f"No se pudo detener la sesión '{session_id}': {e}")
 
 
 # --- Funciones de Detección de Sesiones ---
 def discover_sessions():
-    """Escanea el directorio de datos en busca de sesiones existentes y las carga en el estado."""
-    # WhatsApp
-    # Corregido: Buscar directamente en DATA_PATH las carpetas de sesión.
-    if os.path.isdir(DATA_PATH):
-        for item in os.listdir(DATA_PATH):
-            full_path = os.path.join(DATA_PATH, item)
-            if os.path.isdir(full_path) and item.startswith("session-"):
-                session_id = item.replace("session-", "")
-                if session_id not in st.session_state.whatsapp_sessions:
-                    st.session_state.whatsapp_sessions[session_id] = {"running": False}
-    
-    # Telegram
-    sessions_config = load_sessions_config()
-    for item in os.listdir(DATA_PATH):
-        if item.startswith("chatbot_session_") and item.endswith(".session"):
-            session_id = item.replace("chatbot_session_", "").replace(".session", "")
-            if session_id not in st.session_state.telegram_sessions:
-                 phone = sessions_config.get("telegram", {}).get(session_id, {}).get("phone", "")
-                 st.session_state.telegram_sessions[session_id] = {"running": False, "phone": phone}
+    """Carga en el estado las sesiones del registro. Coste O(sesiones): no lista DATA_PATH."""
+    registry = get_registry()
+    for session_id, meta in registry.list("whatsapp").items():
+        st.session_state.whatsapp_sessions.setdefault(session_id, {"running": False, "email": meta.get("email", "")})
+    for session_id, meta in registry.list("telegram").items():
+        st.session_state.telegram_sessions.setdefault(session_id, {"running": False, "phone": meta.get("phone", "")})
 
 
 # --- Funciones de Utilidad ---
 
-def kill_process(pid):
-    """Mata un proceso y sus hijos por su PID."""
-    if not pid or not psutil.pid_exists(pid):
-        return
-    try:
-        process = psutil.Process(pid)
-        for child in process.children(recursive=True):
-            child.kill()
-        process.kill()
-        st.info(f"Proceso con PID {pid} detenido.")
-    except psutil.NoSuchProcess:
-        pass # El proceso ya no existía
-    except Exception as e:
-        st.warning(f"No se pudo detener el proceso con PID {pid}: {e}")
-
 # --- Funciones de Telegram (modificadas para multisesión) ---
 
-def check_telegram_auth_completed(session_id):
-    auth_file = get_telegram_session_files(session_id)["auth_status"]
-    if not os.path.exists(auth_file):
-        return None
-    with open(auth_file, "r") as f:
-        return f.read().strip()
+def submit_telegram_code(session_id, code):
+    """Envía el código de verificación al bot. Devuelve si el supervisor lo entregó."""
+    try:
+        get_supervisor().call("send", platform="telegram", session_id=session_id, message={"type": MESSAGE_CODE, "code": code})
+        return True
+    except (OSError, SupervisorError) as e:
+        st.error(f"No se pudo enviar el código a la sesión '{session_id}': {e}")
+        return False
 
-def check_telegram_needs_code(session_id):
-    return os.path.exists(get_telegram_session_files(session_id)["need_code"])
+def start_telegram_bot(session_id, phone, key, api_id, api_hash):
 
-def get_telegram_error(session_id):
-    error_file = get_telegram_session_files(session_id)["error"]
-    if os.path.exists(error_file):
-        with open(error_file, "r") as f:
-            return f.read().strip()
-    return None
+    # Guardar/Actualizar el número de teléfono en el registro
+    get_registry().upsert("telegram", session_id, phone=phone)
 
-def start_telegram_bot(session_id, phone, key, api_id, api_hash):
-    if st.session_state.telegram_sessions.get(session_id, {}).get("pid"):
-        kill_process(st.session_state.telegram_sessions[session_id]["pid"])
-
-    # Guardar/Actualizar el número de teléfono en la configuración
-    config = load_sessions_config()
-    if "telegram" not in config:
-        config["telegram"] = {}
-    config["telegram"][session_id] = {"phone": phone}
-    save_sessions_config(config)
-
-    telegram_env = os.environ.copy()
-    telegram_env.update({
+    # Solo las variables propias de la sesión; el supervisor aporta el resto del entorno
+    telegram_env = {
         "PHONE_NUMBER": phone, 
         "OPENAI_API_KEY": key, 
         "API_ID": api_id, 
-        "API_HASH": api_hash,
-        "SESSION_ID": session_id,
-        "PYTHONUNBUFFERED": "1"
-    })
-    process = subprocess.Popen([sys.executable, os.path.join(BOTS_DIR, "telegram.py")], env=telegram_env)
-    
+        "API_HASH": api_hash
+    }
+    try:
+        info = get_supervisor().call("start", platform="telegram", session_id=session_id, env=telegram_env)
+    except (OSError, SupervisorError) as e:
+        st.error(f"No se pudo iniciar la sesión de Telegram '{session_id}': {e}")
+        return
+
     st.session_state.telegram_sessions[session_id] = {
-        "pid": process.pid,
+        "pid": info.get("pid"),
         "running": True,
         "phone": phone
     }
-    st.info(f"Iniciando sesión de Telegram '{session_id}' con PID: {process.pid}")
+    st.info(f"Iniciando sesión de Telegram '{session_id}' con PID: {info.get('pid')}")
 
 def clear_telegram_auth(session_id):
-    files_to_delete = get_telegram_session_files(session_id).values()
-    for f in files_to_delete:
-        if os.path.exists(f):
-            os.remove(f)
-    
-    # Eliminar de la configuración
-    config = load_sessions_config()
-    if config.get("telegram", {}).get(session_id):
-        del config["telegram"][session_id]
-        save_sessions_config(config)
+    remove_session("telegram", session_id)
+    # Elimina la sesión del registro junto con su directorio (sesión de Telethon y memoria del agente)
+    get_registry().remove("telegram", session_id)
 
     st.info(f"Sesión de Telegram '{session_id}' limpiada.")
 
 
 # --- Funciones de WhatsApp (modificadas para multisesión) ---
 
-def check_whatsapp_auth_completed(session_id):
-    auth_file = get_whatsapp_auth_status_file(session_id)
-    if not os.path.exists(auth_file):
-        return None
-    with open(auth_file, "r") as f:
-        return f.read().strip()
-
-def get_whatsapp_qr_data_url(session_id):
-    qr_file = get_whatsapp_qr_data_url_file(session_id)
-    if os.path.exists(qr_file):
-        with open(qr_file, "r", encoding="utf-8") as f:
-            return f.read().strip()
-    return None
-
 def start_whatsapp_bot(session_id, key, email):
-    # Asegurarse de que no haya otro proceso con el mismo session_id
-    if st.session_state.whatsapp_sessions.get(session_id, {}).get("pid"):
-        kill_process(st.session_state.whatsapp_sessions[session_id]["pid"])
-
-    whatsapp_env = os.environ.copy()
-    whatsapp_env.update({
-        "OPENAI_API_KEY": key,
-        "SESSION_ID": session_id,
-        "PYTHONUNBUFFERED": "1"
-    })
+    get_registry().upsert("whatsapp", session_id, email=email)
+    # El supervisor detiene antes cualquier proceso previo con el mismo session_id
+    whatsapp_env = {"OPENAI_API_KEY": key}
     if email:
         whatsapp_env["WHATSAPP_QR_EMAIL"] = email
     if os.getenv("PUPPETEER_EXECUTABLE_PATH"):
         whatsapp_env["PUPPETEER_EXECUTABLE_PATH"] = os.getenv("PUPPETEER_EXECUTABLE_PATH")
     
-    # Usar stdbuf para forzar la salida sin búfer para Node.js
-    command = ["stdbuf", "-o0", "node", os.path.join(BOTS_DIR, "whatsapp.js")]
-    process = subprocess.Popen(command, env=whatsapp_env)
-    
+    try:
+        info = get_supervisor().call("start", platform="whatsapp", session_id=session_id, env=whatsapp_env)
+    except (OSError, SupervisorError) as e:
+        st.error(f"No se pudo iniciar la sesión de WhatsApp '{session_id}': {e}")
+        return
+
     st.session_state.whatsapp_sessions[session_id] = {
-        "pid": process.pid,
+        "pid": info.get("pid"),
         "running": True,
         "email": email
     }
-    st.info(f"Iniciando sesión de WhatsApp '{session_id}' con PID: {process.pid}")
+    st.info(f"Iniciando sesión de WhatsApp '{session_id}' con PID: {info.get('pid')}")
 
 def clear_whatsapp_auth(session_id):
-    auth_status_file = get_whatsapp_auth_status_file(session_id)
-    qr_file = get_whatsapp_qr_data_url_file(session_id)
-    session_dir = get_whatsapp_session_dir(session_id)
-
-    if os.path.exists(auth_status_file): os.remove(auth_status_file)
-    if os.path.exists(qr_file): os.remove(qr_file)
+    remove_session("whatsapp", session_id)
+    get_registry().remove("whatsapp", session_id, delete_data=False)
+    whatsapp_dir = session_dir(DATA_PATH, "whatsapp", session_id)
     # Usar 'rm -rf' a través de subprocess para un borrado más robusto que shutil.rmtree
-    if os.path.isdir(session_dir):
+    if os.path.isdir(whatsapp_dir):
         try:
-            subprocess.run(["rm", "-rf", session_dir], check=True)
+            subprocess.run(["rm", "-rf", whatsapp_dir], check=True)
         except subprocess.CalledProcessError as e:
             st.error(f"Error al limpiar el directorio de sesión: {e}")
     st.info(f"Sesión de WhatsApp '{session_id}' limpiada.")
 
 
+# --- Visualización de Estado ---
+# Fragmentos que se refrescan solos leyendo el estado en memoria del canal, sin bloquear
+# el resto del panel ni volver a ejecutar el script completo.
+
+def render_process_status(info):
+    """Avisos del supervisor: reinicios pendientes y motivo de la última caída."""
+    if info.get("supervisor_error"):
+        st.error(f"❌ Supervisor no disponible: {info['supervisor_error']}")
+    elif info.get("state") == STATE_BACKOFF:
+        st.warning(f"🔁 El bot se cayó ({info.get('last_reason')}). Reinicio en {info.get('next_start_in') or 0:.0f}s...")
+    elif info.get("restarts"):
+        st.caption(f"Reinicios: {info['restarts']} · último motivo: {info.get('last_reason')}")
+
+def _format_latency(summary):
+    """p50 / p95 en milisegundos de un resumen de botengine/session_metrics.py."""
+    if not summary or summary.get("p50") is None:
+        return "—"
+    return f"{summary['p50'] * 1000:.0f} / {summary['p95'] * 1000:.0f} ms"
+
+def render_resource_metrics(info):
+    """Recursos del proceso (muestreados por el supervisor) y carga de trabajo (publicada por el bot)."""
+    if info.get("state") != STATE_RUNNING:
+        return
+    metrics = info["status"].get(STATUS_METRICS) or {}
+    shared = " (proceso host compartido)" if info.get("hosted") else ""
+    cols = st.columns(4)
+    cols[0].metric("CPU" + shared, f"{info.get('cpu_percent', 0):.0f}%")
+    cols[1].metric("RSS", f"{info.get('rss_mb', 0):.0f} MB")
+    cols[2].metric("Descriptores", info.get("num_fds", 0))
+    cols[3].metric("Hilos", info.get("num_threads", 0))
+    cols = st.columns(4)
+    cols[0].metric("Mensajes/s", f"{metrics.get('messages_per_second', 0):.2f}")
+    cols[1].metric("Manejador p50/p95", _format_latency(metrics.get("handler")))
+    cols[2].metric("Phishing p50/p95", _format_latency(metrics.get("phishing")))
+    cols[3].metric("LLM p50/p95", _format_latency(metrics.get("llm")))
+    samples = info.get("samples") or []
+    if len(samples) > 1:
+        with st.expander("Histórico de recursos"):
+            left, right = st.columns(2)
+            left.line_chart({"CPU %": [s[1] for s in samples]}, height=150)
+            right.line_chart({"RSS MB": [s[2] for s in samples]}, height=150)
+
+def render_startup_time(info):
+    """Tiempo desde que el supervisor lanzó la sesión hasta que el bot quedó listo para responder."""
+    startup = info["status"].get(STATUS_STARTUP) or {}
+    started_at = info.get("started_at")
+    if not startup.get("ready_at"):
+        return
+    if started_at and startup["ready_at"] >= started_at:
+        ready = startup["ready_at"] - started_at
+    else:
+        ready = startup.get("ready_seconds") or 0
+    details = []
+    if startup.get("auth_seconds") is not None:
+        details.append(f"autenticación {startup['auth_seconds']:.1f}s")
+    if startup.get("agent_seconds") is not None:
+        details.append(f"agente {startup['agent_seconds']:.1f}s")
+    suffix = f" ({', '.join(details)})" if details else ""
+    st.caption(f"⏱️ Listo en {ready:.1f}s{suffix}")
+
+@st.fragment(run_every=PANEL_STATUS_REFRESH)
+def render_whatsapp_status(session_id):
+    info = get_session_status("whatsapp", session_id)
+    render_process_status(info)
+    auth_status = info["status"].get(STATUS_AUTH)
+    if auth_status == AUTH_AUTHENTICATED:
+        st.success("✅ Listo y operativo.")
+        render_startup_time(info)
+        render_resource_metrics(info)
+    elif auth_status == AUTH_CONNECTED:
+        st.info("🤖 Conectado, cargando agente...")
+    else:
+        qr_url = info["status"].get(STATUS_QR)
+        if qr_url:
+            st.image(qr_url, caption=f"Escanea para conectar '{session_id}'")
+        else:
+            st.info("Iniciando y esperando QR...")
+
+@st.fragment(run_every=PANEL_STATUS_REFRESH)
+def render_telegram_status(session_id):
+    info = get_session_status("telegram", session_id)
+    render_process_status(info)
+    error = info["status"].get(STATUS_ERROR)
+    auth_status = info["status"].get(STATUS_AUTH)
+    needs_code = bool(info["status"].get(STATUS_NEEDS_CODE))
+    if error:
+        st.error(f"❌ Error: {error}")
+    if auth_status == AUTH_AUTHENTICATED:
+        st.success("✅ Listo y operativo.")
+        render_startup_time(info)
+        render_resource_metrics(info)
+    elif auth_status == AUTH_CONNECTED:
+        st.info("🤖 Conectado, cargando agente...")
+    elif needs_code:
+        # Tras un código incorrecto el bot sigue esperando, así que se muestra el error y el campo
+        st.warning("📱 Se necesita código.")
+        code = st.text_input("Introduce el código", key=f"tg_code_{session_id}")
+        if st.button("Enviar Código", key=f"submit_tg_code_{session_id}"):
+            if submit_telegram_code(session_id, code):
+                st.info("Código enviado...")
+    elif not error:
+        st.info("Iniciando y conectando...")
+
+
 # --- Interfaz de Streamlit ---
 
 st.set_page_config(page_title="BotEngine Control 🤖", layout="wide", page_icon=":robot_face:")
@@ -230,9 +282,11 @@ st.title("Panel de Control de BotEngine 🤖 ")
 # Inicializar estado de sesión
 if 'telegram_sessions' not in st.session_state: st.session_state.telegram_sessions = {}
 if 'whatsapp_sessions' not in st.session_state: st.session_state.whatsapp_sessions = {}
-if 'sessions_discovered' not in st.session_state:
-    discover_sessions()
-    st.session_state.sessions_discovered = True
+# El registro solo se relee si cambió el índice, así que se puede consultar en cada ejecución
+discover_sessions()
+# El supervisor es la fuente de verdad de qué sesiones están en ejecución
+sync_sessions("whatsapp", st.session_state.whatsapp_sessions)
+sync_sessions("telegram", st.session_state.telegram_sessions)
 
 
 # --- Credenciales Globales ---
@@ -284,32 +338,17 @@ else:
                 col1, col2 = st.columns(2)
                 with col1:
                     if st.button(f"Detener", key=f"stop_wa_{session_id}"):
-                        kill_process(session_data.get("pid"))
+                        stop_session("whatsapp", session_id)
                         st.session_state.whatsapp_sessions[session_id]["running"] = False
                         st.rerun()
                 with col2:
                     if st.button(f"Limpiar", key=f"clear_wa_{session_id}"):
-                        kill_process(session_data.get("pid"))
                         clear_whatsapp_auth(session_id)
                         del st.session_state.whatsapp_sessions[session_id]
                         st.rerun()
 
                 # --- Visualización de estado ---
-                auth_status = check_whatsapp_auth_completed(session_id)
-                if auth_status == AUTH_AUTHENTICATED:
-                    st.success("✅ Listo y operativo.")
-                elif auth_status == AUTH_CONNECTED:
-                    st.info("🤖 Conectado, cargando agente...")
-                    time.sleep(3)
-                    st.rerun()
-                else:
-                    qr_url = get_whatsapp_qr_data_url(session_id)
-                    if qr_url:
-                        st.image(qr_url, caption=f"Escanea para conectar '{session_id}'")
-                    else:
-                        st.info("Iniciando y esperando QR...")
-                    time.sleep(3) # Dar tiempo a que el QR se genere
-                    st.rerun()
+                render_whatsapp_status(session_id)
 
             else:
                 st.warning("Sesión detenida.")
@@ -363,41 +402,17 @@ else:
                 col1_tg, col2_tg = st.columns(2)
                 with col1_tg:
                     if st.button("Detener", key=f"stop_tg_{session_id}"):
-                        kill_process(session_data.get("pid"))
+                        stop_session("telegram", session_id)
                         st.session_state.telegram_sessions[session_id]["running"] = False
                         st.rerun()
                 with col2_tg:
                     if st.button("Limpiar", key=f"clear_tg_{session_id}"):
-                        kill_process(session_data.get("pid"))
                         clear_telegram_auth(session_id)
                         del st.session_state.telegram_sessions[session_id]
                         st.rerun()
 
                 # --- Visualización de estado ---
-                error = get_telegram_error(session_id)
-                auth_status = check_telegram_auth_completed(session_id)
-                if error:
-                    st.error(f"❌ Error: {error}")
-                elif auth_status == AUTH_AUTHENTICATED:
-                    st.success("✅ Listo y operativo.")
-                elif auth_status == AUTH_CONNECTED:
-                    st.info("🤖 Conectado, cargando agente...")
-                    time.sleep(3)
-                    st.rerun()
-                elif check_telegram_needs_code(session_id):
-                    st.warning("📱 Se necesita código.")
-                    code = st.text_input("Introduce el código", key=f"tg_code_{session_id}")
-                    if st.button("Enviar Código", key=f"submit_tg_code_{session_id}"):
-                        code_file = get_telegram_session_files(session_id)["code"]
-                        with open(code_file, "w") as f:
-                            f.write(code)
-                        st.info("Código enviado...")
-                        time.sleep(5)
-                        st.rerun()
-                else:
-                    st.info("Iniciando y conectando...")
-                    time.sleep(3)
-                    st.rerun()
+                render_telegram_status(session_id)
 
             else:
                 st.warning("Sesión detenida.")